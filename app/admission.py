@@ -0,0 +1,273 @@
+"""
+Admission control for the transform endpoints.
+
+Requests are sorted into endpoint classes (single point GETs, batch POSTs
+and observatory positions). Each class has a concurrency limit measured in
+cost units and a cap on the number of requests waiting for capacity. Single
+point requests cost 1 unit. Batch requests cost 1 unit plus 1 for every
+ADMISSION_BYTES_PER_UNIT bytes of request body, so a 100k point batch takes
+most of the batch class's capacity, but never any capacity from single
+point requests. Batch bodies sent without a Content-Length take the class's
+whole capacity. Streaming requests cost 1 unit, which they give back and
+queue for again after every ADMISSION_BYTES_PER_UNIT bytes of body, so a
+long stream takes turns with the requests waiting behind it.
+
+When a class's queue is full, requests are rejected right away with 429.
+Requests which wait longer than ADMISSION_TIMEOUT seconds are rejected
+with 503. Both responses include a Retry-After header.
+"""
+
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Set to 1 to enable admission control
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "0") == "1"
+# Default (concurrency, queue) of each endpoint class. Each one can be
+# overridden with ADMISSION_<CLASS>_CONCURRENCY and ADMISSION_<CLASS>_QUEUE
+DEFAULT_LIMITS = {"point": (8, 64), "batch": (8, 16), "position": (4, 16)}
+# Request body bytes per batch cost unit, roughly 1000 JSON coordinates
+ADMISSION_BYTES_PER_UNIT = int(os.environ.get("ADMISSION_BYTES_PER_UNIT", 50000))
+# Seconds a request may wait for capacity before it is rejected
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", 10))
+# Value of the Retry-After header sent with rejected requests, in seconds
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+
+
+def get_limits() -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the (concurrency, queue) of each endpoint class
+    """
+    return {
+        name: (
+            int(os.environ.get(f"ADMISSION_{name.upper()}_CONCURRENCY", concurrency)),
+            int(os.environ.get(f"ADMISSION_{name.upper()}_QUEUE", queue)),
+        )
+        for name, (concurrency, queue) in DEFAULT_LIMITS.items()
+    }
+
+
+class Rejected(Exception):
+    """
+    Raised when a request can't be admitted
+    """
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class CostLimiter:
+    """
+    First in, first out limiter for requests which use a varying number of
+    cost units. Must only be used from the event loop.
+
+    Parameters
+    ----------
+    capacity: int
+        Cost units which may be in use at once
+    queue: int
+        Maximum number of requests waiting for capacity
+    """
+
+    def __init__(self, capacity: int, queue: int):
+        self.capacity = capacity
+        self.queue = queue
+        self.in_use = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self, cost: int, timeout: Optional[float]) -> int:
+        """
+        Waits until cost units are available and takes them. Costs over the
+        capacity are reduced to the capacity. Returns the cost taken, which
+        must be passed to release.
+
+        Raises Rejected with 429 if the queue is full, or 503 if the units
+        aren't available within timeout seconds. With a timeout of None the
+        request waits as long as it takes, even if the queue is full. This
+        is used by requests which were already admitted.
+        """
+        cost = max(1, min(cost, self.capacity))
+        if not self._waiters and self.in_use + cost <= self.capacity:
+            self.in_use += cost
+            return cost
+        if timeout is not None and len(self._waiters) >= self.queue:
+            raise Rejected(429, "Too many requests, try again later")
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (cost, waiter)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # Cancelled while waiting, i.e. the client went away
+            self._abandon(entry)
+            raise
+        if waiter.done():
+            return cost
+        self._abandon(entry)
+        raise Rejected(503, "Server is busy, try again later")
+
+    def _abandon(self, entry: tuple):
+        """
+        Removes a waiting request, giving back its units if it was
+        admitted in the meantime
+        """
+        cost, waiter = entry
+        if waiter.done():
+            self.release(cost)
+        else:
+            waiter.cancel()
+            self._waiters.remove(entry)
+            # Requests behind this one may fit now
+            self._wake()
+
+    def release(self, cost: int):
+        """
+        Returns cost units taken by acquire
+        """
+        self.in_use -= cost
+        self._wake()
+
+    def _wake(self):
+        """
+        Admits waiting requests in order while they fit
+        """
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            cost, waiter = self._waiters.popleft()
+            self.in_use += cost
+            waiter.set_result(None)
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """
+    Returns the endpoint class of a request, or None if it isn't limited
+    """
+    if method == "GET" and path in ("/hpc", "/hgs2hpc"):
+        return "point"
+    if method == "POST" and path.split("/")[1] in ("hpc", "hgs2hpc", "gse2frame"):
+        return "batch"
+    if method == "GET" and path.startswith("/position/"):
+        return "position"
+    if method == "POST" and path == "/positions":
+        return "position"
+    return None
+
+
+def is_stream(path: str) -> bool:
+    """
+    Returns True for the streaming NDJSON endpoints, see streaming.py
+    """
+    return path.endswith("/stream")
+
+
+def estimate_cost(
+    endpoint_class: str, headers: Dict[bytes, bytes], path: str = ""
+) -> Optional[int]:
+    """
+    Estimates the cost of a request from its batch size. The request body
+    hasn't been read yet, so the size comes from Content-Length. Returns
+    None when the size isn't known, such requests are charged the class's
+    whole capacity. Streaming requests cost 1 unit for each
+    ADMISSION_BYTES_PER_UNIT bytes, which is charged while they are read.
+    """
+    if endpoint_class != "batch" or is_stream(path):
+        return 1
+    length = headers.get(b"content-length")
+    if length is None or not length.isdigit():
+        return None
+    return 1 + int(length) // ADMISSION_BYTES_PER_UNIT
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware which applies admission control per endpoint class
+
+    Parameters
+    ----------
+    app:
+        ASGI application to protect
+    limits: Dict[str, Tuple[int, int]]
+        (concurrency, queue) of each endpoint class, see get_limits
+    """
+
+    def __init__(self, app, limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.app = app
+        self.limiters = {
+            name: CostLimiter(concurrency, queue)
+            for name, (concurrency, queue) in (limits or get_limits()).items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        endpoint_class = None
+        if scope["type"] == "http":
+            endpoint_class = classify(scope["method"], scope["path"])
+        if endpoint_class not in self.limiters:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[endpoint_class]
+        cost = estimate_cost(endpoint_class, dict(scope["headers"]), scope["path"])
+        if cost is None:
+            cost = limiter.capacity
+        try:
+            cost = await limiter.acquire(cost, ADMISSION_TIMEOUT)
+        except Rejected as e:
+            await _reject(send, e)
+            return
+        # Units held by the request, taken again by streaming requests
+        held = [cost]
+        if endpoint_class == "batch" and is_stream(scope["path"]):
+            receive = _turn_taking_receive(receive, limiter, held)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(held[0])
+
+
+def _turn_taking_receive(receive, limiter: CostLimiter, held: List[int]):
+    """
+    Wraps receive so the request gives back its units and waits for them
+    again after every ADMISSION_BYTES_PER_UNIT bytes of body. held[0] is
+    the number of units held, 0 while waiting.
+    """
+    received = 0
+
+    async def wrapped():
+        nonlocal received
+        if received >= ADMISSION_BYTES_PER_UNIT:
+            received = 0
+            cost = held[0]
+            limiter.release(cost)
+            held[0] = 0
+            held[0] = await limiter.acquire(cost, None)
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+        return message
+
+    return wrapped
+
+
+async def _reject(send, rejection: Rejected):
+    """
+    Sends a JSON error response for a rejected request
+    """
+    body = json.dumps({"detail": rejection.detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": rejection.status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,71 @@
+"""
+Compares latency and throughput of concurrent single point GET /hpc
+requests with request coalescing off and on.
+
+Run from the app directory with
+
+    python -m benchmarks.coalesce --clients 32 --requests 10 --window 5
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+import coalesce
+from main import app
+
+
+async def _run(clients: int, requests: int) -> tuple:
+    """
+    Runs clients concurrent loops of sequential requests and returns
+    (latencies in seconds, total elapsed seconds)
+    """
+    rng = np.random.default_rng(0)
+    latencies = []
+
+    async def client_loop(client: httpx.AsyncClient):
+        for _ in range(requests):
+            x, y = rng.uniform(-900, 900, 2)
+            hour = rng.integers(0, 13)
+            start = time.perf_counter()
+            response = await client.get(
+                f"/hpc?x={x}&y={y}&coord_time=2012-07-05 {hour:02d}:00:00&target=2012-07-05 13:00:00"
+            )
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test", timeout=None
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+    return np.array(latencies), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--window", type=float, default=5, help="milliseconds")
+    args = parser.parse_args()
+
+    # Warm up frame caches and imports
+    asyncio.run(_run(1, 2))
+    for window in [0, args.window]:
+        coalesce.COALESCE_WINDOW = window
+        latencies, elapsed = asyncio.run(_run(args.clients, args.requests))
+        print(
+            f"window {window:5.1f} ms: "
+            f"p50 {np.percentile(latencies, 50) * 1e3:8.1f} ms, "
+            f"p99 {np.percentile(latencies, 99) * 1e3:8.1f} ms, "
+            f"{len(latencies) / elapsed:7.1f} requests/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
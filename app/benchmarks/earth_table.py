@@ -0,0 +1,59 @@
+"""
+Compares building Earth observer frames with sunpy against the precomputed
+earth ephemeris table.
+
+Run from the app directory with
+
+    python -m benchmarks.earth_table
+"""
+
+import argparse
+import time
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from sunpy.coordinates.frames import Helioprojective
+
+import frames
+
+
+def _time(fn, repeat: int) -> float:
+    """
+    Returns the mean run time of fn in seconds
+    """
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for size in [1, 100, 10000]:
+        times = Time("2012-07-05 13:01:46") + np.arange(size) * 17 * u.min
+        if size == 1:
+            times = times[0]
+
+        def build():
+            return Helioprojective(
+                observer=frames.get_earth_observer(times), obstime=times
+            )
+
+        frames.USE_EARTH_TABLE = False
+        sunpy_time = _time(build, args.repeat)
+        frames.USE_EARTH_TABLE = True
+        table_time = _time(build, args.repeat)
+        print(
+            f"{size:>6} times: sunpy {sunpy_time * 1e3:8.3f} ms, "
+            f"table {table_time * 1e3:8.3f} ms, "
+            f"speedup {sunpy_time / table_time:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+End to end load test.
+
+Sends a weighted mix of requests to the app and reports throughput, error
+rate and p50/p95/p99 latency for each kind of request. By default the app
+runs in this process through httpx's ASGI transport, with JPL Horizons
+replaced by a local stand-in. Pass --url to load test a running server,
+i.e. one started with `python -m uvicorn main:app --port 8000`.
+
+Requests are sent by --concurrency clients which each wait for their
+previous response (closed loop), or at a fixed --rate per second whatever
+the response times are (open loop). With --rate, latency is measured from
+when each request was scheduled, so time spent queued behind slow requests
+counts.
+
+Run from the app directory with
+
+    python -m benchmarks.load --duration 30 --concurrency 16
+    python -m benchmarks.load --mix hpc=10,hpc_batch=1 --rate 50 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+# Default weight of each kind of request
+MIX = {
+    "hpc": 40,
+    "hgs2hpc": 40,
+    "hpc_batch": 3,
+    "hgs2hpc_batch": 3,
+    "gse_batch": 2,
+    "position": 12,
+}
+
+TARGET = "2020-01-01T00:00:00"
+
+
+def _coord_time(rng) -> str:
+    """
+    Returns one of the 24 hours before TARGET, so caches see some reuse
+    """
+    return f"2019-12-31T{rng.integers(0, 24):02d}:00:00"
+
+
+def _requests(batch_size: int, observatory: str) -> Dict[str, Callable]:
+    """
+    Returns a function for each kind of request which takes a random
+    generator and returns (method, url, json body)
+    """
+
+    def hpc(rng):
+        x, y = rng.uniform(-1200, 1200, 2)
+        return "GET", f"/hpc?x={x}&y={y}&coord_time={_coord_time(rng)}", None
+
+    def hgs2hpc(rng):
+        lat, lon = rng.uniform(-80, 80), rng.uniform(-90, 90)
+        query = f"lat={lat}&lon={lon}&coord_time={_coord_time(rng)}&target={TARGET}"
+        return "GET", f"/hgs2hpc?{query}", None
+
+    def hpc_batch(rng):
+        coordinates = [
+            {"x": x, "y": y, "coord_time": _coord_time(rng)}
+            for x, y in rng.uniform(-1200, 1200, (batch_size, 2)).tolist()
+        ]
+        return "POST", "/hpc", {"coordinates": coordinates, "target": TARGET}
+
+    def hgs2hpc_batch(rng):
+        coordinates = [
+            {"lat": lat, "lon": lon, "coord_time": _coord_time(rng)}
+            for lat, lon in rng.uniform(-80, 80, (batch_size, 2)).tolist()
+        ]
+        return "POST", "/hgs2hpc", {"coordinates": coordinates, "target": TARGET}
+
+    def gse_batch(rng):
+        coordinates = [
+            {"x": x, "y": y, "z": z, "time": _coord_time(rng)}
+            for x, y, z in rng.uniform(-1e6, 1e6, (batch_size, 3)).tolist()
+        ]
+        return "POST", "/gse2frame", {"coordinates": coordinates}
+
+    def position(rng):
+        day = rng.integers(1, 29)
+        query = f"start=2024-02-{day:02d}T00:00:00&stop=2024-02-{day:02d}T12:00:00"
+        return "GET", f"/position/{observatory}?{query}", None
+
+    return {
+        "hpc": hpc,
+        "hgs2hpc": hgs2hpc,
+        "hpc_batch": hpc_batch,
+        "hgs2hpc_batch": hgs2hpc_batch,
+        "gse_batch": gse_batch,
+        "position": position,
+    }
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parses "name=weight,name=weight" into a dict
+    """
+    mix = {}
+    for item in text.split(","):
+        name, weight = item.split("=")
+        if name not in MIX:
+            raise SystemExit(f"Unknown request kind {name}, use one of {list(MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Recorder:
+    """
+    Collects the latency and outcome of every request by kind
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, kind: str, latency: float, error: Optional[str]):
+        self.latencies.setdefault(kind, []).append(latency)
+        errors = self.errors.setdefault(kind, {})
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        """
+        Returns count, throughput, error rate and latency percentiles (in
+        milliseconds) for each kind of request and for all of them together
+        """
+        results = {}
+        every = []
+        for kind, latencies in sorted(self.latencies.items()):
+            every.extend(latencies)
+            results[kind] = _stats(latencies, self.errors[kind], elapsed)
+        errors: Dict[str, int] = {}
+        for kind_errors in self.errors.values():
+            for error, count in kind_errors.items():
+                errors[error] = errors.get(error, 0) + count
+        results["all"] = _stats(every, errors, elapsed)
+        return results
+
+
+def _stats(latencies: List[float], errors: Dict[str, int], elapsed: float) -> dict:
+    latencies_ms = np.array(latencies) * 1e3
+    failed = sum(errors.values())
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "error_rate": failed / len(latencies),
+        "errors": errors,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    kind: str,
+    request: Tuple[str, str, Optional[dict]],
+    start: float,
+):
+    """
+    Sends one request and records its latency from start
+    """
+    method, url, body = request
+    error = None
+    try:
+        response = await client.request(method, url, json=body)
+        if response.status_code >= 400:
+            error = str(response.status_code)
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    recorder.record(kind, time.perf_counter() - start, error)
+
+
+async def _run(client: httpx.AsyncClient, args, mix: Dict[str, float]) -> tuple:
+    """
+    Runs the load test and returns (recorder, elapsed seconds)
+    """
+    rng = np.random.default_rng(args.seed)
+    requests = _requests(args.batch_size, args.observatory)
+    kinds = list(mix)
+    weights = np.array([mix[kind] for kind in kinds])
+    weights = weights / weights.sum()
+    recorder = Recorder()
+
+    def next_request():
+        kind = kinds[rng.choice(len(kinds), p=weights)]
+        return kind, requests[kind](rng)
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    if args.rate:
+        # Open loop, one request every 1 / rate seconds
+        tasks = []
+        scheduled = start
+        while scheduled < deadline:
+            await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+            kind, request = next_request()
+            tasks.append(
+                asyncio.create_task(_send(client, recorder, kind, request, scheduled))
+            )
+            scheduled += 1 / args.rate
+        await asyncio.gather(*tasks)
+    else:
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                kind, request = next_request()
+                await _send(client, recorder, kind, request, time.perf_counter())
+
+        await asyncio.gather(*[client_loop() for _ in range(args.concurrency)])
+    return recorder, time.perf_counter() - start
+
+
+async def _main(args, mix: Dict[str, float]) -> Tuple[Recorder, float]:
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100))
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=None, limits=limits)
+    else:
+        from ephemeris import EphemerisCache, set_cache
+        from main import app
+        from sunpy.coordinates import get_earth
+
+        # Stand-in for JPL Horizons, so the in process test runs offline
+        set_cache(
+            EphemerisCache(tempfile.mkdtemp(), lambda name, times: get_earth(times))
+        )
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://test",
+            timeout=None,
+        )
+    async with client:
+        if args.warmup:
+            # One request of each kind, so startup costs aren't counted
+            warmup = Recorder()
+            rng = np.random.default_rng(args.seed)
+            for request in _requests(args.batch_size, args.observatory).values():
+                await _send(client, warmup, "warmup", request(rng), 0)
+        return await _run(client, args, mix)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="server to test, defaults to the app in process")
+    parser.add_argument(
+        "--mix",
+        default=",".join(f"{name}={weight}" for name, weight in MIX.items()),
+        help="comma separated name=weight of each kind of request",
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--rate", type=float, help="requests per second, enables the open loop"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--observatory", default="SDO")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-warmup", dest="warmup", action="store_false", help="skip the warm-up"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    mix = _parse_mix(args.mix)
+    recorder, elapsed = asyncio.run(_main(args, mix))
+    results = recorder.summary(elapsed)
+
+    print(
+        f"{'request':<14} {'count':>7} {'req/s':>8} {'errors':>7} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    )
+    for kind, stats in results.items():
+        print(
+            f"{kind:<14} {stats['count']:>7} {stats['throughput']:>8.1f} "
+            f"{stats['error_rate']:>7.1%} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}"
+        )
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "config": {**config, "mix": mix},
+                    "elapsed": elapsed,
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+            fp.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures batch throughput of the sunpy engine as the number of pool workers
+grows. Worker count 1 runs the whole batch in this process.
+
+Run from the app directory with
+
+    python -m benchmarks.pool --size 20000
+"""
+
+import argparse
+import os
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+
+from benchmarks.earth_table import _time
+import pool
+from normalizer import normalize_hpc_columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - rng.uniform(0, 24, args.size) * u.hour
+    xs = rng.uniform(-1200, 1200, args.size)
+    ys = rng.uniform(-1200, 1200, args.size)
+
+    pool.POOL_MIN_BATCH = 0
+    workers = 1
+    baseline = None
+    while workers <= args.max_workers:
+        pool.shutdown()
+        pool.POOL_WORKERS = workers
+        if workers > 1:
+            # Start the workers before timing
+            pool.get_pool()
+        elapsed = _time(
+            lambda: normalize_hpc_columns(xs, ys, coord_times, target, "sunpy"),
+            args.repeat,
+        )
+        baseline = baseline or elapsed
+        print(
+            f"{workers:>3} workers: {elapsed * 1e3:9.1f} ms, "
+            f"{args.size / elapsed:10.0f} points/s, "
+            f"speedup {baseline / elapsed:5.2f}x"
+        )
+        workers *= 2
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares the sunpy and numpy engines for normalize_hpc and hgs2hpc batches.
+
+Run from the app directory with
+
+    python -m benchmarks.rotation
+"""
+
+import argparse
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+
+from benchmarks.earth_table import _time
+from hgs2hpc import hgs2hpc_columns
+from normalizer import normalize_hpc_columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    target = Time("2020-01-01 00:00:00")
+    for size in [1, 100, 10000]:
+        coord_times = target - rng.uniform(0, 24, size) * u.hour
+        hpc = (rng.uniform(-1200, 1200, size), rng.uniform(-1200, 1200, size))
+        hgs = (rng.uniform(-60, 60, size), rng.uniform(-80, 80, size))
+        for name, fn, (xs, ys) in [
+            ("hpc", normalize_hpc_columns, hpc),
+            ("hgs2hpc", hgs2hpc_columns, hgs),
+        ]:
+            sunpy_time = _time(
+                lambda: fn(xs, ys, coord_times, target, "sunpy"),
+                args.repeat,
+            )
+            numpy_time = _time(
+                lambda: fn(xs, ys, coord_times, target, "numpy"),
+                args.repeat,
+            )
+            print(
+                f"{name:>7} {size:>6} points: sunpy {sunpy_time * 1e3:8.3f} ms, "
+                f"numpy {numpy_time * 1e3:8.3f} ms, "
+                f"speedup {sunpy_time / numpy_time:6.1f}x"
+            )
+        grid_time = _time(
+            lambda: hgs2hpc_columns(*hgs, coord_times, target, "grid"),
+            args.repeat,
+        )
+        print(f"{'grid':>7} {size:>6} points: {grid_time * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
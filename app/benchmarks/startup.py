@@ -0,0 +1,97 @@
+"""
+Measures cold start time: how long `import main` takes, how long a freshly
+started uvicorn server takes to answer GET /health-check and to report
+ready on GET /ready, and the latency of the first GET /hpc request sent
+once it is ready, with STARTUP_WARMUP off and on.
+
+Run from the app directory with
+
+    python -m benchmarks.startup --repeat 3
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+QUERY = "/hpc?x=515&y=-342&coord_time=2012-07-05 13:01:46&target=2012-07-05 14:00:00"
+
+
+def _import_time() -> float:
+    """
+    Returns the seconds taken to import main in a new interpreter
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], check=True)
+    return time.perf_counter() - start
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(warmup: bool) -> tuple:
+    """
+    Starts a server and returns the seconds until it answers
+    GET /health-check, the seconds until GET /ready returns 200 and the
+    latency of the first GET /hpc request sent after that
+    """
+    port = _free_port()
+    env = {**os.environ, "STARTUP_WARMUP": "1" if warmup else "0"}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    live = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError("Server exited during startup")
+                try:
+                    if live is None and client.get("/health-check").is_success:
+                        live = time.perf_counter() - start
+                    if live is not None and client.get("/ready").is_success:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            ready = time.perf_counter() - start
+            sent = time.perf_counter()
+            client.get(QUERY).raise_for_status()
+            latency = time.perf_counter() - sent
+    finally:
+        server.terminate()
+        server.wait()
+    return live, ready, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    imports = [_import_time() for _ in range(args.repeat)]
+    print(f"import main: {np.median(imports):.2f} s")
+    for warmup in [False, True]:
+        runs = np.array([_start_server(warmup) for _ in range(args.repeat)])
+        live, ready, latency = np.median(runs, axis=0)
+        print(
+            f"STARTUP_WARMUP={int(warmup)}: live {live:.2f} s, ready {ready:.2f} s, "
+            f"first request after ready {latency * 1e3:.0f} ms, "
+            f"first successful request {ready + latency:.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Regression benchmarks for the coordinate transform functions.
+
+Measures throughput (points per second) and peak traced memory of hgs2hpc,
+hgs2hpc_batch, normalize_hpc, normalize_hpc_batch, gse_frame,
+gse_frame_batch and jsonify_skycoord. It sweeps batch size, the number of
+distinct coord_times in a batch (capped at the batch size, "all" for one
+per point), and points on or off the disk (for hgs2hpc, points on the
+visible or far side). Scalar functions are called once per point and only
+run up to SCALAR_MAX_SIZE points. Observatory positions come from a local
+stand-in for JPL Horizons, so the suite runs offline.
+
+Results are compared with the baseline in benchmarks/baseline.json. The
+command exits with status 1 if any case's throughput dropped, or its peak
+memory grew, by more than --threshold. Save a new baseline on the machine
+that runs the comparison with --save.
+
+Run from the app directory with
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --sizes 1,100,10000 --distinct 1,all --save
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, Iterator, Tuple
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from sunpy.coordinates import get_earth
+
+from benchmarks.earth_table import _time
+from ephemeris import EphemerisCache, get_position, set_cache
+from hgs2hpc import hgs2hpc, hgs2hpc_batch
+from normalizer import (
+    gse_frame,
+    gse_frame_batch,
+    jsonify_skycoord,
+    normalize_hpc,
+    normalize_hpc_batch,
+)
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SIZES = (1, 10, 100, 1000, 10000, 100000)
+# Numbers of distinct coord_times per batch. Batches with one coord_time
+# per point take minutes with the sunpy engine at 100k points.
+DISTINCT = ("1", "100")
+# Largest number of points passed one at a time to the scalar functions
+SCALAR_MAX_SIZE = 10
+# Peak memory under this many bytes is never reported as a regression
+MEMORY_SLACK = 1 << 20
+
+TARGET = Time("2020-01-01 00:00:00")
+
+
+def _coord_times(size: int, distinct: int) -> Time:
+    """
+    Returns size times before TARGET with the given number of distinct values
+    """
+    offsets = np.linspace(0, 24, distinct) * u.hour
+    return TARGET - np.resize(offsets, size)
+
+
+def _hpc(rng, size: int, disk: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns helioprojective points within 900 arcsec of disk center for
+    "on", or between 1000 and 1500 arcsec for "off"
+    """
+    low, high = (0, 900) if disk == "on" else (1000, 1500)
+    radius = rng.uniform(low, high, size)
+    angle = rng.uniform(0, 2 * np.pi, size)
+    return radius * np.cos(angle), radius * np.sin(angle)
+
+
+def _hgs(rng, size: int, disk: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns lat/lon points on the visible side for "on", or the far side
+    for "off"
+    """
+    lats = rng.uniform(-60, 60, size)
+    if disk == "on":
+        return lats, rng.uniform(-60, 60, size)
+    return lats, rng.uniform(120, 240, size)
+
+
+def _cases(sizes, distincts) -> Iterator[Tuple[str, int, Callable[[], object]]]:
+    """
+    Yields (name, points, fn) for every benchmark case
+    """
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        counts = {size if d == "all" else min(int(d), size) for d in distincts}
+        for distinct in sorted(counts):
+            times = _coord_times(size, distinct)
+            strings = times.isot.tolist()
+            for disk in ("on", "off"):
+                key = f"n={size}/times={distinct}/disk={disk}"
+                xs, ys = _hpc(rng, size, disk)
+                lats, lons = _hgs(rng, size, disk)
+                hpc_rows = [
+                    {"x": x, "y": y, "coord_time": t}
+                    for x, y, t in zip(xs.tolist(), ys.tolist(), strings)
+                ]
+                hgs_rows = [
+                    {"lat": lat, "lon": lon, "coord_time": t}
+                    for lat, lon, t in zip(lats.tolist(), lons.tolist(), strings)
+                ]
+                yield f"normalize_hpc_batch/{key}", size, lambda rows=hpc_rows: (
+                    normalize_hpc_batch(rows, TARGET)
+                )
+                yield f"hgs2hpc_batch/{key}", size, lambda rows=hgs_rows: (
+                    hgs2hpc_batch(rows, TARGET)
+                )
+                if size <= SCALAR_MAX_SIZE:
+                    yield f"normalize_hpc/{key}", size, lambda x=xs, y=ys, t=times: [
+                        normalize_hpc(x[i], y[i], t[i], TARGET) for i in range(len(x))
+                    ]
+                    yield f"hgs2hpc/{key}", size, lambda a=lats, o=lons, t=times: [
+                        hgs2hpc(a[i], o[i], t[i], TARGET) for i in range(len(a))
+                    ]
+
+            # GSE coordinates are all near earth, so disk doesn't apply
+            key = f"n={size}/times={distinct}"
+            gse = rng.uniform(-1e6, 1e6, (3, size))
+            yield f"gse_frame_batch/{key}", size, lambda g=gse, t=list(times): (
+                gse_frame_batch(g[0], g[1], g[2], t)
+            )
+            if size <= SCALAR_MAX_SIZE:
+                yield f"gse_frame/{key}", size, lambda g=gse, t=times: [
+                    gse_frame(g[0][i], g[1][i], g[2][i], t[i]) for i in range(len(t))
+                ]
+
+        # Positions are fetched from the stand-in before timing
+        positions = get_position(
+            "earth", TARGET, TARGET + (size - 1) * u.min, 1 * u.min
+        )
+        yield f"jsonify_skycoord/n={size}", size, lambda p=positions: (
+            jsonify_skycoord(p)
+        )
+
+
+def _peak_memory(fn: Callable[[], object]) -> int:
+    """
+    Returns the peak memory traced while running fn, in bytes
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _regressions(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float):
+    """
+    Yields a description of every case which regressed against the baseline
+    """
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            yield (
+                f"{name}: throughput {result['throughput']:.1f}/s, "
+                f"baseline {base['throughput']:.1f}/s"
+            )
+        memory_limit = max(base["peak_memory"] * (1 + threshold), MEMORY_SLACK)
+        if result["peak_memory"] > memory_limit:
+            yield (
+                f"{name}: peak memory {result['peak_memory']} bytes, "
+                f"baseline {base['peak_memory']} bytes"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", default=",".join(map(str, SIZES)), help="comma separated"
+    )
+    parser.add_argument(
+        "--distinct",
+        default=",".join(DISTINCT),
+        help='comma separated distinct coord_time counts, "all" for one per point',
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed relative regression before failing",
+    )
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--save", action="store_true", help="write the results as the baseline"
+    )
+    args = parser.parse_args()
+
+    # Stand-in for JPL Horizons, so the suite never uses the network
+    cache_dir = tempfile.TemporaryDirectory()
+    set_cache(EphemerisCache(cache_dir.name, lambda name, times: get_earth(times)))
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = {}
+    for name, points, fn in _cases(sizes, args.distinct.split(",")):
+        if args.filter not in name:
+            continue
+        elapsed = _time(fn, args.repeat)
+        results[name] = {
+            "throughput": points / elapsed,
+            "peak_memory": _peak_memory(fn),
+        }
+        print(
+            f"{name:<50} {results[name]['throughput']:12.1f} points/s "
+            f"{results[name]['peak_memory'] / 2**20:9.2f} MiB"
+        )
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fp:
+                baseline = json.load(fp)
+        baseline.update(results)
+        with open(args.baseline, "w") as fp:
+            json.dump(baseline, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save to create one")
+        return
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    regressions = list(_regressions(results, baseline, args.threshold))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
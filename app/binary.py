@@ -0,0 +1,219 @@
+"""
+Binary (.npz) request and response bodies for the batch endpoints.
+
+A request sent with Content-Type NPZ_MEDIA_TYPE is an uncompressed numpy
+.npz archive with one array per field. Coordinates are float64 arrays and
+times are int64 nanoseconds since the unix epoch (UTC). The response is an
+.npz archive in the same format. Requests in any other format are handled
+by the route's normal JSON endpoint.
+
+Routes opt in with the npz_endpoint decorator, which must be applied below
+the route decorator:
+
+    @app.post("/hpc")
+    @npz_endpoint(_normalize_hpc_npz)
+    def _normalize_hpc_post(params: HpcBatchInput):
+        ...
+"""
+
+import io
+import zipfile
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from astropy.time import Time
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from validation import check_columns
+
+NPZ_MEDIA_TYPE = "application/x-npz"
+
+# Function which receives the request arrays and returns the response arrays
+NpzEndpoint = Callable[[Dict[str, np.ndarray]], Dict[str, np.ndarray]]
+
+
+def npz_endpoint(endpoint: NpzEndpoint):
+    """
+    Marks a route as accepting .npz bodies, which are handled by the given
+    endpoint instead of the route's JSON endpoint.
+    """
+
+    def decorator(fn):
+        fn.npz_endpoint = endpoint
+        return fn
+
+    return decorator
+
+
+class NpzRoute(APIRoute):
+    """
+    Route class which sends .npz requests to the route's npz_endpoint.
+    Routes without an npz_endpoint behave like a normal APIRoute.
+    """
+
+    def get_route_handler(self):
+        json_handler = super().get_route_handler()
+        endpoint: Optional[NpzEndpoint] = getattr(self.endpoint, "npz_endpoint", None)
+        if endpoint is None:
+            return json_handler
+
+        async def route_handler(request: Request) -> Response:
+            if not _is_npz(request.headers.get("content-type")):
+                return await json_handler(request)
+            if not _accepts_npz(request.headers.get("accept")):
+                return JSONResponse(
+                    {
+                        "detail": f"Responses to {NPZ_MEDIA_TYPE} requests are {NPZ_MEDIA_TYPE}"
+                    },
+                    status_code=406,
+                )
+            body = await request.body()
+            try:
+                result = await run_in_threadpool(lambda: endpoint(read_npz(body)))
+            except ValueError as e:
+                return JSONResponse({"detail": str(e)}, status_code=422)
+            return Response(write_npz(result), media_type=NPZ_MEDIA_TYPE)
+
+        return route_handler
+
+
+def read_npz(body: bytes) -> Dict[str, np.ndarray]:
+    """
+    Reads every array from an .npz archive. Raises a ValueError if the
+    body isn't a valid archive, or if any member is compressed. Stored
+    members can't be larger than the body, so the arrays read take about
+    as much memory as the request.
+
+    Parameters
+    ----------
+    body: bytes
+        Contents of the .npz archive
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            members = archive.infolist()
+    except Exception as e:
+        raise ValueError(f"Request body is not a valid npz archive: {e}") from e
+    for member in members:
+        if member.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(
+                f"Request body must be an uncompressed npz archive, {member.filename} is compressed"
+            )
+        if member.file_size > len(body):
+            raise ValueError(
+                f"Request body is not a valid npz archive: {member.filename} is larger than the archive"
+            )
+    try:
+        with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+            return {name: archive[name] for name in archive.files}
+    except Exception as e:
+        raise ValueError(f"Request body is not a valid npz archive: {e}") from e
+
+
+def write_npz(arrays: Dict[str, np.ndarray]) -> bytes:
+    """
+    Writes the given arrays to an uncompressed .npz archive
+
+    Parameters
+    ----------
+    arrays: Dict[str, np.ndarray]
+        Arrays to write, keyed by field name
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def check_fields(
+    arrays: Dict[str, np.ndarray],
+    floats=(),
+    times=(),
+    scalar_times=(),
+    optional=(),
+):
+    """
+    Raises a ValueError unless the arrays contain exactly the given fields
+    with the expected types. Columns must be 1 dimensional and all the same
+    length, float columns must be float64 and time columns int64.
+
+    Parameters
+    ----------
+    arrays: Dict[str, np.ndarray]
+        Arrays read from the request
+    floats: Iterable[str]
+        Names of float64 columns
+    times: Iterable[str]
+        Names of int64 epoch time columns
+    scalar_times: Iterable[str]
+        Names of single int64 epoch times
+    optional: Iterable[str]
+        Names of optional string fields
+    """
+    required = {*floats, *times, *scalar_times}
+    missing = required - arrays.keys()
+    if missing:
+        raise ValueError(f"Missing fields: {sorted(missing)}")
+    extra = arrays.keys() - required - set(optional)
+    if extra:
+        raise ValueError(f"Unknown fields: {sorted(extra)}")
+    for name in floats:
+        _check_dtype(name, arrays[name], np.float64, 1)
+    for name in times:
+        _check_dtype(name, arrays[name], np.int64, 1)
+    for name in scalar_times:
+        _check_dtype(name, arrays[name], np.int64, 0)
+    for name in optional:
+        if name in arrays and (
+            arrays[name].dtype.kind != "U" or arrays[name].ndim != 0
+        ):
+            raise ValueError(f"{name} must be a single string")
+    check_columns(**{name: arrays[name] for name in [*floats, *times]})
+
+
+def _check_dtype(name: str, array: np.ndarray, dtype, ndim: int):
+    """
+    Raises a ValueError if the array doesn't have the given dtype and
+    number of dimensions
+    """
+    if array.dtype != dtype or array.ndim != ndim:
+        shape = "a scalar" if ndim == 0 else "a 1 dimensional array"
+        raise ValueError(
+            f"{name} must be {shape} of {np.dtype(dtype).name}, got {array.dtype.name} with shape {array.shape}"
+        )
+
+
+def epoch_to_time(ns: np.ndarray) -> Time:
+    """
+    Converts int64 nanoseconds since the unix epoch to an astropy Time.
+    Whole seconds and the fractional part are passed separately so no
+    precision is lost.
+
+    Parameters
+    ----------
+    ns: np.ndarray
+        Scalar or array of nanoseconds since 1970-01-01 00:00:00 UTC
+    """
+    seconds, fraction = np.divmod(ns, 10**9)
+    return Time(seconds.astype(float), fraction * 1e-9, format="unix", scale="utc")
+
+
+def _is_npz(content_type: Optional[str]) -> bool:
+    """
+    Returns True if the Content-Type header is NPZ_MEDIA_TYPE
+    """
+    if content_type is None:
+        return False
+    return content_type.split(";")[0].strip().lower() == NPZ_MEDIA_TYPE
+
+
+def _accepts_npz(accept: Optional[str]) -> bool:
+    """
+    Returns True if the Accept header allows an npz response
+    """
+    if accept is None:
+        return True
+    types = [value.split(";")[0].strip().lower() for value in accept.split(",")]
+    return any(t in (NPZ_MEDIA_TYPE, "application/*", "*/*") for t in types)
@@ -0,0 +1,128 @@
+"""
+Micro-batching for single point requests.
+
+Helioviewer often sends many single point GET /hpc and /hgs2hpc requests
+at the same time, and each one pays the fixed cost of building frames and
+running a transform for one coordinate. When COALESCE_WINDOW is set, the
+first request for a key waits that long for other requests with the same
+key, then transforms all of them as one batch and hands each request its
+own result.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, List
+
+# Milliseconds to wait for other requests before running a batch.
+# 0 disables coalescing.
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 0))
+
+# Function which transforms every item in a batch with the same key
+BatchFunction = Callable[[Hashable, List[tuple]], List[tuple]]
+
+
+class _Batch:
+    """
+    A batch which is collecting items, or waiting for its results
+    """
+
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, results: List[tuple]):
+        self.results = results
+        self._done.set()
+
+    def fail(self, error: Exception):
+        self.error = error
+        self._done.set()
+
+    def wait(self, index: int) -> tuple:
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        result = self.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class Coalescer:
+    """
+    Gathers items submitted from different threads into batches by key.
+
+    The first thread to submit an item for a key leads the batch. It waits
+    for the window to pass, closes the batch and calls fn with every item.
+    Other threads which submit items with the same key in the meantime
+    wait for the leader and take their result from the batch. If the batch
+    fails, the leader transforms each item on its own so only the items
+    which fail raise an error.
+
+    Parameters
+    ----------
+    fn: BatchFunction
+        Function which receives a key and a list of items and returns one
+        result per item
+    """
+
+    def __init__(self, fn: BatchFunction):
+        self.fn = fn
+        self._open: Dict[Hashable, _Batch] = {}
+        self._lock = threading.Lock()
+        # batches: number of calls made to fn
+        # coalesced: number of items which joined another item's batch
+        self.metrics = {"batches": 0, "coalesced": 0}
+
+    def submit(self, key: Hashable, item: tuple, window: float) -> tuple:
+        """
+        Adds the item to the open batch for key and returns its result
+
+        Parameters
+        ----------
+        key: Hashable
+            Items are only batched with items that have the same key
+        item: tuple
+            Item to pass to fn
+        window: float
+            Seconds to wait for more items before running a new batch
+        """
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._open[key] = batch
+            else:
+                self.metrics["coalesced"] += 1
+            index = len(batch.items)
+            batch.items.append(item)
+
+        if not leader:
+            return batch.wait(index)
+
+        time.sleep(window)
+        with self._lock:
+            del self._open[key]
+            self.metrics["batches"] += 1
+        try:
+            batch.finish(self.fn(key, batch.items))
+        except Exception as e:
+            if len(batch.items) == 1:
+                batch.fail(e)
+                raise
+            batch.finish([self._run_one(key, item) for item in batch.items])
+        return batch.wait(index)
+
+    def _run_one(self, key: Hashable, item: tuple):
+        """
+        Runs fn for a single item. Errors are returned as the result so
+        they are raised in the thread which submitted the item.
+        """
+        try:
+            return self.fn(key, [item])[0]
+        except Exception as e:
+            return e
@@ -0,0 +1,125 @@
+"""
+Precomputed table of Earth's Heliographic Stonyhurst position and
+Heliocentric Inertial longitude.
+
+The table is generated offline from sunpy with
+
+    python earth_table.py
+
+and stored as a .npy file which is memory-mapped on first use. Positions
+between table rows are found with cubic interpolation, which is within
+1 km in distance and 0.001 arcseconds in latitude of sunpy's get_earth
+across the whole table.
+"""
+
+import os
+import warnings
+from typing import Union
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+
+from interpolation import cubic_interpolate
+
+TABLE_PATH = os.path.join(os.path.dirname(__file__), "data", "earth_hgs.npy")
+# Table covers TABLE_START to TABLE_END in TT, one row every TABLE_STEP days
+TABLE_START = Time("1990-01-01 00:00:00", scale="tt")
+TABLE_END = Time("2050-01-01 00:00:00", scale="tt")
+TABLE_STEP = 1
+# Columns in each row: lon (deg), lat (deg), radius (AU) and Earth's
+# Heliocentric Inertial longitude (deg, unwrapped so it increases smoothly)
+
+_table = None
+
+
+def generate(path: str = TABLE_PATH):
+    """
+    Computes the table with sunpy and writes it to the given path
+    """
+    from erfa import ErfaWarning
+    from sunpy.coordinates import get_earth, HeliocentricInertial
+
+    days = (TABLE_END - TABLE_START).to_value(u.day)
+    times = TABLE_START + np.arange(0, days + TABLE_STEP, TABLE_STEP) * u.day
+    with warnings.catch_warnings():
+        # Future dates are past the end of the leap second table
+        warnings.simplefilter("ignore", ErfaWarning)
+        earth = get_earth(times)
+        hci = earth.transform_to(HeliocentricInertial(obstime=times))
+    table = np.column_stack(
+        [
+            earth.lon.to_value(u.deg),
+            earth.lat.to_value(u.deg),
+            earth.radius.to_value(u.AU),
+            np.rad2deg(np.unwrap(hci.lon.to_value(u.rad))),
+        ]
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path, table)
+
+
+def load() -> np.ndarray:
+    """
+    Returns the memory-mapped table, loading it on first use.
+    Table rows are transposed to shape (4, N).
+    """
+    global _table
+    if _table is None:
+        _table = np.load(TABLE_PATH, mmap_mode="r").T
+    return _table
+
+
+def earth_hgs(obstime: Union[Time, str]):
+    """
+    Returns Earth's Heliographic Stonyhurst lon, lat and radius at the given
+    time(s) as quantities, or None if any time falls outside of the table.
+
+    Parameters
+    ----------
+    obstime: Time
+        Scalar or array observation time
+    """
+    values = _interpolate(obstime)
+    if values is None:
+        return None
+    return values[0] * u.deg, values[1] * u.deg, values[2] * u.AU
+
+
+def earth_hci_lon(obstime: Union[Time, str]):
+    """
+    Returns Earth's Heliocentric Inertial longitude at the given time(s),
+    or None if any time falls outside of the table. The longitude is not
+    wrapped, so differences between times are continuous.
+
+    Parameters
+    ----------
+    obstime: Time
+        Scalar or array observation time
+    """
+    values = _interpolate(obstime)
+    if values is None:
+        return None
+    return values[3] * u.deg
+
+
+def _interpolate(obstime: Union[Time, str]):
+    """
+    Returns every table column interpolated to the given time(s), or None
+    if any time falls outside of the table.
+    """
+    time = obstime if isinstance(obstime, Time) else Time(obstime)
+    tt = time.tt
+    # Split jd1/jd2 to keep full precision in the offset
+    offset = ((tt.jd1 - TABLE_START.jd1) + (tt.jd2 - TABLE_START.jd2)) / TABLE_STEP
+    table = load()
+    if np.any(offset < 1) or np.any(offset > table.shape[1] - 2):
+        return None
+    values = cubic_interpolate(table, np.atleast_1d(offset))
+    if time.isscalar:
+        return values[:, 0]
+    return values
+
+
+if __name__ == "__main__":
+    generate()
@@ -1,10 +1,476 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import quote
+
+import numpy as np
 import astropy.units as u
+from astropy.coordinates import SkyCoord
 from astropy.time import Time
 from sunpy.coordinates import get_horizons_coord
+from sunpy.coordinates.frames import HeliographicStonyhurst
+
+from interpolation import cubic_interpolate
+from metrics import (
+    BATCH_SIZE,
+    EPHEMERIS_ROWS,
+    HORIZONS_REQUESTS,
+    HORIZONS_SECONDS,
+    stage,
+)
+
+# Signature of the function used to look up observatory positions.
+# It receives the observatory name and an array of times and returns
+# a SkyCoord with one position per time.
+Fetcher = Callable[[str, Time], SkyCoord]
+
+# Number of hourly rows stored in each cache file
+BLOCK_HOURS = 8192
+# Columns stored for each hour: lon (deg), lat (deg), radius (AU)
+COLUMNS = 3
+# Spacing of the anchor positions used to interpolate finer cadences
+ANCHOR_CADENCE = 1 * u.hour
+# Maximum number of positions returned by a single call to get_position or
+# get_positions, counting every observatory
+MAX_POSITIONS = 100000
+# Maximum number of observatories in a single call to get_positions
+MAX_OBSERVATORIES = 16
+# Number of threads shared by all get_positions calls to look up
+# observatories concurrently. One call with more observatories than this
+# uses every thread until its lookups are done, later calls queue behind it.
+POSITION_FETCH_WORKERS = int(os.environ.get("POSITION_FETCH_WORKERS", 4))
+
+
+class _Flight:
+    """
+    An in-flight fetch for a set of hours. Other requests which need any
+    of these hours wait on the flight instead of fetching them again.
+    """
+
+    def __init__(self, hours: np.ndarray):
+        self.hours = hours
+        self.values = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, hours: np.ndarray, values: np.ndarray):
+        """
+        Publishes the fetched rows for the given hours
+        """
+        self.values = np.empty((len(self.hours), COLUMNS))
+        self.values[np.searchsorted(self.hours, hours)] = values
+        self._done.set()
+
+    def fail(self, error: Exception):
+        """
+        Marks the fetch as failed, waiting requests re-raise the error
+        """
+        self.error = error
+        self._done.set()
+
+    def wait(self, hours: np.ndarray) -> np.ndarray:
+        """
+        Waits for the fetch to finish and returns the rows for the given hours
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.values[np.searchsorted(self.hours, hours)]
+
+
+class EphemerisCache:
+    """
+    Persistent cache of observatory positions keyed by (observatory, hour).
+
+    Positions are stored as Heliographic Stonyhurst lon/lat/radius in
+    memory-mapped float64 files, one file per observatory per block of
+    BLOCK_HOURS hours. Rows which have not been fetched yet are NaN.
+    Only times which land exactly on the hour are cached, any other
+    times are passed straight through to the fetcher.
+
+    Concurrent requests for overlapping hours share a single fetch.
+
+    Parameters
+    ----------
+    directory: str
+        Directory where cache files are stored
+    fetcher: Fetcher
+        Function used to look up positions which are not in the cache
+    """
+
+    def __init__(self, directory: str, fetcher: Fetcher = get_horizons_coord):
+        self.directory = directory
+        self.fetcher = fetcher
+        self._blocks: Dict[Tuple[str, int], np.memmap] = {}
+        self._inflight: Dict[Tuple[str, int], _Flight] = {}
+        self._lock = threading.Lock()
+        # fetched: number of calls made to the fetcher
+        # coalesced: number of requests which waited on another request's fetch
+        self.metrics = {"fetched": 0, "coalesced": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, observatory: str, times: Time) -> SkyCoord:
+        """
+        Returns the position of the observatory at each of the given times.
+        Positions missing from the cache are fetched in a single call to the
+        fetcher and stored for future requests. If another request is
+        already fetching some of the same hours, this request waits for
+        that fetch and takes the rows it needs from the result instead of
+        fetching them again.
+
+        Parameters
+        ----------
+        observatory: str
+            Observatory name, as understood by the fetcher
+        times: Time
+            Array of times to get positions for
+        """
+        key = _observatory_key(observatory)
+        hours, aligned = _hour_index(times)
+        values = np.full((len(times), COLUMNS), np.nan)
+        waiting: Dict[_Flight, list] = {}
+        own = []
+        flight = None
+        with self._lock:
+            for block, rows in _group_by_block(hours[aligned]):
+                data = self._block(key, block, create=False)
+                if data is not None:
+                    values[np.flatnonzero(aligned)[rows]] = data[
+                        hours[aligned][rows] - block * BLOCK_HOURS
+                    ]
+            missing = np.isnan(values[:, 2])
+            EPHEMERIS_ROWS.inc("hit", amount=int(np.sum(~missing)))
+            EPHEMERIS_ROWS.inc("miss", amount=int(np.sum(missing)))
+            for i in np.flatnonzero(missing & aligned):
+                other = self._inflight.get((key, hours[i]))
+                if other is None:
+                    own.append(i)
+                else:
+                    waiting.setdefault(other, []).append(i)
+            if own:
+                flight = _Flight(np.unique(hours[own]))
+                for hour in flight.hours:
+                    self._inflight[(key, hour)] = flight
+            if waiting:
+                self.metrics["coalesced"] += 1
+
+        fetch = np.concatenate([own, np.flatnonzero(missing & ~aligned)]).astype(
+            np.int64
+        )
+        try:
+            if len(fetch) > 0:
+                with self._lock:
+                    self.metrics["fetched"] += 1
+                values[fetch] = _to_columns(self._fetch(observatory, times[fetch]))
+            if flight is not None:
+                self._store(key, hours[own], values[own])
+                flight.finish(hours[own], values[own])
+        except Exception as e:
+            if flight is not None:
+                flight.fail(e)
+            raise
+        finally:
+            if flight is not None:
+                with self._lock:
+                    for hour in flight.hours:
+                        del self._inflight[(key, hour)]
+
+        for other, indices in waiting.items():
+            values[indices] = other.wait(hours[indices])
+
+        return SkyCoord(
+            values[:, 0] * u.deg,
+            values[:, 1] * u.deg,
+            values[:, 2] * u.AU,
+            frame=HeliographicStonyhurst,
+            obstime=times,
+        )
+
+    def _fetch(self, observatory: str, times: Time) -> SkyCoord:
+        """
+        Calls the fetcher and records the call's outcome and duration
+        """
+        start = time.perf_counter()
+        try:
+            result = self.fetcher(observatory, times)
+        except Exception:
+            HORIZONS_REQUESTS.inc("error")
+            raise
+        finally:
+            HORIZONS_SECONDS.observe(time.perf_counter() - start)
+        HORIZONS_REQUESTS.inc("ok")
+        return result
+
+    def _store(self, key: str, hours: np.ndarray, values: np.ndarray):
+        """
+        Writes the given rows to the cache files.
+        """
+        with self._lock:
+            for block, rows in _group_by_block(hours):
+                data = self._block(key, block, create=True)
+                data[hours[rows] - block * BLOCK_HOURS] = values[rows]
+                data.flush()
+
+    def _block(self, key: str, block: int, create: bool):
+        """
+        Returns the memory-mapped array for the given block, or None if
+        the block doesn't exist and create is False.
+        """
+        if (key, block) in self._blocks:
+            return self._blocks[(key, block)]
+        path = os.path.join(self.directory, f"{key}.{block}.f64")
+        if not os.path.exists(path):
+            if not create:
+                return None
+            _create_block(path)
+        data = np.memmap(
+            path, dtype=np.float64, mode="r+", shape=(BLOCK_HOURS, COLUMNS)
+        )
+        self._blocks[(key, block)] = data
+        return data
+
+
+def _create_block(path: str):
+    """
+    Creates a new block file filled with NaN. The file is written to a
+    temporary name first so other processes never see a partial file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as fp:
+        np.full((BLOCK_HOURS, COLUMNS), np.nan).tofile(fp)
+    os.replace(tmp_path, path)
+
+
+def _observatory_key(observatory: str) -> str:
+    """
+    Returns a file name safe key for the given observatory
+    """
+    return quote(observatory.strip().lower(), safe="")
+
+
+def _hour_index(times: Time) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the hour index of each time relative to the unix epoch and a
+    mask of which times land exactly on the hour.
+    """
+    hours = np.atleast_1d(times.unix) / 3600
+    rounded = np.round(hours)
+    aligned = np.abs(hours - rounded) < 1e-9
+    return rounded.astype(np.int64), aligned
+
+
+def _group_by_block(hours: np.ndarray):
+    """
+    Yields (block, indices) for each cache block touched by the given hours
+    """
+    blocks = hours // BLOCK_HOURS
+    for block in np.unique(blocks):
+        yield int(block), np.flatnonzero(blocks == block)
+
+
+def _to_columns(coord: SkyCoord) -> np.ndarray:
+    """
+    Converts a SkyCoord to an array of lon (deg), lat (deg), radius (AU) rows
+    """
+    hgs = coord.transform_to(HeliographicStonyhurst(obstime=coord.obstime))
+    return np.column_stack(
+        [
+            np.atleast_1d(hgs.lon.to_value(u.deg)),
+            np.atleast_1d(hgs.lat.to_value(u.deg)),
+            np.atleast_1d(hgs.radius.to_value(u.AU)),
+        ]
+    )
+
+
+_cache = None
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool used by get_positions, so concurrent requests
+    share POSITION_FETCH_WORKERS upstream lookups between them
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=POSITION_FETCH_WORKERS, thread_name_prefix="positions"
+            )
+        return _executor
+
+
+def get_cache() -> EphemerisCache:
+    """
+    Returns the ephemeris cache used by get_position. The cache directory
+    is read from the EPHEMERIS_CACHE_DIR environment variable.
+    """
+    global _cache
+    if _cache is None:
+        directory = os.environ.get(
+            "EPHEMERIS_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "coordinator-ephemeris"),
+        )
+        _cache = EphemerisCache(directory)
+    return _cache
+
+
+def set_cache(cache: EphemerisCache):
+    """
+    Replaces the ephemeris cache used by get_position
+    """
+    global _cache
+    _cache = cache
+
+
+@stage("ephemeris")
+def get_position(
+    observatory_name: str,
+    start_time: Time,
+    end_time: Time,
+    cadence: u.Quantity = ANCHOR_CADENCE,
+) -> SkyCoord:
+    """
+    Returns the position of the observatory from start_time to end_time
+    (inclusive) sampled every cadence.
+
+    Cadences of one hour or more are looked up directly. Finer cadences are
+    interpolated from hourly anchor positions with a piecewise cubic, so the
+    number of upstream samples only depends on the length of the window.
+    The interpolation error is bounded by 3/128 * r * (w * 1 hour)^4, where r
+    is the radius of the observatory's orbit and w is its angular rate. This
+    is under 5 km for an observatory in geosynchronous orbit (i.e. SDO).
+
+    Parameters
+    ----------
+    observatory_name: str
+        Observatory name, as understood by JPL Horizons
+    start_time: Time
+        Time of the first position
+    end_time: Time
+        Time of the last position
+    cadence: u.Quantity
+        Time between positions
+    """
+    times = _position_times(start_time, end_time, cadence)
+    BATCH_SIZE.observe(len(times), "position")
+    return _lookup(observatory_name, times, cadence)
+
+
+@stage("ephemeris")
+def get_positions(
+    observatory_names: List[str],
+    start_time: Time,
+    end_time: Time,
+    cadence: u.Quantity = ANCHOR_CADENCE,
+) -> SkyCoord:
+    """
+    Returns the positions of several observatories from start_time to
+    end_time (inclusive) sampled every cadence, stacked into one SkyCoord.
+    The first len(times) positions belong to the first observatory, the
+    next len(times) to the second, and so on.
+
+    The time grid is built once and shared by every observatory, and the
+    observatories are looked up concurrently, on POSITION_FETCH_WORKERS
+    threads shared by all calls, so their upstream fetches overlap.
+    Positions are returned in Heliographic Stonyhurst cartesian coordinates
+    so they can all be transformed in one call.
+
+    Parameters
+    ----------
+    observatory_names: List[str]
+        Observatory names, as understood by JPL Horizons
+    start_time: Time
+        Time of the first position
+    end_time: Time
+        Time of the last position
+    cadence: u.Quantity
+        Time between positions
+    """
+    if len(observatory_names) > MAX_OBSERVATORIES:
+        raise ValueError(
+            f"Request has {len(observatory_names)} observatories, "
+            f"the maximum is {MAX_OBSERVATORIES}"
+        )
+    times = _position_times(start_time, end_time, cadence, len(observatory_names))
+    BATCH_SIZE.observe(len(times) * len(observatory_names), "position")
+    coords = list(
+        _get_executor().map(
+            lambda name: _lookup(name, times, cadence), observatory_names
+        )
+    )
+    xyz = np.concatenate(
+        [coord.cartesian.xyz.to_value(u.AU) for coord in coords], axis=1
+    )
+    return SkyCoord(
+        xyz[0] * u.AU,
+        xyz[1] * u.AU,
+        xyz[2] * u.AU,
+        frame=HeliographicStonyhurst,
+        obstime=times[np.tile(np.arange(len(times)), len(coords))],
+        representation_type="cartesian",
+    )
+
+
+def _position_times(
+    start_time: Time, end_time: Time, cadence: u.Quantity, observatories: int = 1
+) -> Time:
+    """
+    Returns the times from start_time to end_time (inclusive) every cadence.
+    Raises a ValueError if there would be more than MAX_POSITIONS positions
+    for the given number of observatories.
+    """
+    if end_time < start_time:
+        raise ValueError("End time must not be before the start time")
+    step = cadence.to_value(u.s)
+    count = int(np.floor((end_time - start_time).to_value(u.s) / step + 1e-9)) + 1
+    if count * observatories > MAX_POSITIONS:
+        raise ValueError(
+            f"Request would return {count * observatories} positions, "
+            f"the maximum is {MAX_POSITIONS}. Use a larger cadence."
+        )
+    return start_time + np.arange(count) * step * u.s
+
+
+def _lookup(observatory_name: str, times: Time, cadence: u.Quantity) -> SkyCoord:
+    """
+    Returns the observatory's position at the given times, which are spaced
+    by cadence. See get_position.
+    """
+    if cadence >= ANCHOR_CADENCE:
+        return get_cache().get(observatory_name, times)
+    return _interpolate_position(observatory_name, times)
+
 
+def _interpolate_position(observatory_name: str, times: Time) -> SkyCoord:
+    """
+    Interpolates the observatory's position at the given times from hourly
+    anchor positions using 4 point (cubic) Lagrange interpolation on the
+    Heliographic Stonyhurst cartesian components.
+    """
+    anchor_step = ANCHOR_CADENCE.to_value(u.s)
+    # Anchor grid is aligned to the hour so anchors are served by the cache.
+    # One extra anchor on each side gives every interval a 4 point stencil.
+    first = np.floor(times[0].unix / anchor_step) - 1
+    last = np.floor(times[-1].unix / anchor_step) + 2
+    anchor_times = Time(
+        np.arange(first, last + 1) * anchor_step, format="unix", scale="utc"
+    )
+    anchors = get_cache().get(observatory_name, anchor_times)
+    xyz = anchors.cartesian.xyz.to_value(u.AU)
 
-def get_position(observatory_name: str, start_time: Time, end_time: Time):
-    time_range = end_time - start_time
-    hours = int(time_range.to("hour").value)
-    times = Time([start_time + i * 3600 * u.second for i in range(hours + 1)])
-    return get_horizons_coord(observatory_name, times)
+    # Position of each time in units of anchor intervals
+    offset = (times.unix - anchor_times[0].unix) / anchor_step
+    result = cubic_interpolate(xyz, offset)
+    return SkyCoord(
+        result[0] * u.AU,
+        result[1] * u.AU,
+        result[2] * u.AU,
+        frame=HeliographicStonyhurst,
+        obstime=times,
+        representation_type="cartesian",
+    )
@@ -1,25 +1,155 @@
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Deque, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from sunpy.coordinates import transform_with_sun_center
 from sunpy.coordinates.frames import Helioprojective, HeliographicStonyhurst
 import astropy.units as u
 from astropy.time import Time
 
+from earth_table import earth_hgs
+from metrics import stage
+
+
+class _FairLock:
+    """
+    Reentrant lock which is handed to waiting threads in the order they
+    asked for it. A thread which releases the lock and asks for it again
+    waits behind the threads already waiting, so work done in chunks
+    interleaves with other requests instead of starving them.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._waiting: Deque[int] = deque()
+        self._owner: Optional[int] = None
+        self._depth = 0
+
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return self
+            self._waiting.append(me)
+            while self._owner is not None or self._waiting[0] != me:
+                self._condition.wait()
+            self._waiting.popleft()
+            self._owner = me
+            self._depth = 1
+            return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._condition.notify_all()
+
+
+# sunpy's transform_with_sun_center and screen context managers modify
+# global state, so only one thread may be inside them at a time.
+_transform_lock = _FairLock()
+
+# Number of observation times kept in each frame cache
+FRAME_CACHE_SIZE = int(os.environ.get("FRAME_CACHE_SIZE", 1024))
+# Observation times are rounded to this many seconds before looking up
+# cached frames. 0 disables rounding.
+FRAME_CACHE_QUANTUM = float(os.environ.get("FRAME_CACHE_QUANTUM", 0))
+# Use the precomputed earth ephemeris table instead of sunpy
+USE_EARTH_TABLE = os.environ.get("USE_EARTH_TABLE", "0") == "1"
+# Batches are transformed per distinct observation time when there are at
+# least this many coordinates per distinct time on average. Transforming a
+# group has a fixed cost of roughly 50 coordinates on the array path.
+TIME_GROUP_MIN_SIZE = int(os.environ.get("TIME_GROUP_MIN_SIZE", 50))
+# Number of coordinates transformed per hold of the sunpy transform lock.
+# Large batches release the lock between chunks so single point requests
+# aren't blocked for the whole batch.
+TRANSFORM_CHUNK_SIZE = int(os.environ.get("TRANSFORM_CHUNK_SIZE", 2000))
+
+
+@contextmanager
+def sun_center_transform():
+    """
+    Thread safe version of sunpy's transform_with_sun_center. Screen
+    context managers (i.e. SphericalScreen) should only be entered
+    inside this context.
+    """
+    with _transform_lock, transform_with_sun_center():
+        yield
+
+
+def transform_chunks(size: int) -> Iterator[slice]:
+    """
+    Yields slices which split size coordinates into chunks of at most
+    TRANSFORM_CHUNK_SIZE. Each chunk should take sun_center_transform
+    separately.
+    """
+    step = max(TRANSFORM_CHUNK_SIZE, 1)
+    for start in range(0, size, step):
+        yield slice(start, min(start + step, size))
+
 
+@stage("rotate")
+def solar_rotate_coordinate(coordinate, observer):
+    """
+    sunpy's solar_rotate_coordinate. Importing
+    sunpy.physics.differential_rotation also imports sunpy.map, which takes
+    several seconds, so it is imported on first use instead of on startup.
+    """
+    from sunpy.physics.differential_rotation import solar_rotate_coordinate
+
+    return solar_rotate_coordinate(coordinate, observer)
+
+
+@stage("frames")
 def get_earth_frame(obstime: str):
     """
     Returns the Helioprojective frame as seen from earth at the
-    given observation time
+    given observation time. Frames for scalar observation times are
+    memoized, see frame_cache_info.
 
     Parameters
     ----------
     obstime: str
         Observation time with both date and time.
     """
-    return Helioprojective(observer="earth", obstime=obstime)
+    key = _frame_key(obstime)
+    if key is None:
+        return Helioprojective(observer=get_earth_observer(obstime), obstime=obstime)
+    return _cached_earth_frame(key)
+
+
+def get_earth_observer(obstime: str):
+    """
+    Returns Earth's position to use as an observer at the given observation
+    time(s). With USE_EARTH_TABLE enabled, the position is interpolated from
+    the precomputed table in earth_table.py. Otherwise, or if the time is
+    outside of the table, sunpy resolves Earth's position.
+
+    Parameters
+    ----------
+    obstime: str
+        Scalar or array observation time
+    """
+    if USE_EARTH_TABLE:
+        position = earth_hgs(obstime)
+        if position is not None:
+            return HeliographicStonyhurst(*position, obstime=obstime)
+    return "earth"
 
 
+@stage("frames")
 def get_helioviewer_frame(obstime: str):
     """
     Returns Helioviewer's Helioprojective frame of reference
-    for the given observation time
+    for the given observation time. Frames for scalar observation
+    times are memoized, see frame_cache_info.
 
     Parameters
     ----------
@@ -27,6 +157,13 @@ def get_helioviewer_frame(obstime: str):
         Observation time with both date and time. Supports
         all formats supported by sunpy
     """
+    key = _frame_key(obstime)
+    if key is None:
+        return _make_helioviewer_frame(obstime)
+    return _cached_helioviewer_frame(key)
+
+
+def _make_helioviewer_frame(obstime: str):
     # Start with earth's frame of reference
     earth_frame = get_earth_frame(obstime)
     # Adjust the distance parameter to 1AU
@@ -37,6 +174,77 @@ def get_helioviewer_frame(obstime: str):
     return Helioprojective(observer=hv_observer, obstime=obstime)
 
 
+def _frame_key(obstime):
+    """
+    Returns the cache key for the given observation time, or None if
+    obstime is an array and can't be cached. With FRAME_CACHE_QUANTUM set,
+    times are rounded to the nearest multiple of that many seconds.
+    """
+    time = obstime if isinstance(obstime, Time) else Time(obstime)
+    if not time.isscalar:
+        return None
+    if FRAME_CACHE_QUANTUM > 0:
+        unix = round(time.unix / FRAME_CACHE_QUANTUM) * FRAME_CACHE_QUANTUM
+        time = Time(unix, format="unix", scale="utc")
+    utc = time.utc
+    return (float(utc.jd1), float(utc.jd2))
+
+
+def _key_time(key: Tuple[float, float]) -> Time:
+    """
+    Returns the observation time for a cache key
+    """
+    return Time(key[0], key[1], format="jd", scale="utc")
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def _cached_earth_frame(key: Tuple[float, float]):
+    obstime = _key_time(key)
+    return Helioprojective(observer=get_earth_observer(obstime), obstime=obstime)
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def _cached_helioviewer_frame(key: Tuple[float, float]):
+    return _make_helioviewer_frame(_key_time(key))
+
+
+def frame_cache_info() -> dict:
+    """
+    Returns hit/miss counts for the earth and helioviewer frame caches
+    """
+    return {
+        "earth": _cached_earth_frame.cache_info()._asdict(),
+        "helioviewer": _cached_helioviewer_frame.cache_info()._asdict(),
+    }
+
+
+def group_by_time(times: Time) -> Optional[List[Tuple[Time, np.ndarray]]]:
+    """
+    Groups an array of times by distinct value. Returns a list of
+    (time, indices) where time is a scalar time and indices are the
+    positions in the array with that time. Returns None when there are
+    fewer than TIME_GROUP_MIN_SIZE times per distinct time on average,
+    in which case transforming the whole array at once is faster.
+
+    Parameters
+    ----------
+    times: Time
+        Array of times to group
+    """
+    if times.isscalar:
+        return None
+    utc = times.utc
+    keys = np.column_stack([np.ravel(utc.jd1), np.ravel(utc.jd2)])
+    _, first, inverse, counts = np.unique(
+        keys, axis=0, return_index=True, return_inverse=True, return_counts=True
+    )
+    if len(first) * TIME_GROUP_MIN_SIZE > len(keys):
+        return None
+    order = np.argsort(inverse.ravel(), kind="stable")
+    indices = np.split(order, np.cumsum(counts)[:-1])
+    return [(times[i], index) for i, index in zip(first, indices)]
+
+
 def get_3d_frame_date() -> Time:
     return Time("2025-01-01 00:00:00")
 
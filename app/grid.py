@@ -0,0 +1,199 @@
+"""
+Grid engine for hgs2hpc.
+
+For a fixed coord_time and target, hgs2hpc is a smooth function of lat/lon
+on the visible side of the sun. The grid engine computes it once on a
+GRID_STEP degree lat/lon grid with the numpy engine and answers each point
+by bilinear interpolation between the 4 grid points around it.
+
+Grids are cached per (coord_time bucket, target). Points are moved from
+their own coord_time to the bucket's time with rotation.rotate_lon, which
+applies the same differential rotation as the transform itself, so the
+bucket size doesn't affect accuracy.
+
+When a grid is built, the interpolation error of every cell is estimated at
+its center. Cells with an estimated error over GRID_MAX_ERROR arcseconds,
+and cells which touch the limb or far side, are answered with the exact
+numpy engine instead.
+"""
+
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from astropy.time import Time
+
+import rotation
+
+# Grid spacing in degrees
+GRID_STEP = float(os.environ.get("GRID_STEP", 1))
+# Largest estimated interpolation error (arcsec) of cells which are used
+GRID_MAX_ERROR = float(os.environ.get("GRID_MAX_ERROR", 0.1))
+# coord_times are grouped into buckets of this many seconds
+GRID_TIME_BUCKET = float(os.environ.get("GRID_TIME_BUCKET", 3600))
+# Number of grids kept in memory
+GRID_CACHE_SIZE = int(os.environ.get("GRID_CACHE_SIZE", 64))
+
+# interpolated: points answered from a grid
+# exact: points answered by the numpy engine
+metrics = {"interpolated": 0, "exact": 0}
+
+
+class Grid:
+    """
+    hgs2hpc results on a lat/lon grid for one coord_time and target
+
+    Parameters
+    ----------
+    coord_time: Time
+        Time the grid's lat/lon coordinates are measured at
+    target: Time
+        Target observation time
+    step: float
+        Grid spacing in degrees
+    max_error: float
+        Largest estimated interpolation error (arcsec) of usable cells
+    """
+
+    def __init__(self, coord_time: Time, target: Time, step: float, max_error: float):
+        self.step = step
+        lats = np.linspace(-90, 90, int(round(180 / step)) + 1)
+        lons = np.linspace(-180, 180, int(round(360 / step)) + 1)
+        lat, lon = np.meshgrid(lats, lons, indexing="ij")
+        x, y, visible = rotation.hgs2hpc_visible(
+            lat.ravel(), lon.ravel(), coord_time, target
+        )
+        self.x = x.reshape(lat.shape)
+        self.y = y.reshape(lat.shape)
+        visible = visible.reshape(lat.shape)
+
+        # Compare the exact value at each cell's center to the interpolated
+        # value, which is the mean of the cell's corners
+        center_lat, center_lon = np.meshgrid(
+            lats[:-1] + step / 2, lons[:-1] + step / 2, indexing="ij"
+        )
+        cx, cy, center_visible = rotation.hgs2hpc_visible(
+            center_lat.ravel(), center_lon.ravel(), coord_time, target
+        )
+        error = np.hypot(
+            _corner_mean(self.x) - cx.reshape(center_lat.shape),
+            _corner_mean(self.y) - cy.reshape(center_lat.shape),
+        )
+        usable = visible[:-1, :-1] & visible[1:, :-1]
+        usable &= visible[:-1, 1:] & visible[1:, 1:]
+        usable &= center_visible.reshape(center_lat.shape)
+        self.usable = usable & (error <= max_error)
+
+    def interpolate(
+        self, lats: np.ndarray, lons: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the interpolated x and y (arcsec) of each point, and whether
+        the point's cell is usable. Values for unusable cells are undefined.
+        """
+        lons = (lons + 180) % 360 - 180
+        i, a = _cell(lats + 90, self.step, self.x.shape[0] - 1)
+        j, b = _cell(lons + 180, self.step, self.x.shape[1] - 1)
+
+        def bilinear(values: np.ndarray) -> np.ndarray:
+            low = (1 - b) * values[i, j] + b * values[i, j + 1]
+            high = (1 - b) * values[i + 1, j] + b * values[i + 1, j + 1]
+            return (1 - a) * low + a * high
+
+        return bilinear(self.x), bilinear(self.y), self.usable[i, j]
+
+
+def hgs2hpc(
+    lats: List[float], lons: List[float], coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Grid version of hgs2hpc.hgs2hpc_columns
+
+    Parameters
+    ----------
+    lats : List[float]
+        Latitude coordinates in degrees
+    lons : List[float]
+        Longitude coordinates in degrees
+    coord_times : Time
+        Scalar or array times when each lat/lon coordinate was measured
+    target : Time
+        Target observation time
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    coord_times = _broadcast(coord_times, len(lats))
+    out_x = np.empty(len(lats))
+    out_y = np.empty(len(lats))
+    usable = np.zeros(len(lats), dtype=bool)
+
+    buckets = np.round(coord_times.unix / GRID_TIME_BUCKET).astype(np.int64)
+    for bucket in np.unique(buckets):
+        index = np.flatnonzero(buckets == bucket)
+        bucket_time = Time(bucket * GRID_TIME_BUCKET, format="unix", scale="utc")
+        grid = _get_grid(_time_key(bucket_time), _time_key(target))
+        rotated = rotation.rotate_lon(
+            lats[index], lons[index], coord_times[index], bucket_time
+        )
+        out_x[index], out_y[index], usable[index] = grid.interpolate(
+            lats[index], rotated
+        )
+
+    exact = np.flatnonzero(~usable)
+    if len(exact) > 0:
+        out_x[exact], out_y[exact] = rotation.hgs2hpc(
+            lats[exact], lons[exact], coord_times[exact], target
+        )
+    metrics["interpolated"] += len(lats) - len(exact)
+    metrics["exact"] += len(exact)
+    return out_x, out_y
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def _get_grid(coord_time: Tuple[float, float], target: Tuple[float, float]) -> Grid:
+    return Grid(
+        Time(*coord_time, format="jd", scale="utc"),
+        Time(*target, format="jd", scale="utc"),
+        GRID_STEP,
+        GRID_MAX_ERROR,
+    )
+
+
+def _time_key(time: Time) -> Tuple[float, float]:
+    utc = time.utc
+    return (float(utc.jd1), float(utc.jd2))
+
+
+def _broadcast(times: Time, size: int) -> Time:
+    """
+    Returns times as an array of the given size
+    """
+    if not times.isscalar:
+        return times
+    utc = times.utc
+    return Time(
+        np.full(size, utc.jd1), np.full(size, utc.jd2), format="jd", scale="utc"
+    )
+
+
+def _cell(offset: np.ndarray, step: float, cells: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the index of the cell containing each offset and the fractional
+    position within the cell
+    """
+    position = offset / step
+    index = np.clip(np.floor(position).astype(np.int64), 0, cells - 1)
+    return index, position - index
+
+
+def _corner_mean(values: np.ndarray) -> np.ndarray:
+    """
+    Returns the mean of the 4 corners of every grid cell
+    """
+    return (values[:-1, :-1] + values[1:, :-1] + values[:-1, 1:] + values[1:, 1:]) / 4
@@ -0,0 +1,167 @@
+"""
+Readiness self-test.
+
+GET /health-check only reports that the server is answering requests.
+GET /ready reports the result of a self-test which runs each transform
+once and reads observatory positions through an ephemeris cache backed by
+a local stand-in for JPL Horizons, so probes never wait on or add load to
+Horizons. The self-test runs in a background thread when the server
+starts, after the warm-up in warmup.py, and again every
+HEALTH_CHECK_INTERVAL seconds if that is set. Probes only read the last
+result.
+"""
+
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from sunpy.coordinates import get_earth
+
+from ephemeris import EphemerisCache, get_cache
+from hgs2hpc import hgs2hpc
+from normalizer import gse_frame, jsonify_skycoord, normalize_hpc
+from warmup import STARTUP_WARMUP, warm_up
+
+# Seconds between self-tests after the first one, 0 only runs it at startup
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", 0))
+
+
+def _check_ephemeris():
+    """
+    Checks the ephemeris cache directory is usable and that positions can
+    be stored, read back and serialized, using earth's position in place
+    of a Horizons lookup
+    """
+    directory = get_cache().directory
+    if not os.access(directory, os.R_OK | os.W_OK):
+        raise RuntimeError(f"Ephemeris cache directory {directory} is not writable")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EphemerisCache(tmp, lambda observatory, times: get_earth(times))
+        times = Time("2025-01-01") + np.arange(2) * u.hour
+        cache.get("earth", times)
+        jsonify_skycoord(cache.get("earth", times))
+
+
+# Name and function of each check
+CHECKS: Dict[str, Callable[[], object]] = {
+    "hpc": lambda: normalize_hpc(
+        515, -342, "2012-07-05 13:01:46", "2012-07-05 13:01:46"
+    ),
+    "hgs2hpc": lambda: hgs2hpc(9, 9, "2024-01-01", "2024-01-02"),
+    "gse": lambda: gse_frame(0, 0, 0, "2024-01-02"),
+    "ephemeris": _check_ephemeris,
+}
+
+
+class SelfTest:
+    """
+    Runs the checks in a background thread and keeps the last result
+
+    Parameters
+    ----------
+    checks: Dict[str, Callable[[], object]]
+        Checks to run, each one fails by raising an exception
+    interval: float
+        Seconds between runs, 0 runs the checks once
+    warmup: Optional[Callable[[], object]]
+        Runs before the first checks, and before later runs until it
+        succeeds. Its error, if any, is reported as a failed "warmup"
+        check.
+    """
+
+    def __init__(
+        self,
+        checks: Dict[str, Callable[[], object]],
+        interval: float,
+        warmup: Optional[Callable[[], object]] = None,
+    ):
+        self.checks = checks
+        self.interval = interval
+        self.warmup = warmup
+        self._warmup_result: Optional[str] = None
+        self.result: Optional[dict] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._ran = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self) -> dict:
+        """
+        Runs every check once, stores and returns the result. The warm-up
+        runs first, unless it has already succeeded.
+        """
+        results = {}
+        if self.warmup is not None:
+            if self._warmup_result != "ok":
+                self._warmup_result = _run_check(self.warmup)
+            results["warmup"] = self._warmup_result
+        for name, check in self.checks.items():
+            results[name] = _run_check(check)
+        result = {
+            "ready": all(value == "ok" for value in results.values()),
+            "checks": results,
+            "checked_at": Time.now().isot,
+        }
+        self.result = result
+        self._ran.set()
+        return result
+
+    def start(self):
+        """
+        Starts the background thread, unless it is already running
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Waits up to timeout seconds for the first result and returns it
+        """
+        self._ran.wait(timeout)
+        return self.result
+
+    def status(self) -> dict:
+        """
+        Returns the last result, or a not ready result if the checks haven't
+        finished yet
+        """
+        if self.result is None:
+            return {"ready": False, "checks": {}, "checked_at": None}
+        return self.result
+
+    def _loop(self):
+        self.run()
+        while self.interval > 0 and not self._stop.wait(self.interval):
+            self.run()
+
+
+def _run_check(check: Callable[[], object]) -> str:
+    """
+    Runs a check and returns "ok", or the error it raised
+    """
+    try:
+        check()
+        return "ok"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+self_test = SelfTest(CHECKS, HEALTH_CHECK_INTERVAL, warm_up if STARTUP_WARMUP else None)
@@ -1,13 +1,27 @@
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
 import astropy.units as u
-from sunpy.coordinates import frames, transform_with_sun_center
-from sunpy.physics.differential_rotation import solar_rotate_coordinate
-from typing import List, Dict
+from sunpy.coordinates import frames
+from typing import List, Dict, Optional, Tuple
 
-from frames import get_helioviewer_frame, get_earth_frame
+import numpy as np
 
+import grid
+import rotation
+from metrics import BATCH_SIZE, stage
+from pool import should_shard, map_shards
+from rotation import resolve_engine
+from frames import (
+    get_helioviewer_frame,
+    get_earth_frame,
+    group_by_time,
+    solar_rotate_coordinate,
+    sun_center_transform,
+    transform_chunks,
+)
 
+
+@stage("transform")
 def hgs2hpc(lat: float, lon: float, coord_time: Time, target: Time) -> SkyCoord:
     """
     Takes a coordinate in the Heliographic Stonyhurst coordinate system
@@ -28,7 +42,7 @@ def hgs2hpc(lat: float, lon: float, coord_time: Time, target: Time) -> SkyCoord:
     """
     hv_frame = get_helioviewer_frame(target)
 
-    with transform_with_sun_center():
+    with sun_center_transform():
         coord = SkyCoord(
             lon * u.deg,
             lat * u.deg,
@@ -41,7 +55,9 @@ def hgs2hpc(lat: float, lon: float, coord_time: Time, target: Time) -> SkyCoord:
         return solar_rotate_coordinate(hpc, hv_frame.observer)
 
 
-def hgs2hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
+def hgs2hpc_batch(
+    coordinates: List[Dict], target: Time, engine: Optional[str] = None
+) -> List[Dict]:
     """
     Batch process multiple HGS to HPC coordinate transformations
 
@@ -51,6 +67,8 @@ def hgs2hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
         List of coordinate dictionaries with keys: lat, lon, coord_time
     target : Time
         Target observation time (same for all coordinates)
+    engine : Optional[str]
+        "sunpy", "numpy" (see rotation.py) or "grid" (see grid.py). Defaults to ROTATION_ENGINE.
 
     Returns
     -------
@@ -60,22 +78,105 @@ def hgs2hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
     if not coordinates:
         return []
 
-    hv_frame = get_helioviewer_frame(target)
+    with stage("parse_times"):
+        coord_times = Time([c["coord_time"] for c in coordinates])
+    xs, ys = hgs2hpc_columns(
+        [c["lat"] for c in coordinates],
+        [c["lon"] for c in coordinates],
+        coord_times,
+        target,
+        engine,
+    )
+    with stage("serialize"):
+        return [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+@stage("transform")
+def hgs2hpc_columns(
+    lats: List[float],
+    lons: List[float],
+    coord_times: Time,
+    target: Time,
+    engine: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column based version of hgs2hpc_batch
+    When many coordinates share a coord_time, each distinct coord_time is
+    transformed once, see frames.group_by_time.
+
+    Parameters
+    ----------
+    lats : List[float]
+        Latitude coordinates in degrees
+    lons : List[float]
+        Longitude coordinates in degrees
+    coord_times : Time
+        Array of times when each lat/lon coordinate was measured
+    target : Time
+        Target observation time (same for all coordinates)
+    engine : Optional[str]
+        "sunpy", "numpy" (see rotation.py) or "grid" (see grid.py). Defaults to ROTATION_ENGINE.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds
+    """
+    BATCH_SIZE.observe(len(lats), "hgs2hpc")
+    if len(lats) == 0:
+        return np.empty(0), np.empty(0)
 
-    with transform_with_sun_center():
-        lats = [c["lat"] for c in coordinates]
-        lons = [c["lon"] for c in coordinates]
-        coord_time = [c["coord_time"] for c in coordinates]
+    if resolve_engine(engine) == "numpy":
+        return rotation.hgs2hpc(lats, lons, coord_times, target)
+    if resolve_engine(engine) == "grid":
+        return grid.hgs2hpc(lats, lons, coord_times, target)
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if should_shard(len(lats)):
+        return map_shards(hgs2hpc_columns, (lats, lons), coord_times, target, engine)
+
+    groups = group_by_time(coord_times)
+    if groups is None:
+        return _hgs2hpc_arrays(lats, lons, coord_times, target)
+
+    # Transform each distinct coord_time with scalar frames, then scatter
+    # the results back into request order
+    out_x = np.empty(len(lats))
+    out_y = np.empty(len(lats))
+    for time, index in groups:
+        out_x[index], out_y[index] = _hgs2hpc_arrays(
+            lats[index], lons[index], time, target
+        )
+    return out_x, out_y
+
+
+def _hgs2hpc_arrays(
+    lats: np.ndarray, lons: np.ndarray, coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transforms the coordinates with a scalar or array coord_time.
+    See hgs2hpc_columns.
+    """
+    hv_frame = get_helioviewer_frame(target)
+    out_x = np.empty(len(lats))
+    out_y = np.empty(len(lats))
+    for part in transform_chunks(len(lats)):
+        times = coord_times if coord_times.isscalar else coord_times[part]
         coord = SkyCoord(
-            lons,
-            lats,
+            lons[part],
+            lats[part],
             unit="deg,deg",
             frame=frames.HeliographicStonyhurst,
-            obstime=coord_time,
+            obstime=times,
         )
-        # First convert to an hpc coordinate
-        earth_frame = get_earth_frame(coord_time)
-        hpc = coord.transform_to(earth_frame)
-        # Then apply the rotation as seen from Helioviewer
-        result = solar_rotate_coordinate(hpc, hv_frame.observer)
-    return [{"x": c.Tx.value.item(), "y": c.Ty.value.item()} for c in result]
+        earth_frame = get_earth_frame(times)
+        # The lock is taken per chunk so other requests can run in between
+        with sun_center_transform():
+            # First convert to an hpc coordinate
+            hpc = coord.transform_to(earth_frame)
+            # Then apply the rotation as seen from Helioviewer
+            result = solar_rotate_coordinate(hpc, hv_frame.observer)
+        out_x[part] = result.Tx.to_value(u.arcsec)
+        out_y[part] = result.Ty.to_value(u.arcsec)
+    return out_x, out_y
@@ -0,0 +1,37 @@
+"""
+Contains interpolation helpers shared by the ephemeris and frame modules
+"""
+
+import numpy as np
+
+
+def cubic_interpolate(samples: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    """
+    Interpolates evenly spaced samples with 4 point (cubic) Lagrange
+    interpolation. For a function sampled every h, the error is bounded by
+    3/128 * h^4 * max|f''''|.
+
+    Parameters
+    ----------
+    samples: np.ndarray
+        Samples along the last axis, i.e. shape (components, N)
+    offset: np.ndarray
+        Position of each interpolated point in units of sample spacing,
+        relative to the first sample. Points must lie between the second
+        and the second to last sample so every point has a 4 point stencil.
+
+    Returns
+    -------
+    np.ndarray
+        Interpolated values with shape (components, len(offset))
+    """
+    offset = np.asarray(offset, dtype=float)
+    index = np.clip(np.floor(offset).astype(np.int64), 1, samples.shape[-1] - 3)
+    s = offset - index
+    weights = [
+        -s * (s - 1) * (s - 2) / 6,
+        (s + 1) * (s - 1) * (s - 2) / 2,
+        -(s + 1) * s * (s - 2) / 2,
+        (s + 1) * s * (s - 1) / 6,
+    ]
+    return sum(w * samples[..., index + k - 1] for k, w in enumerate(weights))
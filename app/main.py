@@ -1,16 +1,76 @@
-from typing import Annotated, List, Union
+from contextlib import asynccontextmanager
+from typing import Annotated, Dict, List, Union
 
+import numpy as np
+import astropy.units as u
 from astropy.time import Time
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import Field
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import Field, PrivateAttr, model_validator
+
+from hgs2hpc import hgs2hpc, hgs2hpc_columns
+from normalizer import (
+    normalize_hpc,
+    normalize_hpc_columns,
+    gse_frame_batch,
+    gse_frame_columns,
+    gse_frame_arrays,
+    jsonify_skycoord,
+    jsonify_skycoords,
+)
+from ephemeris import MAX_OBSERVATORIES, get_cache, get_position, get_positions
+from frames import frame_cache_info
+import grid
+import metrics
+from metrics import MetricsMiddleware
+from profiling import PROFILING_TOKEN, ProfiledRoute, ProfilingMiddleware
+from health import self_test
+from admission import ADMISSION_CONTROL, AdmissionMiddleware
+from binary import NpzRoute, npz_endpoint, check_fields, epoch_to_time
+import coalesce
+from coalesce import Coalescer
+from response_cache import (
+    POSITION_CACHE_MAX_AGE,
+    cached_json,
+    response_cache_info,
+    time_key,
+)
+import rotation
+from streaming import ndjson_body, stream_ndjson
+from rotation import Engine, resolve_engine
+from validation import (
+    AstropyTime,
+    HvBaseModel,
+    HvRequestModel,
+    TimeString,
+    check_columns,
+    make_times,
+    time_formats,
+)
+
 
-from hgs2hpc import hgs2hpc, hgs2hpc_batch
-from normalizer import normalize_hpc, normalize_hpc_batch, gse_frame, jsonify_skycoord
-from ephemeris import get_position
-from validation import AstropyTime, HvBaseModel
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The warm-up and readiness self-test run in the background, so
+    # /health-check answers right away and /ready once they have finished
+    self_test.start()
+    _metrics_writer.start()
+    yield
+    self_test.stop()
+    _metrics_writer.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+# Lets batch routes accept .npz bodies, see binary.py. With profiling on,
+# handlers are also wrapped so they can be profiled, see profiling.py
+app.router.route_class = ProfiledRoute if PROFILING_TOKEN else NpzRoute
+
+# Added before CORS so rejected requests still get CORS headers
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
 
 origins = ["*"]
 
@@ -21,14 +81,78 @@ app.add_middleware(
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
 )
+# Outermost, so request latency includes time spent waiting for admission
+app.add_middleware(MetricsMiddleware)
+
+if PROFILING_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+
+@app.exception_handler(RequestValidationError)
+async def _validation_error(request: Request, exc: RequestValidationError):
+    "FastAPI's default 422 response, which also works when the input has NaN"
+    detail = _finite_floats(jsonable_encoder(exc.errors()))
+    return JSONResponse({"detail": detail}, status_code=422)
+
+
+def _finite_floats(value):
+    "Replaces NaN and infinite floats, which JSON can't represent, with strings"
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: _finite_floats(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_finite_floats(item) for item in value]
+    return value
+
+
+def _coalesce_key(target: Time, engine: Union[Engine, None]) -> tuple:
+    "Single point requests are batched together when they share this key"
+    target = target.utc
+    return (float(target.jd1), float(target.jd2), engine)
+
 
+def _coalesce_target(key: tuple) -> Time:
+    "Returns the target time of a coalesce key"
+    return Time(key[0], key[1], format="jd", scale="utc")
 
-class Hgs2HpcQueryParameters(HvBaseModel):
+
+def _hgs2hpc_coalesced(key: tuple, items: List[tuple]) -> List[tuple]:
+    "Transforms a batch of coalesced GET /hgs2hpc requests"
+    xs, ys = hgs2hpc_columns(
+        [item[0] for item in items],
+        [item[1] for item in items],
+        Time([item[2] for item in items]),
+        _coalesce_target(key),
+        key[2],
+    )
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def _hpc_coalesced(key: tuple, items: List[tuple]) -> List[tuple]:
+    "Transforms a batch of coalesced GET /hpc requests"
+    xs, ys = normalize_hpc_columns(
+        [item[0] for item in items],
+        [item[1] for item in items],
+        Time([item[2] for item in items]),
+        _coalesce_target(key),
+        key[2],
+    )
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+_hgs2hpc_coalescer = Coalescer(_hgs2hpc_coalesced)
+_hpc_coalescer = Coalescer(_hpc_coalesced)
+
+
+class Hgs2HpcQueryParameters(HvRequestModel):
     lat: float = Field(ge=-90, le=90)
     lon: float
     coord_time: AstropyTime
     # Defaults to coord_time via constructor if None
     target: Union[AstropyTime, None] = None
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -41,9 +165,34 @@ class Hgs2HpcQueryParameters(HvBaseModel):
     summary="Convert Heliographic Stonyhurst coordinate to Helioprojective coordinate in Helioviewer's POV",
 )
 # def _hgs2hpc(lat: float, lon: float, coord_time: str, target: Union[str, None] = None):
-def _hgs2hpc(params: Annotated[Hgs2HpcQueryParameters, Query()]):
+def _hgs2hpc(params: Annotated[Hgs2HpcQueryParameters, Query()], request: Request):
     "Convert a latitude/longitude coordinate to the equivalent helioprojective coordinate at the given target time"
+    key = (
+        "hgs2hpc",
+        params.lat,
+        params.lon,
+        time_key(params.coord_time),
+        time_key(params.target),
+        resolve_engine(params.engine),
+    )
+    return cached_json(request, key, lambda: _hgs2hpc_point(params))
+
+
+def _hgs2hpc_point(params: Hgs2HpcQueryParameters) -> dict:
+    "Transforms the coordinate given to GET /hgs2hpc"
     #    try:
+    if coalesce.COALESCE_WINDOW > 0:
+        x, y = _hgs2hpc_coalescer.submit(
+            _coalesce_key(params.target, params.engine),
+            (params.lat, params.lon, params.coord_time),
+            coalesce.COALESCE_WINDOW / 1000,
+        )
+        return {"x": x, "y": y}
+    if resolve_engine(params.engine) != "sunpy":
+        xs, ys = hgs2hpc_columns(
+            [params.lat], [params.lon], params.coord_time, params.target, params.engine
+        )
+        return {"x": xs[0].item(), "y": ys[0].item()}
     coord = hgs2hpc(params.lat, params.lon, params.coord_time, params.target)
     return {"x": coord.Tx.value, "y": coord.Ty.value}
 
@@ -51,37 +200,143 @@ def _hgs2hpc(params: Annotated[Hgs2HpcQueryParameters, Query()]):
 class Hgs2HpcCoordInput(HvBaseModel):
     lat: float = Field(ge=-90, le=90)
     lon: float
-    coord_time: AstropyTime
+    coord_time: TimeString
 
 
-class Hgs2HpcBatchInput(HvBaseModel):
+class Hgs2HpcBatchInput(HvRequestModel):
     coordinates: List[Hgs2HpcCoordInput]
     target: AstropyTime
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
+    # All coordinate times parsed in a single call
+    _coord_times: Time = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _parse_coord_times(self):
+        self._coord_times = make_times([c.coord_time for c in self.coordinates])
+        return self
+
+
+def _npz_engine(arrays: Dict[str, np.ndarray]) -> Union[Engine, None]:
+    "Returns the engine selected by an npz request, if any"
+    if "engine" not in arrays:
+        return None
+    engine = str(arrays["engine"])
+    if engine not in rotation.ENGINES:
+        raise ValueError(f"engine must be one of {rotation.ENGINES}")
+    return engine
+
+
+def _hgs2hpc_npz(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    "Binary version of POST /hgs2hpc, see binary.py"
+    check_fields(
+        arrays,
+        floats=["lat", "lon"],
+        times=["coord_time"],
+        scalar_times=["target"],
+        optional=["engine"],
+    )
+    # Written so NaN, which fails every comparison, is invalid too
+    invalid = np.flatnonzero(~(np.abs(arrays["lat"]) <= 90))
+    if len(invalid) > 0:
+        index = invalid[0]
+        raise ValueError(
+            f"Latitude at index {index} must be between -90 and 90, got {arrays['lat'][index]}"
+        )
+    xs, ys = hgs2hpc_columns(
+        arrays["lat"],
+        arrays["lon"],
+        epoch_to_time(arrays["coord_time"]),
+        epoch_to_time(arrays["target"]),
+        _npz_engine(arrays),
+    )
+    return {"x": xs, "y": ys}
 
 
 @app.post(
     "/hgs2hpc",
     summary="Convert Heliographic Stonyhurst coordinate to Helioprojective coordinate in Helioviewer's POV",
 )
+@npz_endpoint(_hgs2hpc_npz)
 def _hgs2hpc_post(params: Hgs2HpcBatchInput):
     "Convert a latitude/longitude coordinate to the equivalent helioprojective coordinate at the given target time"
-    # Prepare coordinates for batch processing
-    coords_input = [
-        {"lat": c.lat, "lon": c.lon, "coord_time": c.coord_time}
-        for c in params.coordinates
-    ]
+    xs, ys = hgs2hpc_columns(
+        [c.lat for c in params.coordinates],
+        [c.lon for c in params.coordinates],
+        params._coord_times,
+        params.target,
+        params.engine,
+    )
+    return {"coordinates": [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]}
+
+
+class Hgs2HpcColumnsInput(HvRequestModel):
+    lat: List[float]
+    lon: List[float]
+    coord_time: List[str]
+    target: AstropyTime
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
+    # All coordinate times parsed in a single call
+    _coord_times: Time = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        check_columns(lat=self.lat, lon=self.lon, coord_time=self.coord_time)
+        # Written so NaN, which fails every comparison, is invalid too
+        invalid = np.flatnonzero(~(np.abs(np.asarray(self.lat)) <= 90))
+        if len(invalid) > 0:
+            index = invalid[0]
+            raise ValueError(
+                f"Latitude at index {index} must be between -90 and 90, got {self.lat[index]}"
+            )
+        self._coord_times = make_times(self.coord_time)
+        return self
 
-    results = hgs2hpc_batch(coords_input, params.target)
 
-    return {"coordinates": results}
+@app.post(
+    "/hgs2hpc/columns",
+    summary="Column based version of POST /hgs2hpc",
+)
+def _hgs2hpc_columns(params: Hgs2HpcColumnsInput):
+    "Convert columns of latitude/longitude coordinates to helioprojective coordinates at the given target time"
+    xs, ys = hgs2hpc_columns(
+        params.lat, params.lon, params._coord_times, params.target, params.engine
+    )
+    return {"x": xs.tolist(), "y": ys.tolist()}
 
 
-class NormalizeHpcQueryParameters(HvBaseModel):
+@app.post(
+    "/hgs2hpc/stream",
+    summary="Streaming NDJSON version of POST /hgs2hpc",
+    openapi_extra=ndjson_body(Hgs2HpcCoordInput),
+)
+async def _hgs2hpc_stream(
+    request: Request, target: AstropyTime, engine: Union[Engine, None] = None
+):
+    "Convert a stream of latitude/longitude coordinates to helioprojective coordinates at the given target time, one JSON object per line"
+
+    def transform(rows: List[Hgs2HpcCoordInput]) -> List[dict]:
+        xs, ys = hgs2hpc_columns(
+            [r.lat for r in rows],
+            [r.lon for r in rows],
+            make_times([r.coord_time for r in rows]),
+            target,
+            engine,
+        )
+        return [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]
+
+    return stream_ndjson(request, Hgs2HpcCoordInput, transform)
+
+
+class NormalizeHpcQueryParameters(HvRequestModel):
     x: float
     y: float
     coord_time: AstropyTime
     # Defaults to coord_time via constructor if None
     target: Union[AstropyTime, None] = None
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -90,7 +345,34 @@ class NormalizeHpcQueryParameters(HvBaseModel):
 
 
 @app.get("/hpc", summary="Get HPC coordinate for Helioviewer POV")
-def _normalize_hpc(params: Annotated[NormalizeHpcQueryParameters, Query()]):
+def _normalize_hpc(
+    params: Annotated[NormalizeHpcQueryParameters, Query()], request: Request
+):
+    key = (
+        "hpc",
+        params.x,
+        params.y,
+        time_key(params.coord_time),
+        time_key(params.target),
+        resolve_engine(params.engine),
+    )
+    return cached_json(request, key, lambda: _normalize_hpc_point(params))
+
+
+def _normalize_hpc_point(params: NormalizeHpcQueryParameters) -> dict:
+    "Transforms the coordinate given to GET /hpc"
+    if coalesce.COALESCE_WINDOW > 0:
+        x, y = _hpc_coalescer.submit(
+            _coalesce_key(params.target, params.engine),
+            (params.x, params.y, params.coord_time),
+            coalesce.COALESCE_WINDOW / 1000,
+        )
+        return {"x": x, "y": y}
+    if resolve_engine(params.engine) != "sunpy":
+        xs, ys = normalize_hpc_columns(
+            [params.x], [params.y], params.coord_time, params.target, params.engine
+        )
+        return {"x": xs[0].item(), "y": ys[0].item()}
     coord = normalize_hpc(params.x, params.y, params.coord_time, params.target)
     return {"x": coord.Tx.value, "y": coord.Ty.value}
 
@@ -98,61 +380,342 @@ def _normalize_hpc(params: Annotated[NormalizeHpcQueryParameters, Query()]):
 class HpcCoordInput(HvBaseModel):
     x: float
     y: float
-    coord_time: AstropyTime
+    coord_time: TimeString
 
 
-class HpcBatchInput(HvBaseModel):
+class HpcBatchInput(HvRequestModel):
     coordinates: List[HpcCoordInput]
     target: AstropyTime
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
+    # All coordinate times parsed in a single call
+    _coord_times: Time = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _parse_coord_times(self):
+        self._coord_times = make_times([c.coord_time for c in self.coordinates])
+        return self
+
+
+def _normalize_hpc_npz(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    "Binary version of POST /hpc, see binary.py"
+    check_fields(
+        arrays,
+        floats=["x", "y"],
+        times=["coord_time"],
+        scalar_times=["target"],
+        optional=["engine"],
+    )
+    xs, ys = normalize_hpc_columns(
+        arrays["x"],
+        arrays["y"],
+        epoch_to_time(arrays["coord_time"]),
+        epoch_to_time(arrays["target"]),
+        _npz_engine(arrays),
+    )
+    return {"x": xs, "y": ys}
 
 
 @app.post("/hpc", summary="Batch normalize HPC coordinates for Helioviewer POV")
+@npz_endpoint(_normalize_hpc_npz)
 def _normalize_hpc_post(params: HpcBatchInput):
     "Normalize multiple HPC coordinates to Helioviewer's POV at the given target time"
-    coords_input = [
-        {"x": c.x, "y": c.y, "coord_time": c.coord_time} for c in params.coordinates
-    ]
+    xs, ys = normalize_hpc_columns(
+        [c.x for c in params.coordinates],
+        [c.y for c in params.coordinates],
+        params._coord_times,
+        params.target,
+        params.engine,
+    )
+    return {"coordinates": [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]}
+
+
+class HpcColumnsInput(HvRequestModel):
+    x: List[float]
+    y: List[float]
+    coord_time: List[str]
+    target: AstropyTime
+    # Defaults to ROTATION_ENGINE if None
+    engine: Union[Engine, None] = None
+    # All coordinate times parsed in a single call
+    _coord_times: Time = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        check_columns(x=self.x, y=self.y, coord_time=self.coord_time)
+        self._coord_times = make_times(self.coord_time)
+        return self
+
 
-    results = normalize_hpc_batch(coords_input, params.target)
+@app.post("/hpc/columns", summary="Column based version of POST /hpc")
+def _normalize_hpc_columns(params: HpcColumnsInput):
+    "Normalize columns of HPC coordinates to Helioviewer's POV at the given target time"
+    xs, ys = normalize_hpc_columns(
+        params.x, params.y, params._coord_times, params.target, params.engine
+    )
+    return {"x": xs.tolist(), "y": ys.tolist()}
 
-    return {"coordinates": results}
+
+@app.post(
+    "/hpc/stream",
+    summary="Streaming NDJSON version of POST /hpc",
+    openapi_extra=ndjson_body(HpcCoordInput),
+)
+async def _normalize_hpc_stream(
+    request: Request, target: AstropyTime, engine: Union[Engine, None] = None
+):
+    "Normalize a stream of HPC coordinates to Helioviewer's POV at the given target time, one JSON object per line"
+
+    def transform(rows: List[HpcCoordInput]) -> List[dict]:
+        xs, ys = normalize_hpc_columns(
+            [r.x for r in rows],
+            [r.y for r in rows],
+            make_times([r.coord_time for r in rows]),
+            target,
+            engine,
+        )
+        return [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]
+
+    return stream_ndjson(request, HpcCoordInput, transform)
 
 
 class GSECoordInput(HvBaseModel):
     x: float
     y: float
     z: float
-    time: AstropyTime
+    time: TimeString
 
 
-class GSEInput(HvBaseModel):
+class GSEInput(HvRequestModel):
     coordinates: List[GSECoordInput]
+    # All coordinate times parsed in a single call
+    _times: Time = PrivateAttr(None)
+    # Format of each input time, so results echo times in the same format
+    _formats: List[str] = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _parse_times(self):
+        times = [c.time for c in self.coordinates]
+        self._times = make_times(times)
+        self._formats = time_formats(times)
+        return self
+
+
+def _normalize_gse_npz(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    "Binary version of POST /gse2frame, see binary.py"
+    check_fields(arrays, floats=["x", "y", "z"], times=["time"])
+    coord = gse_frame_arrays(
+        arrays["x"], arrays["y"], arrays["z"], epoch_to_time(arrays["time"])
+    )
+    return {"x": coord[0], "y": coord[1], "z": coord[2], "time": arrays["time"]}
 
 
 @app.post("/gse2frame", summary="Convert GSE coordinates to Helioviewer 3D coordinates")
+@npz_endpoint(_normalize_gse_npz)
 def _normalize_gse(params: GSEInput):
-    coords = map(lambda c: gse_frame(c.x, c.y, c.z, c.time), params.coordinates)
-    return {"coordinates": list(coords)}
+    coords = gse_frame_batch(
+        [c.x for c in params.coordinates],
+        [c.y for c in params.coordinates],
+        [c.z for c in params.coordinates],
+        params._times,
+        params._formats,
+    )
+    return {"coordinates": coords}
+
+
+class GSEColumnsInput(HvRequestModel):
+    x: List[float]
+    y: List[float]
+    z: List[float]
+    time: List[str]
+    # All coordinate times parsed in a single call
+    _times: Time = PrivateAttr(None)
+    # Format of each input time, so results echo times in the same format
+    _formats: List[str] = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _check_columns(self):
+        check_columns(x=self.x, y=self.y, z=self.z, time=self.time)
+        self._times = make_times(self.time)
+        self._formats = time_formats(self.time)
+        return self
+
+
+@app.post("/gse2frame/columns", summary="Column based version of POST /gse2frame")
+def _normalize_gse_columns(params: GSEColumnsInput):
+    return gse_frame_columns(
+        params.x, params.y, params.z, params._times, params._formats
+    )
+
+
+@app.post(
+    "/gse2frame/stream",
+    summary="Streaming NDJSON version of POST /gse2frame",
+    openapi_extra=ndjson_body(GSECoordInput),
+)
+async def _normalize_gse_stream(request: Request):
+    "Convert a stream of GSE coordinates to Helioviewer 3D coordinates, one JSON object per line"
+
+    def transform(rows: List[GSECoordInput]) -> List[dict]:
+        times = [r.time for r in rows]
+        return gse_frame_batch(
+            [r.x for r in rows],
+            [r.y for r in rows],
+            [r.z for r in rows],
+            make_times(times),
+            time_formats(times),
+        )
+
+    return stream_ndjson(request, GSECoordInput, transform)
 
 
-class PositionInput(HvBaseModel):
+class PositionInput(HvRequestModel):
     start: AstropyTime
     stop: AstropyTime
 
 
 @app.get("/position/{observatory}")
-def _get_position(observatory: str, start: AstropyTime, stop: AstropyTime):
-    return {"coordinates": jsonify_skycoord(get_position(observatory, start, stop))}
+def _get_position(
+    request: Request,
+    observatory: str,
+    start: AstropyTime,
+    stop: AstropyTime,
+    cadence: Annotated[float, Query(gt=0)] = 3600,
+):
+    "Get the observatory's position from start to stop (inclusive) every cadence seconds"
+    # Returned times are formatted like start, so its format is part of the key
+    key = (
+        "position",
+        observatory,
+        time_key(start),
+        time_key(stop),
+        cadence,
+        start.format,
+    )
+    return cached_json(
+        request,
+        key,
+        lambda: _position(observatory, start, stop, cadence),
+        POSITION_CACHE_MAX_AGE,
+    )
+
+
+def _position(observatory: str, start: Time, stop: Time, cadence: float) -> dict:
+    "Looks up the positions for GET /position"
+    try:
+        positions = get_position(observatory, start, stop, cadence * u.s)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"coordinates": jsonify_skycoord(positions)}
+
+
+class PositionsInput(HvRequestModel):
+    observatories: List[str] = Field(min_length=1, max_length=MAX_OBSERVATORIES)
+    start: AstropyTime
+    stop: AstropyTime
+    cadence: float = Field(3600, gt=0)
+
+    @model_validator(mode="after")
+    def _unique_observatories(self):
+        # Results are keyed by observatory, so repeated names are looked up once
+        self.observatories = list(dict.fromkeys(self.observatories))
+        return self
+
+
+@app.post("/positions")
+def _get_positions(request: Request, params: PositionsInput):
+    "Get the positions of several observatories from start to stop (inclusive) every cadence seconds"
+    key = (
+        "positions",
+        tuple(params.observatories),
+        time_key(params.start),
+        time_key(params.stop),
+        params.cadence,
+        params.start.format,
+    )
+    return cached_json(request, key, lambda: _positions(params), POSITION_CACHE_MAX_AGE)
+
+
+def _positions(params: PositionsInput) -> dict:
+    "Looks up the positions for POST /positions"
+    try:
+        positions = get_positions(
+            params.observatories, params.start, params.stop, params.cadence * u.s
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"observatories": jsonify_skycoords(positions, params.observatories)}
 
 
 @app.get("/health-check", include_in_schema=False)
 def health_check():
     """
-    Performs a simple self test to make sure functions used will run
-    without exceptions
+    Liveness probe, only checks that the server is answering requests
     """
-    normalize_hpc(515, -342, "2012-07-05 13:01:46", "2012-07-05 13:01:46")
-    hgs2hpc(9, 9, "2024-01-01", "2024-01-02")
-    gse_frame(0, 0, 0, "2024-01-02")
-    jsonify_skycoord(get_position("SDO", Time("2025-01-01"), Time("2025-01-01")))
     return "success"
+
+
+@app.get("/ready", include_in_schema=False)
+def ready():
+    """
+    Readiness probe, returns the last result of the self test in health.py.
+    Answers with 503 until the self test has passed.
+    """
+    # Starts the self test if the server was started without the lifespan
+    self_test.start()
+    status = self_test.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/cache-info", include_in_schema=False)
+def cache_info():
+    "Returns hit rates and sizes of the server's caches"
+    return {
+        "responses": response_cache_info(),
+        "frames": frame_cache_info(),
+        "ephemeris": get_cache().metrics,
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    "Returns the server's metrics in the Prometheus text format, see metrics.py"
+    return PlainTextResponse(
+        metrics.render_all(_cache_stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+def _cache_stats() -> Dict[str, tuple]:
+    "Returns (hits, misses) of each cache for /metrics"
+    responses = response_cache_info()
+    frames = frame_cache_info()
+    grids = grid._get_grid.cache_info()
+    return {
+        "responses": (responses["hits"], responses["misses"]),
+        "earth_frames": (frames["earth"]["hits"], frames["earth"]["misses"]),
+        "helioviewer_frames": (
+            frames["helioviewer"]["hits"],
+            frames["helioviewer"]["misses"],
+        ),
+        "ephemeris": (
+            metrics.EPHEMERIS_ROWS.value("hit"),
+            metrics.EPHEMERIS_ROWS.value("miss"),
+        ),
+        "grids": (grids.hits, grids.misses),
+        # Points answered from a grid, or computed exactly
+        "grid_points": (grid.metrics["interpolated"], grid.metrics["exact"]),
+        # Requests which joined another request's batch, or led a batch
+        "coalesce_hgs2hpc": (
+            _hgs2hpc_coalescer.metrics["coalesced"],
+            _hgs2hpc_coalescer.metrics["batches"],
+        ),
+        "coalesce_hpc": (
+            _hpc_coalescer.metrics["coalesced"],
+            _hpc_coalescer.metrics["batches"],
+        ),
+    }
+
+
+# Shares this worker's metrics with the others when METRICS_DIR is set
+_metrics_writer = metrics.SnapshotWriter(_cache_stats)
@@ -0,0 +1,460 @@
+"""
+Prometheus metrics.
+
+Request latency is recorded per route by MetricsMiddleware, and the time
+spent in each part of the transform pipeline is recorded with stage():
+
+    validation  pydantic validation of request parameters and bodies
+    parse_times parsing time strings into astropy Time arrays
+    frames      looking up or building earth and helioviewer frames
+    transform   running the transform, including frames and rotate
+    rotate      sunpy's solar_rotate_coordinate
+    ephemeris   reading observatory positions, including Horizons calls
+    serialize   converting results to JSON friendly lists and dicts
+
+GET /metrics returns every metric in the Prometheus text format. Recording
+a value takes a lock and a few microseconds, so metrics are always on.
+
+Metrics are kept in memory by each process. When the server runs several
+worker processes (i.e. `fastapi run --workers 4`), set METRICS_DIR to a
+directory shared by them. Each process then writes its metrics to a file
+there every METRICS_SYNC_INTERVAL seconds, and GET /metrics returns the sum
+over every file, whichever worker answers it. Stage timings recorded by
+pool.py's shard processes are sent back with each shard's results.
+"""
+
+import copy
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+# Histogram buckets for the number of coordinates in a batch
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+# Directory shared by the server's worker processes. Empty keeps metrics per
+# process. Files of exited processes are kept so counters never go down,
+# the directory should be emptied before the server starts.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+# Seconds between writes of each process's metrics to METRICS_DIR
+METRICS_SYNC_INTERVAL = float(os.environ.get("METRICS_SYNC_INTERVAL", 5))
+
+
+class Counter:
+    """
+    Monotonically increasing count per set of label values
+
+    Parameters
+    ----------
+    name: str
+        Metric name
+    documentation: str
+        Help text
+    labels: Sequence[str]
+        Label names, values are passed to inc in the same order
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def state(self, clear: bool = False) -> list:
+        """
+        Returns the values as a JSON friendly list of [labels, value],
+        which can be passed to merge. Values are reset if clear is set.
+        """
+        with self._lock:
+            values = [[list(k), v] for k, v in self._values.items()]
+            if clear:
+                self._values.clear()
+        return values
+
+    def merge(self, state: list):
+        """
+        Adds values returned by state
+        """
+        for labels, value in state:
+            self.inc(*labels, amount=value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = _header(self.name, self.documentation, "counter")
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values per set of label values
+
+    Parameters
+    ----------
+    name: str
+        Metric name
+    documentation: str
+        Help text
+    labels: Sequence[str]
+        Label names, values are passed to observe in the same order
+    buckets: Sequence[float]
+        Upper bounds of the buckets, in increasing order
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: [count in each bucket and +Inf, sum]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return 0 if entry is None else sum(entry[0])
+
+    def state(self, clear: bool = False) -> list:
+        """
+        Returns the values as a JSON friendly list of [labels, bucket
+        counts, sum], which can be passed to merge. Values are reset if
+        clear is set.
+        """
+        with self._lock:
+            values = [[list(k), list(v[0]), v[1]] for k, v in self._values.items()]
+            if clear:
+                self._values.clear()
+        return values
+
+    def merge(self, state: list):
+        """
+        Adds values returned by state
+        """
+        with self._lock:
+            for labels, counts, total in state:
+                entry = self._values.get(tuple(labels))
+                if entry is None:
+                    entry = self._values[tuple(labels)] = [[0] * len(counts), 0.0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = _header(self.name, self.documentation, "histogram")
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                label_text = _labels(self.labels + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {total:g}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+REGISTRY: List = []
+
+REQUEST_SECONDS = Histogram(
+    "coordinator_request_seconds",
+    "Time to answer a request, until the last byte of the response is sent",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "coordinator_stage_seconds",
+    "Time spent in each stage of the transform pipeline",
+    ["stage"],
+)
+BATCH_SIZE = Histogram(
+    "coordinator_batch_size",
+    "Number of coordinates or positions per transform call",
+    ["operation"],
+    SIZE_BUCKETS,
+)
+HORIZONS_REQUESTS = Counter(
+    "coordinator_horizons_requests_total",
+    "Calls made to JPL Horizons",
+    ["outcome"],
+)
+HORIZONS_SECONDS = Histogram(
+    "coordinator_horizons_request_seconds",
+    "Duration of calls made to JPL Horizons",
+)
+EPHEMERIS_ROWS = Counter(
+    "coordinator_ephemeris_rows_total",
+    "Observatory positions read from the ephemeris cache (hit) or fetched (miss)",
+    ["result"],
+)
+
+_active_stages: ContextVar[FrozenSet[str]] = ContextVar(
+    "active_stages", default=frozenset()
+)
+
+
+def active_stages() -> FrozenSet[str]:
+    """
+    Returns the stages being recorded by the current context
+    """
+    return _active_stages.get()
+
+
+@contextmanager
+def skip_stages(names: Iterable[str]):
+    """
+    Stages with the given names aren't recorded inside the context, i.e.
+    in a pool worker running part of a stage the server is already timing
+    """
+    token = _active_stages.set(_active_stages.get() | frozenset(names))
+    try:
+        yield
+    finally:
+        _active_stages.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Records the time spent inside the context as the given pipeline stage.
+    A stage which is entered again while it is running, i.e. for a nested
+    pydantic model, is only recorded once.
+    """
+    active = _active_stages.get()
+    if name in active:
+        yield
+        return
+    token = _active_stages.set(active | {name})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, name)
+        _active_stages.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware which records the latency of every HTTP request,
+    labeled by the path of the route which handled it
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], path, status
+            )
+
+
+def render_caches(caches: Dict[str, Tuple[int, int]]) -> List[str]:
+    """
+    Returns hit, miss and hit ratio metrics for caches given as
+    {name: (hits, misses)}
+    """
+    hits = _header("coordinator_cache_hits_total", "Cache hits", "counter")
+    misses = _header("coordinator_cache_misses_total", "Cache misses", "counter")
+    ratios = _header("coordinator_cache_hit_ratio", "Hits divided by lookups", "gauge")
+    for name, (hit, miss) in sorted(caches.items()):
+        label = _labels(("cache",), (name,))
+        hits.append(f"coordinator_cache_hits_total{label} {hit}")
+        misses.append(f"coordinator_cache_misses_total{label} {miss}")
+        ratio = hit / (hit + miss) if hit + miss else 0.0
+        ratios.append(f"coordinator_cache_hit_ratio{label} {ratio:g}")
+    return hits + misses + ratios
+
+
+def render(extra: Iterable[str] = (), registry: Optional[List] = None) -> str:
+    """
+    Returns every registered metric, followed by extra lines, in the
+    Prometheus text format
+    """
+    registry = REGISTRY if registry is None else registry
+    lines = [line for metric in registry for line in metric.render()]
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+def render_all(caches: Dict[str, Tuple[int, int]]) -> str:
+    """
+    Returns the metrics and the given cache statistics of this process, or
+    their sum over every process sharing METRICS_DIR
+    """
+    if not METRICS_DIR:
+        return render(render_caches(caches))
+    write_snapshot(METRICS_DIR, caches)
+    registry, caches = read_snapshots(METRICS_DIR)
+    return render(render_caches(caches), registry)
+
+
+def write_snapshot(directory: str, caches: Dict[str, Tuple[int, int]]):
+    """
+    Writes this process's metrics and cache statistics to a file in the
+    directory named after its pid
+    """
+    snapshot = {
+        "metrics": {metric.name: metric.state() for metric in REGISTRY},
+        "caches": caches,
+    }
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    # Written to a temporary file first, so readers never see part of it
+    with open(path + ".tmp", "w") as fp:
+        json.dump(snapshot, fp)
+    os.replace(path + ".tmp", path)
+
+
+def read_snapshots(directory: str) -> Tuple[List, Dict[str, Tuple[int, int]]]:
+    """
+    Returns a registry of copies of the registered metrics and the cache
+    statistics, each summed over every file written by write_snapshot
+    """
+    registry = []
+    for metric in REGISTRY:
+        total = copy.copy(metric)
+        total._values = {}
+        total._lock = threading.Lock()
+        registry.append(total)
+    by_name = {metric.name: metric for metric in registry}
+    caches: Dict[str, Tuple[int, int]] = {}
+    for path in sorted(glob.glob(os.path.join(directory, "metrics-*.json"))):
+        try:
+            with open(path) as fp:
+                snapshot = json.load(fp)
+        except (OSError, ValueError):
+            # Removed since it was listed
+            continue
+        for name, state in snapshot["metrics"].items():
+            if name in by_name:
+                by_name[name].merge(state)
+        for name, (hits, misses) in snapshot["caches"].items():
+            total_hits, total_misses = caches.get(name, (0, 0))
+            caches[name] = (total_hits + hits, total_misses + misses)
+    return registry, caches
+
+
+class SnapshotWriter:
+    """
+    Writes this process's metrics to METRICS_DIR every
+    METRICS_SYNC_INTERVAL seconds in a background thread, and once more
+    when stopped
+
+    Parameters
+    ----------
+    caches: Callable[[], Dict[str, Tuple[int, int]]]
+        Returns the cache statistics to write, see render_caches
+    """
+
+    def __init__(self, caches: Callable[[], Dict[str, Tuple[int, int]]]):
+        self.caches = caches
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not METRICS_DIR or self._thread is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        while True:
+            write_snapshot(METRICS_DIR, self.caches())
+            if self._stop.wait(METRICS_SYNC_INTERVAL):
+                write_snapshot(METRICS_DIR, self.caches())
+                return
+
+
+def _header(name: str, documentation: str, kind: str) -> List[str]:
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,16 +1,26 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
 import astropy.units as u
-from sunpy.coordinates import (
-    transform_with_sun_center,
-    GeocentricSolarEcliptic,
-)
+from sunpy.coordinates import GeocentricSolarEcliptic
 from sunpy.coordinates.screens import SphericalScreen
-from sunpy.physics.differential_rotation import solar_rotate_coordinate
-from frames import get_helioviewer_frame, get_earth_frame, get_3d_frame
+import rotation
+from metrics import BATCH_SIZE, stage
+from pool import should_shard, map_shards
+from rotation import resolve_engine
+from frames import (
+    get_helioviewer_frame,
+    get_earth_frame,
+    get_3d_frame,
+    solar_rotate_coordinate,
+    sun_center_transform,
+    transform_chunks,
+    group_by_time,
+)
 
 
+@stage("transform")
 def normalize_hpc(x: float, y: float, coord_time: Time, target: Time) -> SkyCoord:
     """
     Accepts a Helioprojective coordinate which is assumed to be measured
@@ -28,7 +38,7 @@ def normalize_hpc(x: float, y: float, coord_time: Time, target: Time) -> SkyCoor
     target: Time
         Desired time for the new coordinates
     """
-    with transform_with_sun_center():
+    with sun_center_transform():
         earth_frame = get_earth_frame(coord_time)
         hv_frame = get_helioviewer_frame(target)
         with SphericalScreen(earth_frame.observer, only_off_disk=True):
@@ -36,7 +46,9 @@ def normalize_hpc(x: float, y: float, coord_time: Time, target: Time) -> SkyCoor
             return solar_rotate_coordinate(real_coord, hv_frame.observer)
 
 
-def normalize_hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
+def normalize_hpc_batch(
+    coordinates: List[Dict], target: Time, engine: Optional[str] = None
+) -> List[Dict]:
     """
     Batch process multiple HPC coordinate normalizations
 
@@ -46,6 +58,9 @@ def normalize_hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
         List of coordinate dictionaries with keys: x, y, coord_time
     target : Time
         Target observation time (same for all coordinates)
+    engine : Optional[str]
+        "sunpy" or "numpy" (see rotation.py). "grid" uses numpy. Defaults to
+        ROTATION_ENGINE.
 
     Returns
     -------
@@ -55,23 +70,102 @@ def normalize_hpc_batch(coordinates: List[Dict], target: Time) -> List[Dict]:
     if not coordinates:
         return []
 
-    hv_frame = get_helioviewer_frame(target)
+    with stage("parse_times"):
+        coord_times = Time([c["coord_time"] for c in coordinates])
+    xs, ys = normalize_hpc_columns(
+        [c["x"] for c in coordinates],
+        [c["y"] for c in coordinates],
+        coord_times,
+        target,
+        engine,
+    )
+    with stage("serialize"):
+        return [{"x": x, "y": y} for x, y in zip(xs.tolist(), ys.tolist())]
 
-    with transform_with_sun_center():
-        xs = [c["x"] for c in coordinates]
-        ys = [c["y"] for c in coordinates]
-        coord_times = [c["coord_time"] for c in coordinates]
 
-        earth_frame = get_earth_frame(coord_times)
-        with SphericalScreen(earth_frame.observer, only_off_disk=True):
-            real_coord = SkyCoord(
-                xs,
-                ys,
-                unit="arcsec,arcsec",
-                frame=earth_frame,
-            )
-            result = solar_rotate_coordinate(real_coord, hv_frame.observer)
-    return [{"x": c.Tx.value.item(), "y": c.Ty.value.item()} for c in result]
+@stage("transform")
+def normalize_hpc_columns(
+    xs: List[float],
+    ys: List[float],
+    coord_times: Time,
+    target: Time,
+    engine: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column based version of normalize_hpc_batch
+    When many coordinates share a coord_time, each distinct coord_time is
+    transformed once, see frames.group_by_time.
+
+    Parameters
+    ----------
+    xs : List[float]
+        X coordinates in arcseconds
+    ys : List[float]
+        Y coordinates in arcseconds
+    coord_times : Time
+        Array of observation times, one per coordinate
+    target : Time
+        Target observation time (same for all coordinates)
+    engine : Optional[str]
+        "sunpy" or "numpy" (see rotation.py). "grid" uses numpy. Defaults to
+        ROTATION_ENGINE.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds
+    """
+    BATCH_SIZE.observe(len(xs), "hpc")
+    if len(xs) == 0:
+        return np.empty(0), np.empty(0)
+
+    # There is no grid version of normalize_hpc, it uses the numpy engine
+    if resolve_engine(engine) in ("numpy", "grid"):
+        return rotation.normalize_hpc(xs, ys, coord_times, target)
+
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    if should_shard(len(xs)):
+        return map_shards(normalize_hpc_columns, (xs, ys), coord_times, target, engine)
+
+    groups = group_by_time(coord_times)
+    if groups is None:
+        return _normalize_hpc_arrays(xs, ys, coord_times, target)
+
+    # Transform each distinct coord_time with scalar frames, then scatter
+    # the results back into request order
+    out_x = np.empty(len(xs))
+    out_y = np.empty(len(xs))
+    for time, index in groups:
+        out_x[index], out_y[index] = _normalize_hpc_arrays(
+            xs[index], ys[index], time, target
+        )
+    return out_x, out_y
+
+
+def _normalize_hpc_arrays(
+    xs: np.ndarray, ys: np.ndarray, coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transforms the coordinates with a scalar or array coord_time.
+    See normalize_hpc_columns.
+    """
+    hv_frame = get_helioviewer_frame(target)
+    out_x = np.empty(len(xs))
+    out_y = np.empty(len(xs))
+    for part in transform_chunks(len(xs)):
+        times = coord_times if coord_times.isscalar else coord_times[part]
+        earth_frame = get_earth_frame(times)
+        real_coord = SkyCoord(
+            xs[part], ys[part], unit="arcsec,arcsec", frame=earth_frame
+        )
+        # The lock is taken per chunk so other requests can run in between
+        with sun_center_transform():
+            with SphericalScreen(earth_frame.observer, only_off_disk=True):
+                result = solar_rotate_coordinate(real_coord, hv_frame.observer)
+        out_x[part] = result.Tx.to_value(u.arcsec)
+        out_y[part] = result.Ty.to_value(u.arcsec)
+    return out_x, out_y
 
 
 def skycoord_to_3dframe(coord: SkyCoord) -> SkyCoord:
@@ -83,10 +177,11 @@ def skycoord_to_3dframe(coord: SkyCoord) -> SkyCoord:
     ----------
     coord: SkyCoord
     """
-    with transform_with_sun_center():
+    with sun_center_transform():
         return coord.transform_to(get_3d_frame())
 
 
+@stage("transform")
 def gse_frame(x: float, y: float, z: float, time: Time) -> dict:
     """
     Accepts a Geocentric Solar Ecliptic system coordinate and transforms it to
@@ -109,19 +204,235 @@ def gse_frame(x: float, y: float, z: float, time: Time) -> dict:
     return _normalize_skycoord(real_coord)
 
 
+def gse_frame_batch(
+    xs: List[float],
+    ys: List[float],
+    zs: List[float],
+    times: List[Time],
+    formats: Optional[List[str]] = None,
+) -> List[dict]:
+    """
+    Batch version of gse_frame. All coordinates are placed in a single
+    array valued GSE coordinate and transformed to hv's unified coordinate
+    frame at once.
+
+    Parameters
+    ----------
+    xs: List[float]
+        X coordinates in kilometers
+    ys: List[float]
+        Y coordinates in kilometers
+    zs: List[float]
+        Z coordinates in kilometers
+    times: List[Time]
+        Coordinate times, one per coordinate
+    formats: Optional[List[str]]
+        Format of each returned time. Defaults to the format of each
+        element when times is a list, so results match gse_frame on each
+        point, or times.format when times is an array valued Time.
+
+    Returns
+    -------
+    List[dict]
+        List of results with keys: x, y, z, time
+    """
+    if len(xs) == 0:
+        return []
+    with stage("parse_times"):
+        if formats is None and not isinstance(times, Time):
+            formats = [time.format for time in times]
+        times = Time(times)
+    columns = gse_frame_columns(xs, ys, zs, times, formats)
+    with stage("serialize"):
+        return [
+            {"x": x, "y": y, "z": z, "time": time}
+            for x, y, z, time in zip(
+                columns["x"], columns["y"], columns["z"], columns["time"]
+            )
+        ]
+
+
+def gse_frame_columns(
+    xs: List[float],
+    ys: List[float],
+    zs: List[float],
+    times: Time,
+    formats: Optional[List[str]] = None,
+) -> Dict[str, list]:
+    """
+    Column based version of gse_frame_batch
+
+    Parameters
+    ----------
+    xs: List[float]
+        X coordinates in kilometers
+    ys: List[float]
+        Y coordinates in kilometers
+    zs: List[float]
+        Z coordinates in kilometers
+    times: Time
+        Array of coordinate times, one per coordinate
+    formats: Optional[List[str]]
+        Format of each returned time, defaults to times.format
+
+    Returns
+    -------
+    Dict[str, list]
+        Lists of results with keys: x, y, z, time
+    """
+    if len(xs) == 0:
+        return {"x": [], "y": [], "z": [], "time": []}
+    xs, ys, zs = gse_frame_arrays(xs, ys, zs, times)
+    with stage("serialize"):
+        return {
+            "x": xs.tolist(),
+            "y": ys.tolist(),
+            "z": zs.tolist(),
+            "time": _format_times(times, formats).tolist(),
+        }
+
+
+@stage("transform")
+def gse_frame_arrays(
+    xs: np.ndarray, ys: np.ndarray, zs: np.ndarray, times: Time
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of gse_frame_columns
+
+    Parameters
+    ----------
+    xs: np.ndarray
+        X coordinates in kilometers
+    ys: np.ndarray
+        Y coordinates in kilometers
+    zs: np.ndarray
+        Z coordinates in kilometers
+    times: Time
+        Array of coordinate times, one per coordinate
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        x, y and z coordinates in kilometers
+    """
+    BATCH_SIZE.observe(len(xs), "gse")
+    if len(xs) == 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    zs = np.asarray(zs, dtype=float)
+    if should_shard(len(xs)):
+        return map_shards(gse_frame_arrays, (xs, ys, zs), times)
+    return _to_3d_frame(_gse_coord(xs, ys, zs, times))
+
+
+def _gse_coord(
+    xs: List[float], ys: List[float], zs: List[float], times: List[Time]
+) -> GeocentricSolarEcliptic:
+    """
+    Builds a single array valued GSE coordinate from the given columns
+    """
+    return GeocentricSolarEcliptic(
+        np.asarray(xs, dtype=float) * u.km,
+        np.asarray(ys, dtype=float) * u.km,
+        np.asarray(zs, dtype=float) * u.km,
+        obstime=Time(times),
+        representation_type="cartesian",
+    )
+
+
 def jsonify_skycoord(coord: SkyCoord) -> list:
     """
-    Converts the skycoord to a dict in kilometers after transforming it into
-    the standard 3D frame.
+    Converts the skycoord to a list of dicts in kilometers after transforming
+    it into the standard 3D frame. See skycoord_columns.
+    """
+    columns = skycoord_columns(coord)
+    with stage("serialize"):
+        return [
+            {"x": x, "y": y, "z": z, "time": time}
+            for x, y, z, time in zip(
+                columns["x"], columns["y"], columns["z"], columns["time"]
+            )
+        ]
+
+
+def jsonify_skycoords(coord: SkyCoord, names: List[str]) -> Dict[str, list]:
+    """
+    Splits the skycoord into equal parts, one per name, and converts each
+    part to a list of dicts in kilometers. The whole skycoord is transformed
+    into the standard 3D frame in a single call. See jsonify_skycoord and
+    ephemeris.get_positions.
+    """
+    columns = skycoord_columns(coord)
+    bounds = range(0, len(coord) + 1, len(coord) // len(names))
+    with stage("serialize"):
+        rows = [
+            {"x": x, "y": y, "z": z, "time": time}
+            for x, y, z, time in zip(
+                columns["x"], columns["y"], columns["z"], columns["time"]
+            )
+        ]
+        return {
+            name: rows[start:stop]
+            for name, start, stop in zip(names, bounds, bounds[1:])
+        }
+
+
+def skycoord_columns(coord: SkyCoord) -> Dict[str, list]:
+    """
+    Converts the skycoord to lists of x, y, z (kilometers) and time after
+    transforming it into the standard 3D frame. The transform and unit
+    conversion are applied to the whole array at once.
+    """
+    xs, ys, zs = _to_3d_frame(coord)
+    with stage("serialize"):
+        times = np.broadcast_to(_format_times(coord.obstime), xs.shape)
+        return {
+            "x": xs.tolist(),
+            "y": ys.tolist(),
+            "z": zs.tolist(),
+            "time": times.tolist(),
+        }
+
+
+@stage("transform")
+def _to_3d_frame(coord: SkyCoord) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Transforms the skycoord to the standard 3D frame and returns its
+    cartesian x, y and z in kilometers as arrays
+    """
+    coord = coord.reshape((coord.size,))
+    frame = get_3d_frame()
+    xyz = np.empty((3, coord.size))
+    for part in transform_chunks(coord.size):
+        # The lock is taken per chunk so other requests can run in between
+        with sun_center_transform():
+            reframed = coord[part].transform_to(frame)
+        xyz[:, part] = reframed.cartesian.xyz.to_value(u.km)
+    return xyz[0], xyz[1], xyz[2]
+
+
+def _format_times(time: Time, formats: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Formats every element of the given time as a string, in one step for
+    each distinct format. Matches str() on each element when it has the
+    given format, defaults to time.format.
     """
-    return list(map(_normalize_skycoord, coord))
+    if formats is None or all(f == time.format for f in formats):
+        return np.atleast_1d(time.value).astype(str)
+    formats = np.asarray(formats)
+    result = np.empty(len(formats), dtype=object)
+    for name in np.unique(formats):
+        index = np.flatnonzero(formats == name)
+        result[index] = np.atleast_1d(time[index].to_value(name)).astype(str)
+    return result.astype(str)
 
 
 def _normalize_skycoord(coord: SkyCoord) -> dict:
     """
     Converts a skycoord to a normalized x,y,z,time dict.
     """
-    with transform_with_sun_center():
+    with sun_center_transform():
         time = coord.obstime
         reframed = coord.transform_to(get_3d_frame())
         reframed.representation_type = "cartesian"
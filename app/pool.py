@@ -0,0 +1,146 @@
+"""
+Process pool used to spread large batch transforms across cores.
+
+sunpy/astropy transforms mostly run Python code while holding the GIL, so
+a single large batch only uses one core no matter how many threads the
+server has. When POOL_WORKERS is set, batches with at least POOL_MIN_BATCH
+coordinates are split into one shard per worker, transformed in separate
+processes and merged back in order.
+
+Workers are started with the "spawn" method, so they don't inherit locks
+held by the server's threads, and import sunpy and the transform modules
+when they start so the first shard doesn't pay for it.
+
+Stage timings recorded while a worker runs a shard are sent back with its
+results and added to the server's metrics. Stages the server is already
+timing around map_shards (i.e. transform) aren't recorded again, so nested
+stages such as rotate add up the time spent by every worker and can exceed
+the wall time of the request.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, FrozenSet, Optional, Tuple
+
+import numpy as np
+from astropy.time import Time
+
+import metrics
+
+# Number of worker processes, 0 disables the pool
+POOL_WORKERS = int(os.environ.get("POOL_WORKERS", 0))
+# Smallest batch which is split across the pool
+POOL_MIN_BATCH = int(os.environ.get("POOL_MIN_BATCH", 10000))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def should_shard(size: int) -> bool:
+    """
+    Returns True if a batch of the given size should be run on the pool
+    """
+    return POOL_WORKERS > 1 and size >= POOL_MIN_BATCH
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool, starting it and waiting for every worker to
+    finish importing on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            # Submitting one task per worker starts all of them
+            for future in [_pool.submit(os.getpid) for _ in range(POOL_WORKERS)]:
+                future.result()
+        return _pool
+
+
+def shutdown():
+    """
+    Stops the worker processes. The pool is started again on next use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def map_shards(
+    fn: Callable[..., Tuple[np.ndarray, ...]],
+    columns: Tuple[np.ndarray, ...],
+    times: Time,
+    *args,
+) -> Tuple[np.ndarray, ...]:
+    """
+    Splits the columns and times into one contiguous shard per worker,
+    calls fn(*shard_columns, shard_times, *args) for each shard on the pool
+    and concatenates the returned arrays in the original order.
+
+    Parameters
+    ----------
+    fn: Callable
+        Module level function which returns a tuple of arrays with one
+        value per coordinate
+    columns: Tuple[np.ndarray, ...]
+        Coordinate columns, all the same length
+    times: Time
+        Array of times, one per coordinate
+    args:
+        Extra arguments passed to every call
+    """
+    pool = get_pool()
+    bounds = np.linspace(0, len(times), POOL_WORKERS + 1).astype(int)
+    active = metrics.active_stages()
+    futures = [
+        pool.submit(
+            _run_shard,
+            active,
+            fn,
+            *[column[a:b] for column in columns],
+            times[a:b],
+            *args,
+        )
+        for a, b in zip(bounds[:-1], bounds[1:])
+        if b > a
+    ]
+    results = []
+    for future in futures:
+        result, stages = future.result()
+        metrics.STAGE_SECONDS.merge(stages)
+        results.append(result)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def _run_shard(active: FrozenSet[str], fn: Callable, *args) -> tuple:
+    """
+    Runs in a worker. Returns the result of fn(*args) and the stage timings
+    recorded while it ran, leaving out the active stages the server is
+    already timing.
+    """
+    # Workers run one shard at a time, so everything recorded since the
+    # last shard belongs to this one
+    metrics.STAGE_SECONDS.state(clear=True)
+    with metrics.skip_stages(active):
+        result = fn(*args)
+    return result, metrics.STAGE_SECONDS.state(clear=True)
+
+
+def _init_worker():
+    """
+    Runs in each worker when it starts. Workers never shard their own
+    batches, and import the transform modules up front.
+    """
+    global POOL_WORKERS
+    POOL_WORKERS = 0
+    import hgs2hpc  # noqa: F401
+    import normalizer  # noqa: F401
@@ -0,0 +1,181 @@
+"""
+On demand profiling of single requests.
+
+When PROFILING_TOKEN is set, a request sent with the header
+`X-Profile: <token>` or the query parameter `profile=<token>` runs its
+route's handler under cProfile. Instead of the route's response, the
+server returns a plain text summary of the profile: the functions with the
+largest cumulative time, the functions with the largest own time and who
+called them. The route's status code is returned in the X-Profile-Status
+header.
+
+Only route handlers which run in the thread pool (plain `def` routes) are
+profiled. The streaming routes are async and return an empty profile.
+
+Only one request per worker process is profiled at a time, other requests
+which ask to be profiled meanwhile are answered with 409. From Python 3.12
+cProfile is built on sys.monitoring, which is process wide, so the summary
+covers everything the worker process ran while the request was profiled,
+including other requests, coalesced batches and the health self-test.
+"""
+
+import cProfile
+import inspect
+import io
+import os
+import pstats
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from binary import NpzRoute
+
+# Value of the X-Profile header or profile query parameter which enables
+# profiling for a request. Empty disables profiling.
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+# Number of functions listed in each section of the summary
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", 30))
+
+_profile: ContextVar[Optional[cProfile.Profile]] = ContextVar("profile", default=None)
+# Held while a request is profiled. Only one profiler may be active in a
+# process on Python 3.12 and later.
+_profiling = threading.Lock()
+
+
+def profiled(fn: Callable) -> Callable:
+    """
+    Wraps a route handler so it runs under the current request's profiler,
+    if there is one. Coroutine functions are returned unchanged.
+    """
+    if inspect.iscoroutinefunction(fn):
+        return fn
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _profile.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        return profile.runcall(fn, *args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(NpzRoute):
+    """
+    Route class which wraps the route's handler, and its npz_endpoint if it
+    has one, with profiled
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        wrapper = profiled(endpoint)
+        npz = getattr(endpoint, "npz_endpoint", None)
+        if npz is not None and wrapper is not endpoint:
+            wrapper.npz_endpoint = profiled(npz)
+        super().__init__(path, wrapper, **kwargs)
+
+
+def requested(scope: dict, token: str) -> bool:
+    """
+    Returns True if the request asks to be profiled with the given token
+    """
+    if not token:
+        return False
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile", b"").decode("latin-1") == token:
+        return True
+    query = parse_qsl(scope["query_string"].decode("latin-1"))
+    return ("profile", token) in query
+
+
+def summarize(profile: cProfile.Profile, top: int) -> str:
+    """
+    Returns the top functions by cumulative time, and the top functions by
+    own time with their callers
+    """
+    out = io.StringIO()
+    try:
+        stats = pstats.Stats(profile, stream=out)
+    except TypeError:
+        # Nothing was recorded
+        return "No profile was recorded. Only non-streaming routes are profiled.\n"
+    stats.strip_dirs()
+    out.write(f"Total time: {stats.total_tt:.6f} s\n")
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_callers(top)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware which profiles requests that ask for it and replaces
+    their response with the profile summary
+
+    Parameters
+    ----------
+    app:
+        ASGI application
+    token: str
+        Value which must be sent to enable profiling, defaults to
+        PROFILING_TOKEN
+    """
+
+    def __init__(self, app, token: str = ""):
+        self.app = app
+        self.token = token or PROFILING_TOKEN
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not requested(scope, self.token):
+            await self.app(scope, receive, send)
+            return
+
+        # Remove the flag so the route's own parameter validation doesn't see it
+        query = [
+            (key, value)
+            for key, value in parse_qsl(scope["query_string"].decode("latin-1"))
+            if key != "profile"
+        ]
+        scope = {**scope, "query_string": urlencode(query).encode("latin-1")}
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        if not _profiling.acquire(blocking=False):
+            await _send_text(
+                send, 409, b"Another request is being profiled, try again later\n"
+            )
+            return
+        try:
+            profile = cProfile.Profile()
+            token = _profile.set(profile)
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                _profile.reset(token)
+        finally:
+            _profiling.release()
+
+        body = summarize(profile, PROFILE_TOP).encode()
+        await _send_text(send, 200, body, [(b"x-profile-status", str(status).encode())])
+
+
+async def _send_text(send, status: int, body: bytes, headers: Optional[list] = None):
+    """
+    Sends a plain text response
+    """
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                *(headers or []),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,173 @@
+"""
+Server side cache of GET responses.
+
+GET /hpc and /hgs2hpc always return the same response for the same
+parameters. Responses are cached in memory keyed by the parsed parameters,
+with times reduced to their UTC (jd1, jd2) pair so different spellings of
+the same time share an entry. The least recently used entry is evicted
+once RESPONSE_CACHE_SIZE responses are stored.
+
+GET /position and POST /positions depend on JPL Horizons, whose
+predictions get revised, so their responses are only kept, and only
+marked cacheable by clients, for POSITION_CACHE_MAX_AGE seconds.
+
+Every response carries an ETag computed from its body and a Cache-Control
+header, and requests with a matching If-None-Match are answered with 304.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from astropy.time import Time
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+# Number of responses to keep, 0 disables the server side cache
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 0))
+# max-age sent in the Cache-Control header, in seconds
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get("RESPONSE_CACHE_MAX_AGE", 86400))
+# max-age of position responses, which are also dropped from the server side
+# cache after this many seconds
+POSITION_CACHE_MAX_AGE = int(os.environ.get("POSITION_CACHE_MAX_AGE", 3600))
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache of (body, etag) pairs
+
+    Parameters
+    ----------
+    maxsize: int
+        Number of entries to keep
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        """
+        Returns the cached (body, etag) for key, or None if there is no
+        entry or it has expired
+        """
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is not None and stored[1] is not None:
+                if time.monotonic() >= stored[1]:
+                    del self._entries[key]
+                    stored = None
+            if stored is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stored[0]
+
+    def put(self, key: Hashable, entry: Tuple[bytes, str], ttl: Optional[float] = None):
+        """
+        Stores an entry, evicting the least recently used one if full.
+        Entries with a ttl expire after that many seconds.
+        """
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (entry, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def info(self) -> dict:
+        """
+        Returns hit and miss counts, hit rate and size of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+
+def response_cache_info() -> dict:
+    """
+    Returns metrics for the response cache, see ResponseCache.info
+    """
+    return _cache.info()
+
+
+def clear_response_cache():
+    """
+    Removes every cached response and resets the metrics
+    """
+    global _cache
+    _cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+
+def time_key(time: Time) -> Tuple[float, float]:
+    """
+    Returns a cache key for a scalar time which doesn't depend on how the
+    time was written
+    """
+    utc = time.utc
+    return (float(utc.jd1), float(utc.jd2))
+
+
+def cached_json(
+    request: Request,
+    key: Hashable,
+    compute: Callable[[], Any],
+    max_age: Optional[int] = None,
+) -> Response:
+    """
+    Returns the JSON response for key from the cache, or computes and caches
+    it. Answers with 304 if the request's If-None-Match has the response's
+    ETag.
+
+    Parameters
+    ----------
+    request: Request
+        Request being answered
+    key: Hashable
+        Parsed request parameters, see time_key
+    compute: Callable[[], Any]
+        Returns the response content when it isn't cached
+    max_age: Optional[int]
+        For responses which may change, seconds the response is kept in the
+        cache and sent as the Cache-Control max-age. Defaults to keeping it
+        until it is evicted, with a max-age of RESPONSE_CACHE_MAX_AGE.
+    """
+    entry = _cache.get(key) if _cache.maxsize > 0 else None
+    if entry is None:
+        body = JSONResponse(compute()).body
+        entry = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+        if _cache.maxsize > 0:
+            _cache.put(key, entry, max_age)
+
+    body, etag = entry
+    if max_age is None:
+        max_age = RESPONSE_CACHE_MAX_AGE
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    tags = _if_none_match(request)
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _if_none_match(request: Request) -> list:
+    """
+    Returns the ETags listed in the request's If-None-Match header
+    """
+    value = request.headers.get("if-none-match", "")
+    return [tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()]
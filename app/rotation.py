@@ -0,0 +1,256 @@
+"""
+NumPy implementation of the transforms behind hgs2hpc and normalize_hpc.
+
+sunpy's solar_rotate_coordinate is generic and builds several intermediate
+coordinate frames. Since the new observer is always Helioviewer's 1 AU
+observer, the same result can be computed with plain array math:
+
+1. Deproject helioprojective coordinates seen from Earth at coord_time to
+   Heliographic Stonyhurst. On disk points are placed on the solar surface,
+   off disk points on a sphere centered on the observer which passes through
+   Sun center (equivalent to SphericalScreen with only_off_disk=True).
+2. Shift the longitude by the Howard differential rotation model.
+3. Rotate from Heliographic Stonyhurst at coord_time to the target time.
+   Both frames share the solar rotation axis, so this is a rotation about
+   that axis by the change in Earth's Heliocentric Inertial longitude.
+4. Project onto the helioprojective frame of Helioviewer's observer.
+
+Earth's position is read from the precomputed table in earth_table.py
+when the times are covered by it, otherwise it is computed by sunpy.
+"""
+
+import os
+from typing import List, Literal, Optional, Tuple, get_args
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from sunpy.coordinates import get_earth, HeliocentricInertial
+from sunpy.sun import constants
+
+from earth_table import earth_hgs, earth_hci_lon
+
+# grid interpolates hgs2hpc results from a cached grid, see grid.py.
+# For normalize_hpc it is the same as numpy.
+Engine = Literal["sunpy", "numpy", "grid"]
+ENGINES = get_args(Engine)
+# Engine used when a request doesn't select one
+DEFAULT_ENGINE = os.environ.get("ROTATION_ENGINE", "sunpy")
+if DEFAULT_ENGINE not in ENGINES:
+    raise ValueError(f"ROTATION_ENGINE must be one of {ENGINES}")
+
+# Howard differential rotation model (sidereal), in radians per second
+_HOWARD = (2.894e-6, -0.428e-6, -0.370e-6)
+_RSUN_KM = constants.radius.to_value(u.km)
+_AU_KM = u.AU.to(u.km)
+_ARCSEC = np.deg2rad(1 / 3600)
+
+
+def resolve_engine(engine: Optional[str]) -> str:
+    """
+    Returns the engine to use for a request, falling back to DEFAULT_ENGINE
+    """
+    return engine or DEFAULT_ENGINE
+
+
+def normalize_hpc(
+    xs: List[float], ys: List[float], coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    NumPy version of normalizer.normalize_hpc_columns
+
+    Parameters
+    ----------
+    xs : List[float]
+        X coordinates in arcseconds
+    ys : List[float]
+        Y coordinates in arcseconds
+    coord_times : Time
+        Scalar or array observation times
+    target : Time
+        Target observation time
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds
+    """
+    tx = np.asarray(xs, dtype=float) * _ARCSEC
+    ty = np.asarray(ys, dtype=float) * _ARCSEC
+    lon, lat, radius, hci_lon = _earth_state(coord_times)
+
+    # Distance to the solar surface along the line of sight (near solution)
+    cos_alpha = np.cos(ty) * np.cos(tx)
+    b = -2 * radius * cos_alpha
+    c = radius**2 - _RSUN_KM**2
+    with np.errstate(invalid="ignore"):
+        distance = (-b - np.sqrt(b**2 - 4 * c)) / 2
+    # Off disk points are on a sphere around the observer through Sun center
+    distance = np.fmin(distance, radius)
+
+    # Heliocentric cartesian, then rotate into Heliographic Stonyhurst
+    x = distance * np.cos(ty) * np.sin(tx)
+    y = distance * np.sin(ty)
+    z = radius - distance * cos_alpha
+    x_hat, y_hat, z_hat = _observer_basis(lon, lat)
+    hgs = x * x_hat + y * y_hat + z * z_hat
+    x, y, _ = _rotate_and_project(hgs, coord_times, hci_lon, target)
+    return x, y
+
+
+def hgs2hpc(
+    lats: List[float], lons: List[float], coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    NumPy version of hgs2hpc.hgs2hpc_columns
+
+    Parameters
+    ----------
+    lats : List[float]
+        Latitude coordinates in degrees
+    lons : List[float]
+        Longitude coordinates in degrees
+    coord_times : Time
+        Scalar or array times when each lat/lon coordinate was measured
+    target : Time
+        Target observation time
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds
+    """
+    x, y, _ = hgs2hpc_visible(lats, lons, coord_times, target)
+    return x, y
+
+
+def hgs2hpc_visible(
+    lats: List[float], lons: List[float], coord_times: Time, target: Time
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as hgs2hpc, but also returns whether each point is on the side of
+    the sun facing the observer.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Helioprojective x and y coordinates in arcseconds, and a boolean
+        array which is True for visible points
+    """
+    lat = np.deg2rad(np.asarray(lats, dtype=float))
+    lon = np.deg2rad(np.asarray(lons, dtype=float))
+    # Coordinates without a radius are on the solar surface
+    hgs = _RSUN_KM * np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+    _, _, _, hci_lon = _earth_state(coord_times)
+    return _rotate_and_project(hgs, coord_times, hci_lon, target)
+
+
+def rotate_lon(
+    lats: np.ndarray, lons: np.ndarray, coord_times: Time, new_time: Time
+) -> np.ndarray:
+    """
+    Returns the stonyhurst longitude (deg) at new_time of surface points at
+    the given lat/lon (deg) at coord_times, moving with differential
+    rotation. This is the same rotation hgs2hpc applies.
+    """
+    hci_lon = _earth_hci_lon(coord_times)
+    new_hci_lon = _earth_hci_lon(new_time)
+    duration = (new_time - coord_times).to_value(u.s)
+    drot = _howard(np.deg2rad(lats)) * duration - (new_hci_lon - hci_lon)
+    return lons + np.rad2deg(drot)
+
+
+def _rotate_and_project(
+    hgs: np.ndarray, coord_times: Time, hci_lon: np.ndarray, target: Time
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Applies differential rotation to heliographic stonyhurst cartesian
+    coordinates measured at coord_times, and projects them into
+    Helioviewer's helioprojective frame at the target time. Also returns
+    whether each point is visible from the observer.
+    """
+    target_lon, target_lat, _, target_hci_lon = _earth_state(target)
+    duration = (target - coord_times).to_value(u.s)
+
+    radius = np.sqrt(np.sum(hgs**2, axis=0))
+    lat = np.arcsin(hgs[2] / radius)
+    lon = np.arctan2(hgs[1], hgs[0])
+    drot = _howard(lat) * duration
+    # Stonyhurst longitude at the target time
+    lon = lon + drot - (target_hci_lon - hci_lon)
+
+    hgs = radius * np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+    x_hat, y_hat, z_hat = _observer_basis(target_lon, target_lat)
+    x = np.sum(hgs * x_hat, axis=0)
+    y = np.sum(hgs * y_hat, axis=0)
+    height = np.sum(hgs * z_hat, axis=0)
+    depth = _AU_KM - height
+    distance = np.sqrt(x**2 + y**2 + depth**2)
+    # Points on a sphere are visible from outside it when their height
+    # along the line of sight is above radius^2 / observer distance
+    visible = height > radius**2 / _AU_KM
+    return (
+        np.arctan2(x, depth) / _ARCSEC,
+        np.arcsin(y / distance) / _ARCSEC,
+        visible,
+    )
+
+
+def _howard(lat: np.ndarray) -> np.ndarray:
+    """
+    Returns the sidereal rotation rate (rad/s) at the given latitudes (rad)
+    """
+    sin2 = np.sin(lat) ** 2
+    return _HOWARD[0] + _HOWARD[1] * sin2 + _HOWARD[2] * sin2**2
+
+
+def _observer_basis(lon: np.ndarray, lat: np.ndarray):
+    """
+    Returns the heliocentric cartesian x, y and z unit vectors for an
+    observer at the given stonyhurst lon/lat, in stonyhurst cartesian
+    components with shape (3, N).
+    """
+    cos_lon, sin_lon = np.cos(lon), np.sin(lon)
+    cos_lat, sin_lat = np.cos(lat), np.sin(lat)
+    x_hat = np.stack([-sin_lon, cos_lon, np.zeros_like(lon)])
+    y_hat = np.stack([-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat])
+    z_hat = np.stack([cos_lat * cos_lon, cos_lat * sin_lon, sin_lat])
+    return x_hat, y_hat, z_hat
+
+
+def _earth_state(times: Time):
+    """
+    Returns Earth's stonyhurst lon (rad), lat (rad), radius (km) and
+    Heliocentric Inertial longitude (rad) at the given times as arrays.
+    """
+    times = times if isinstance(times, Time) else Time(times)
+    position = earth_hgs(times)
+    if position is not None:
+        lon, lat, radius = position
+        hci_lon = earth_hci_lon(times)
+    else:
+        earth = get_earth(times)
+        lon, lat, radius = earth.lon, earth.lat, earth.radius
+        hci_lon = earth.transform_to(HeliocentricInertial(obstime=times)).lon
+    return (
+        np.atleast_1d(lon.to_value(u.rad)),
+        np.atleast_1d(lat.to_value(u.rad)),
+        np.atleast_1d(radius.to_value(u.km)),
+        np.atleast_1d(hci_lon.to_value(u.rad)),
+    )
+
+
+def _earth_hci_lon(times: Time) -> np.ndarray:
+    """
+    Returns Earth's Heliocentric Inertial longitude (rad) at the given
+    times as an array. Cheaper than _earth_state when only this is needed.
+    """
+    times = times if isinstance(times, Time) else Time(times)
+    hci_lon = earth_hci_lon(times)
+    if hci_lon is None:
+        return _earth_state(times)[3]
+    return np.atleast_1d(hci_lon.to_value(u.rad))
@@ -0,0 +1,197 @@
+"""
+Streaming NDJSON versions of the batch endpoints.
+
+The request body is read incrementally, one JSON object per line, and
+transformed in chunks of STREAM_CHUNK_SIZE lines. Results are written back
+as NDJSON as soon as each chunk is done, one line per input line in the
+same order, so memory use depends on the chunk size instead of the number
+of lines sent. Lines which fail validation are answered with
+{"line": n, "error": message} (n counts from 1) and don't stop the stream,
+as are lines which the transform fails on.
+Lines longer than STREAM_MAX_LINE_BYTES are discarded as they are read and
+answered with an error the same way, the response has already started by
+then so its status can't change.
+"""
+
+import json
+import os
+from typing import AsyncIterator, Callable, List, Optional, Type
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, ValidationError
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Number of lines transformed at once
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1000))
+# Longest line which is buffered, longer lines are answered with an error
+STREAM_MAX_LINE_BYTES = int(os.environ.get("STREAM_MAX_LINE_BYTES", 65536))
+
+# Function which transforms a chunk of validated rows into result dicts
+Transform = Callable[[List[BaseModel]], List[dict]]
+
+
+class NdjsonResponse(StreamingResponse):
+    """
+    StreamingResponse which doesn't listen for disconnects while streaming.
+    The request body is still being read while the response is sent, so
+    receive() can't also be used to wait for a disconnect message. Instead
+    reading the body raises ClientDisconnect when the client goes away,
+    which stops the response.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except (ClientDisconnect, OSError):
+            # The client went away, so the rest of the body isn't read or
+            # transformed
+            return
+
+
+def ndjson_body(model: Type[BaseModel]) -> dict:
+    """
+    Returns openapi_extra describing an NDJSON request body where each line
+    is the given model
+    """
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {NDJSON_MEDIA_TYPE: {"schema": model.model_json_schema()}},
+        }
+    }
+
+
+def stream_ndjson(
+    request: Request, model: Type[BaseModel], transform: Transform
+) -> NdjsonResponse:
+    """
+    Returns a response which streams the transformed results of the NDJSON
+    request body.
+
+    Parameters
+    ----------
+    request: Request
+        Request with an NDJSON body
+    model: Type[BaseModel]
+        Model used to validate each line
+    transform: Transform
+        Function which transforms a chunk of validated rows. It is run in
+        the thread pool. If it raises, the rows in the chunk are
+        transformed one at a time and the ones which fail are answered
+        with the error.
+    """
+    return NdjsonResponse(_stream(request, model, transform))
+
+
+async def _stream(
+    request: Request, model: Type[BaseModel], transform: Transform
+) -> AsyncIterator[str]:
+    async for chunk in read_chunks(request, STREAM_CHUNK_SIZE):
+        rows = []
+        results: List[dict] = []
+        for number, line in chunk:
+            if line is None:
+                results.append(
+                    {
+                        "line": number,
+                        "error": f"line: longer than {STREAM_MAX_LINE_BYTES} bytes",
+                    }
+                )
+                continue
+            try:
+                rows.append(model.model_validate_json(line))
+                results.append(None)
+            except ValidationError as e:
+                results.append({"line": number, "error": _error_message(e)})
+        valid = [i for i, result in enumerate(results) if result is None]
+        try:
+            transformed = await run_in_threadpool(transform, rows) if rows else []
+        except Exception:
+            # Transform the rows one at a time to find the ones which fail
+            transformed = [await _transform_row(transform, row) for row in rows]
+        for i, result in zip(valid, transformed):
+            if "error" in result:
+                result["line"] = chunk[i][0]
+            results[i] = result
+        yield "".join(json.dumps(result) + "\n" for result in results)
+
+
+async def _transform_row(transform: Transform, row: BaseModel) -> dict:
+    """
+    Transforms a single row, returning an error result if it fails
+    """
+    try:
+        return (await run_in_threadpool(transform, [row]))[0]
+    except ValueError as e:
+        return {"line": None, "error": str(e)}
+    except Exception as e:
+        # Not caused by the input, so the type helps to report it
+        return {"line": None, "error": f"{type(e).__name__}: {e}"}
+
+
+async def read_chunks(
+    request: Request, size: int, max_line: Optional[int] = None
+) -> AsyncIterator[list]:
+    """
+    Reads the request body incrementally and yields lists of up to size
+    (line number, line) pairs. Blank lines are skipped. Lines longer than
+    max_line bytes are discarded while they are read and yielded as None,
+    so at most max_line bytes are buffered.
+
+    Parameters
+    ----------
+    request: Request
+        Request with an NDJSON body
+    size: int
+        Maximum number of lines in each chunk
+    max_line: Optional[int]
+        Longest line kept in bytes, defaults to STREAM_MAX_LINE_BYTES
+    """
+    max_line = STREAM_MAX_LINE_BYTES if max_line is None else max_line
+    buffer = bytearray()
+    # True while discarding the rest of a line which was too long
+    skipping = False
+    number = 0
+    chunk = []
+    async for data in request.stream():
+        *lines, rest = data.split(b"\n")
+        for line in lines:
+            number += 1
+            if skipping:
+                line = None
+                skipping = False
+            else:
+                buffer += line
+                line = bytes(buffer) if len(buffer) <= max_line else None
+                buffer.clear()
+            if line is None or line.strip():
+                chunk.append((number, line))
+                if len(chunk) == size:
+                    yield chunk
+                    chunk = []
+        if not skipping:
+            buffer += rest
+            if len(buffer) > max_line:
+                buffer.clear()
+                skipping = True
+    if skipping:
+        chunk.append((number + 1, None))
+    elif buffer.strip():
+        chunk.append((number + 1, bytes(buffer)))
+    if chunk:
+        yield chunk
+
+
+def _error_message(error: ValidationError) -> str:
+    """
+    Formats a validation error as a single line message
+    """
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in e['loc']) or 'line'}: {e['msg']}"
+        for e in error.errors()
+    )
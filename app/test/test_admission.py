@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from ..main import app
+import admission
+from admission import AdmissionMiddleware, CostLimiter, Rejected, estimate_cost
+
+
+def test_cost_limiter():
+    async def run():
+        limiter = CostLimiter(capacity=4, queue=1)
+        # Costs over the capacity take the whole capacity
+        assert await limiter.acquire(10, timeout=1) == 4
+        waiting = asyncio.ensure_future(limiter.acquire(1, timeout=1))
+        await asyncio.sleep(0)
+        # Queue is full
+        with pytest.raises(Rejected) as e:
+            await limiter.acquire(1, timeout=1)
+        assert e.value.status == 429
+        limiter.release(4)
+        assert await waiting == 1
+        assert limiter.in_use == 1
+
+        # Timed out requests are rejected and leave the queue
+        await limiter.acquire(3, timeout=1)
+        with pytest.raises(Rejected) as e:
+            await limiter.acquire(1, timeout=0.05)
+        assert e.value.status == 503
+        assert len(limiter._waiters) == 0
+        limiter.release(4)
+        assert limiter.in_use == 0
+
+    asyncio.run(run())
+
+
+def test_estimate_cost(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_BYTES_PER_UNIT", 1000)
+    assert estimate_cost("point", {b"content-length": b"100000"}) == 1
+    # Unknown sizes are charged the whole capacity
+    assert estimate_cost("batch", {}) is None
+    assert estimate_cost("batch", {}, "/hpc/stream") == 1
+    assert estimate_cost("batch", {b"content-length": b"999"}) == 1
+    assert estimate_cost("batch", {b"content-length": b"5000"}) == 6
+
+
+def run_requests(limits, requests):
+    async def run():
+        transport = httpx.ASGITransport(app=AdmissionMiddleware(app, limits))
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(
+                *[
+                    client.request(method, url, **kwargs)
+                    for method, url, kwargs in requests
+                ]
+            )
+
+    return asyncio.run(run())
+
+
+def test_admission_saturated():
+    # One request runs, one waits and the rest are rejected right away
+    query = "/hpc?x=515&y=-342&coord_time=2012-07-05 13:01:46"
+    responses = run_requests(
+        {"point": (1, 1)},
+        [("GET", f"{query}&target=2012-07-0{i + 1}", {}) for i in range(6)],
+    )
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 429, 429, 429, 429]
+    rejected = [r for r in responses if r.status_code == 429]
+    assert rejected[0].headers["retry-after"] == str(admission.ADMISSION_RETRY_AFTER)
+
+
+def test_admission_classes():
+    # A batch which fills the batch class doesn't hold up single point
+    # requests, but does hold up other batches
+    coordinates = [
+        {"x": i, "y": i, "coord_time": "2012-07-05 13:01:46"} for i in range(2000)
+    ]
+    batch = (
+        "POST",
+        "/hpc",
+        {"json": {"coordinates": coordinates, "target": "2012-07-06"}},
+    )
+    point = ("GET", "/hpc?x=515&y=-342&coord_time=2012-07-05 13:01:46", {})
+    responses = run_requests({"point": (1, 0), "batch": (4, 0)}, [batch, point, batch])
+    assert [response.status_code for response in responses] == [200, 200, 429]
+
+
+def test_admission_stream_takes_turns(monkeypatch):
+    # A stream gives back its units between chunks of body, so a batch sent
+    # while it is being read doesn't wait for the whole stream
+    monkeypatch.setattr(admission, "ADMISSION_BYTES_PER_UNIT", 10)
+    finished = []
+
+    async def read_body(scope, receive, send):
+        more_body = True
+        while more_body:
+            more_body = (await receive()).get("more_body", False)
+        finished.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def stream_body():
+        for _ in range(5):
+            yield b"0123456789"
+            await asyncio.sleep(0.05)
+
+    async def run():
+        middleware = AdmissionMiddleware(read_body, {"batch": (1, 4)})
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+
+            async def batch():
+                await asyncio.sleep(0.05)
+                return await client.post("/hpc", content=b"{}")
+
+            return await asyncio.gather(
+                client.post("/hpc/stream", content=stream_body()), batch()
+            )
+
+    responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert finished == ["/hpc", "/hpc/stream"]
+
+
+def test_admission_chunked_batch():
+    # A 100k point batch sent without a Content-Length takes the whole batch
+    # class and doesn't hold up single point requests
+    coordinates = [
+        {"lat": 10.0, "lon": float(i % 90), "coord_time": "2013-01-01T00:00:00"}
+        for i in range(100000)
+    ]
+    body = json.dumps(
+        {"coordinates": coordinates, "target": "2013-01-02", "engine": "sunpy"}
+    ).encode()
+
+    async def chunked_body():
+        for start in range(0, len(body), 65536):
+            yield body[start:][:65536]
+
+    async def run():
+        middleware = AdmissionMiddleware(app, {"point": (1, 4), "batch": (4, 4)})
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test", timeout=None
+        ) as client:
+            query = "/hgs2hpc?lon=3&coord_time=2013-01-03&target=2013-01-02"
+            # Warm up the caches used by the point requests
+            assert (await client.get(f"{query}&lat=0")).status_code == 200
+            finished = {}
+
+            async def batch():
+                response = await client.post(
+                    "/hgs2hpc",
+                    content=chunked_body(),
+                    headers={"content-type": "application/json"},
+                )
+                finished["batch"] = time.perf_counter()
+                assert middleware.limiters["batch"].in_use == 0
+                return response
+
+            async def points():
+                while middleware.limiters["batch"].in_use == 0:
+                    await asyncio.sleep(0.01)
+                # The batch takes every unit, so other batches wait
+                assert middleware.limiters["batch"].in_use == 4
+                latencies = []
+                for i in range(5):
+                    start = time.perf_counter()
+                    response = await client.get(f"{query}&lat={i + 1}.5")
+                    assert response.status_code == 200
+                    latencies.append(time.perf_counter() - start)
+                finished["points"] = time.perf_counter()
+                return latencies
+
+            response, latencies = await asyncio.gather(batch(), points())
+            return response, latencies, finished
+
+    response, latencies, finished = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(response.json()["coordinates"]) == 100000
+    assert finished["points"] < finished["batch"]
+    assert max(latencies) < 1
@@ -1,12 +1,20 @@
+import asyncio
 import pytest
 import random
 import math
+import time
+import threading
+import httpx
 from astropy import units as u
 from fastapi.testclient import TestClient
 from sunpy.coordinates import get_earth
 
 from ..main import app
+import frames
+import hgs2hpc
 from frames import get_3d_frame_date
+from ephemeris import EphemerisCache, set_cache
+from health import self_test
 
 
 @pytest.fixture
@@ -103,6 +111,27 @@ def test_hpc_post(client: TestClient):
     response = client.post("/hpc", json=batch_data)
     assert response.status_code == 422
 
+    # Invalid times report the index of the coordinate
+    batch_data = {
+        "coordinates": [
+            {"x": 0, "y": 0, "coord_time": "2012-01-01T00:00:00Z"},
+            {"x": 0, "y": 0, "coord_time": "NotAValidTime"},
+        ],
+        "target": "2012-01-01T00:00:00Z",
+    }
+    response = client.post("/hpc", json=batch_data)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == [
+        "body",
+        "coordinates",
+        1,
+        "coord_time",
+    ]
+    batch_data["coordinates"][1]["coord_time"] = "2012-13-45T00:00:00Z"
+    response = client.post("/hpc", json=batch_data)
+    assert response.status_code == 422
+    assert "index 1" in response.json()["detail"][0]["msg"]
+
     # Test empty coordinates array
     batch_data = {"coordinates": [], "target": "2012-01-01T00:00:00Z"}
     response = client.post("/hpc", json=batch_data)
@@ -218,6 +247,41 @@ def test_hpc_single_vs_batched(client: TestClient):
         ), f"Mismatch at index {i}: y values differ"
 
 
+def test_numpy_engine(client: TestClient):
+    # The numpy engine gives the same results as the default engine
+    query = "x=515&y=-342&coord_time=2012-07-05+13:01:46"
+    response = client.get(f"/hpc?{query}&engine=numpy")
+    assert response.status_code == 200
+    coord = response.json()
+    assert pytest.approx(coord["x"], abs=1e-3) == 523.6178
+    assert pytest.approx(coord["y"], abs=1e-3) == -347.7228
+
+    query = "lat=0&lon=0&coord_time=2012-01-01 00:00:00&target=2012-01-01 01:00:00"
+    expected = client.get(f"/hgs2hpc?{query}").json()
+    response = client.get(f"/hgs2hpc?{query}&engine=numpy")
+    assert response.status_code == 200
+    assert pytest.approx(response.json()["x"], abs=1e-3) == expected["x"]
+    assert pytest.approx(response.json()["y"], abs=1e-3) == expected["y"]
+
+    batch = {
+        "coordinates": [
+            {"x": 515, "y": -342, "coord_time": "2012-07-05T13:01:46"},
+            {"x": 1200, "y": 300, "coord_time": "2012-07-05T10:00:00"},
+        ],
+        "target": "2012-07-05T13:01:46",
+    }
+    expected = client.post("/hpc", json=batch).json()["coordinates"]
+    response = client.post("/hpc", json={**batch, "engine": "numpy"})
+    assert response.status_code == 200
+    for actual, coord in zip(response.json()["coordinates"], expected):
+        assert pytest.approx(actual["x"], abs=1e-3) == coord["x"]
+        assert pytest.approx(actual["y"], abs=1e-3) == coord["y"]
+
+    # Unknown engines are rejected
+    response = client.get("/hpc?x=0&y=0&coord_time=2012-01-01&engine=fast")
+    assert response.status_code == 422
+
+
 def test_hgs2hpc(client: TestClient):
     # Missing lat
     response = client.get("/hgs2hpc?lon=0&coord_time=2012-01-01")
@@ -376,10 +440,87 @@ def test_hgs2hpc_post(client: TestClient):
         assert isinstance(coord["y"], (int, float))
 
 
+def test_point_during_batch(monkeypatch):
+    """
+    A point request made while a large batch is being transformed waits for
+    one chunk of the batch, not the whole batch
+    """
+    monkeypatch.setattr(frames, "TRANSFORM_CHUNK_SIZE", 100)
+    transforming = threading.Event()
+    solar_rotate_coordinate = hgs2hpc.solar_rotate_coordinate
+
+    def signal_rotate(*args):
+        # Called with the transform lock held
+        transforming.set()
+        return solar_rotate_coordinate(*args)
+
+    monkeypatch.setattr(hgs2hpc, "solar_rotate_coordinate", signal_rotate)
+    # Distinct times, so the batch is transformed on the array path
+    coordinates = [
+        {
+            "lat": 10.0,
+            "lon": float(i % 90),
+            "coord_time": f"2013-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+        }
+        for i in range(6000)
+    ]
+    batch = {"coordinates": coordinates, "target": "2013-01-02", "engine": "sunpy"}
+    finished = {}
+
+    async def request_both():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test", timeout=None
+        ) as client:
+            # The first transform with many times loads data sunpy needs
+            warmup = {**batch, "coordinates": coordinates[:100]}
+            assert (await client.post("/hgs2hpc", json=warmup)).status_code == 200
+            transforming.clear()
+
+            async def post_batch():
+                response = await client.post("/hgs2hpc", json=batch)
+                finished["batch"] = time.perf_counter()
+                return response
+
+            async def get_point():
+                await asyncio.to_thread(transforming.wait, 30)
+                start = time.perf_counter()
+                response = await client.get(
+                    "/hgs2hpc?lat=12.5&lon=7.25&coord_time=2013-01-03&target=2013-01-02"
+                )
+                finished["point"] = time.perf_counter()
+                return response, finished["point"] - start
+
+            return await asyncio.gather(post_batch(), get_point())
+
+    batch_response, (point_response, elapsed) = asyncio.run(request_both())
+    assert batch_response.status_code == 200
+    assert point_response.status_code == 200
+    assert finished["point"] < finished["batch"]
+    assert elapsed < 1
+
+
 def test_healthcheck(client: TestClient):
     assert client.get("/health-check").text == '"success"'
 
 
+def test_ready():
+    # Readiness reports the self test run at startup, which doesn't need
+    # network access
+    with TestClient(app) as client:
+        self_test.wait(60)
+        response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+    assert set(response.json()["checks"]) == {
+        "warmup",
+        "hpc",
+        "hgs2hpc",
+        "gse",
+        "ephemeris",
+    }
+
+
 def test_gse(client: TestClient):
     """
     Tests transforming GSE coordinates into the 3D frame.
@@ -439,3 +580,225 @@ def test_gse_errors(client: TestClient):
         "/gse2frame", json={"coordinates": [{"x": "not a number", "y": 2, "z": 3}]}
     )
     assert response.status_code == 422
+
+
+def test_columns(client: TestClient):
+    """
+    Column based endpoints give the same results as the row based endpoints
+    """
+    rows = [
+        {"lat": 10.0, "lon": -20.0, "coord_time": "2012-01-01T00:00:00Z"},
+        {"lat": -45.0, "lon": 60.0, "coord_time": "2012-01-01 06:00:00"},
+        {"lat": 0.0, "lon": 0.0, "coord_time": "2011-12-31"},
+    ]
+    target = "2012-01-01 12:00:00"
+    expected = client.post("/hgs2hpc", json={"coordinates": rows, "target": target})
+    columns = {key: [row[key] for row in rows] for key in rows[0]}
+    response = client.post("/hgs2hpc/columns", json={**columns, "target": target})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["x"] == [c["x"] for c in expected.json()["coordinates"]]
+    assert data["y"] == [c["y"] for c in expected.json()["coordinates"]]
+
+    rows = [
+        {"x": 515.0, "y": -342.0, "coord_time": "2012-07-05 13:01:46"},
+        {"x": -1200.0, "y": 400.0, "coord_time": "2012-07-05 10:00:00"},
+    ]
+    expected = client.post("/hpc", json={"coordinates": rows, "target": target})
+    columns = {key: [row[key] for row in rows] for key in rows[0]}
+    response = client.post("/hpc/columns", json={**columns, "target": target})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["x"] == [c["x"] for c in expected.json()["coordinates"]]
+    assert data["y"] == [c["y"] for c in expected.json()["coordinates"]]
+
+    rows = [
+        {"x": 16856.9645, "y": 32613.5430, "z": -20740.0146, "time": target},
+        {"x": 0.0, "y": 0.0, "z": 0.0, "time": "2024-01-02 00:00:00"},
+    ]
+    expected = client.post("/gse2frame", json={"coordinates": rows})
+    columns = {key: [row[key] for row in rows] for key in rows[0]}
+    response = client.post("/gse2frame/columns", json=columns)
+    assert response.status_code == 200
+    data = response.json()
+    for key in ["x", "y", "z", "time"]:
+        assert data[key] == [c[key] for c in expected.json()["coordinates"]]
+
+    # Empty columns
+    response = client.post(
+        "/hpc/columns", json={"x": [], "y": [], "coord_time": [], "target": target}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"x": [], "y": []}
+
+
+def test_columns_errors(client: TestClient):
+    target = "2012-01-01 00:00:00"
+    # Columns with different lengths
+    response = client.post(
+        "/hpc/columns",
+        json={"x": [0, 1], "y": [0], "coord_time": [target], "target": target},
+    )
+    assert response.status_code == 422
+    assert "same length" in response.text
+
+    # Latitude out of range
+    response = client.post(
+        "/hgs2hpc/columns",
+        json={
+            "lat": [0, 91],
+            "lon": [0, 0],
+            "coord_time": [target] * 2,
+            "target": target,
+        },
+    )
+    assert response.status_code == 422
+    assert "index 1" in response.text
+    # NaN, which JSON bodies may contain as a literal
+    response = client.post(
+        "/hgs2hpc/columns",
+        content=f'{{"lat": [NaN, 0], "lon": [0, 0], "coord_time": ["{target}", "{target}"], "target": "{target}"}}',
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 422
+    assert "index 0" in response.text
+
+    # Invalid time
+    response = client.post(
+        "/gse2frame/columns",
+        json={"x": [0, 0], "y": [0, 0], "z": [0, 0], "time": [target, "NotATime"]},
+    )
+    assert response.status_code == 422
+    assert "index 1" in response.text
+
+
+def test_gse_mixed_time_formats(client: TestClient):
+    # Each returned time has the format of its own input time
+    times = ["2024-01-01 00:00:00", "2024-01-02T00:00:00"]
+    expected = ["2024-01-01 00:00:00.000", "2024-01-02T00:00:00.000"]
+    rows = [{"x": 1.0, "y": 0.0, "z": 0.0, "time": t} for t in times]
+    response = client.post("/gse2frame", json={"coordinates": rows})
+    assert response.status_code == 200
+    assert [c["time"] for c in response.json()["coordinates"]] == expected
+
+    columns = {"x": [1.0, 1.0], "y": [0.0, 0.0], "z": [0.0, 0.0], "time": times}
+    response = client.post("/gse2frame/columns", json=columns)
+    assert response.status_code == 200
+    assert response.json()["time"] == expected
+
+
+def test_position_coalesced(tmp_path):
+    """
+    Concurrent requests for the same window share a single upstream fetch
+    """
+    calls = []
+
+    def slow_fetcher(observatory, times):
+        calls.append(len(times))
+        time.sleep(0.5)
+        return get_earth(times)
+
+    cache = EphemerisCache(str(tmp_path), slow_fetcher)
+    set_cache(cache)
+
+    async def request_positions():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(
+                *[
+                    client.get(
+                        "/position/SDO?start=2025-01-01 00:00:00&stop=2025-01-02 00:00:00"
+                    )
+                    for _ in range(8)
+                ]
+            )
+
+    try:
+        responses = asyncio.run(request_positions())
+    finally:
+        set_cache(None)
+
+    assert calls == [25]
+    assert cache.metrics == {"fetched": 1, "coalesced": 7}
+    expected = responses[0].json()
+    for response in responses:
+        assert response.status_code == 200
+        assert len(response.json()["coordinates"]) == 25
+        assert response.json() == expected
+
+
+def test_position_cadence(client: TestClient, tmp_path):
+    set_cache(EphemerisCache(str(tmp_path), lambda name, times: get_earth(times)))
+    try:
+        response = client.get(
+            "/position/SDO?start=2025-01-01 00:00:00&stop=2025-01-01 01:00:00&cadence=600"
+        )
+        assert response.status_code == 200
+        coordinates = response.json()["coordinates"]
+        assert len(coordinates) == 7
+        assert coordinates[1]["time"] == "2025-01-01 00:10:00.000"
+
+        # Cadence must be positive
+        response = client.get(
+            "/position/SDO?start=2025-01-01 00:00:00&stop=2025-01-01 01:00:00&cadence=0"
+        )
+        assert response.status_code == 422
+
+        # Stop before start
+        response = client.get(
+            "/position/SDO?start=2025-01-02 00:00:00&stop=2025-01-01 00:00:00"
+        )
+        assert response.status_code == 422
+    finally:
+        set_cache(None)
+
+
+def test_positions(client: TestClient, tmp_path):
+    set_cache(EphemerisCache(str(tmp_path), lambda name, times: get_earth(times)))
+    try:
+        body = {
+            "observatories": ["SDO", "SOHO", "SDO"],
+            "start": "2025-01-01 00:00:00",
+            "stop": "2025-01-01 01:00:00",
+            "cadence": 600,
+        }
+        response = client.post("/positions", json=body)
+        assert response.status_code == 200
+        observatories = response.json()["observatories"]
+        # Repeated observatories are only returned once
+        assert list(observatories) == ["SDO", "SOHO"]
+        # Each observatory matches GET /position
+        expected = client.get(
+            "/position/SDO?start=2025-01-01 00:00:00&stop=2025-01-01 01:00:00&cadence=600"
+        ).json()["coordinates"]
+        for name in ["SDO", "SOHO"]:
+            assert len(observatories[name]) == 7
+            assert observatories[name][1]["time"] == "2025-01-01 00:10:00.000"
+            for result, position in zip(observatories[name], expected):
+                assert pytest.approx(result["x"]) == position["x"]
+                assert pytest.approx(result["y"]) == position["y"]
+                assert pytest.approx(result["z"]) == position["z"]
+
+        # At least one observatory is required
+        response = client.post("/positions", json={**body, "observatories": []})
+        assert response.status_code == 422
+
+        # Stop before start
+        response = client.post(
+            "/positions", json={**body, "stop": "2024-01-01 00:00:00"}
+        )
+        assert response.status_code == 422
+    finally:
+        set_cache(None)
+
+
+def test_grid_engine(client: TestClient):
+    # The grid engine is within GRID_MAX_ERROR of the default engine
+    query = "lat=10&lon=20&coord_time=2012-01-01 00:00:00&target=2012-01-01 05:00:00"
+    expected = client.get(f"/hgs2hpc?{query}").json()
+    response = client.get(f"/hgs2hpc?{query}&engine=grid")
+    assert response.status_code == 200
+    assert pytest.approx(response.json()["x"], abs=0.1) == expected["x"]
+    assert pytest.approx(response.json()["y"], abs=0.1) == expected["y"]
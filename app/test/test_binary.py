@@ -0,0 +1,183 @@
+import io
+import numpy as np
+import pytest
+from astropy.time import Time
+from fastapi.testclient import TestClient
+
+from ..main import app
+from binary import NPZ_MEDIA_TYPE, read_npz, write_npz, epoch_to_time
+
+# 2012-07-05 13:01:46 UTC in nanoseconds since the unix epoch
+TARGET = 1341493306 * 10**9
+TARGET_ISO = "2012-07-05 13:01:46"
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def post_npz(client: TestClient, path: str, arrays: dict):
+    return client.post(
+        path,
+        content=write_npz(arrays),
+        headers={"Content-Type": NPZ_MEDIA_TYPE},
+    )
+
+
+def iso(ns: np.ndarray) -> list:
+    return epoch_to_time(ns).iso.tolist()
+
+
+def test_epoch_to_time():
+    ns = np.array([TARGET, TARGET + 123456789])
+    times = epoch_to_time(ns)
+    expected = Time([TARGET_ISO, "2012-07-05 13:01:46.123456789"])
+    assert np.all(times.jd1 == expected.jd1)
+    assert np.all(np.abs(times.jd2 - expected.jd2) * 86400 < 1e-9)
+    assert epoch_to_time(np.int64(TARGET)) == Time(TARGET_ISO)
+
+
+def test_hpc_npz(client: TestClient):
+    # Binary results match the JSON results bit for bit
+    rng = np.random.default_rng(4)
+    xs = rng.uniform(-1500, 1500, 20)
+    ys = rng.uniform(-1500, 1500, 20)
+    coord_times = TARGET - rng.integers(0, 86400, 20) * 10**9
+    response = post_npz(
+        client,
+        "/hpc",
+        {"x": xs, "y": ys, "coord_time": coord_times, "target": np.int64(TARGET)},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == NPZ_MEDIA_TYPE
+    result = read_npz(response.content)
+
+    coordinates = [
+        {"x": x, "y": y, "coord_time": t}
+        for x, y, t in zip(xs.tolist(), ys.tolist(), iso(coord_times))
+    ]
+    expected = client.post(
+        "/hpc", json={"coordinates": coordinates, "target": TARGET_ISO}
+    ).json()["coordinates"]
+    assert result["x"].tolist() == [c["x"] for c in expected]
+    assert result["y"].tolist() == [c["y"] for c in expected]
+
+
+def test_hgs2hpc_npz(client: TestClient):
+    rng = np.random.default_rng(5)
+    lats = rng.uniform(-60, 60, 20)
+    lons = rng.uniform(-80, 80, 20)
+    coord_times = TARGET - rng.integers(0, 86400, 20) * 10**9
+    arrays = {"lat": lats, "lon": lons, "coord_time": coord_times}
+    response = post_npz(
+        client, "/hgs2hpc", {**arrays, "target": np.int64(TARGET), "engine": "numpy"}
+    )
+    assert response.status_code == 200
+    result = read_npz(response.content)
+
+    coordinates = [
+        {"lat": lat, "lon": lon, "coord_time": t}
+        for lat, lon, t in zip(lats.tolist(), lons.tolist(), iso(coord_times))
+    ]
+    expected = client.post(
+        "/hgs2hpc",
+        json={"coordinates": coordinates, "target": TARGET_ISO, "engine": "numpy"},
+    ).json()["coordinates"]
+    assert result["x"].tolist() == [c["x"] for c in expected]
+    assert result["y"].tolist() == [c["y"] for c in expected]
+
+
+def test_gse2frame_npz(client: TestClient):
+    xs = np.array([16856.9645, 0.0])
+    ys = np.array([32613.5430, 0.0])
+    zs = np.array([-20740.0146, 0.0])
+    times = np.array([TARGET, TARGET + 3600 * 10**9])
+    response = post_npz(
+        client, "/gse2frame", {"x": xs, "y": ys, "z": zs, "time": times}
+    )
+    assert response.status_code == 200
+    result = read_npz(response.content)
+
+    coordinates = [
+        {"x": x, "y": y, "z": z, "time": t}
+        for x, y, z, t in zip(xs.tolist(), ys.tolist(), zs.tolist(), iso(times))
+    ]
+    expected = client.post("/gse2frame", json={"coordinates": coordinates}).json()
+    for key in ["x", "y", "z"]:
+        assert result[key].tolist() == [c[key] for c in expected["coordinates"]]
+    assert np.array_equal(result["time"], times)
+
+
+def test_npz_errors(client: TestClient):
+    arrays = {
+        "x": np.zeros(2),
+        "y": np.zeros(2),
+        "coord_time": np.full(2, TARGET),
+        "target": np.int64(TARGET),
+    }
+    # Not an npz archive
+    response = client.post(
+        "/hpc", content=b"invalid", headers={"Content-Type": NPZ_MEDIA_TYPE}
+    )
+    assert response.status_code == 422
+
+    # Missing and unknown fields
+    response = post_npz(client, "/hpc", {**arrays, "z": np.zeros(2)})
+    assert response.status_code == 422
+    assert "Unknown fields" in response.text
+    response = post_npz(client, "/hpc", {"x": arrays["x"]})
+    assert response.status_code == 422
+    assert "Missing fields" in response.text
+
+    # Wrong dtype, columns with different lengths, bad engine
+    response = post_npz(client, "/hpc", {**arrays, "x": np.zeros(2, np.float32)})
+    assert response.status_code == 422
+    response = post_npz(client, "/hpc", {**arrays, "y": np.zeros(3)})
+    assert response.status_code == 422
+    assert "same length" in response.text
+    response = post_npz(client, "/hpc", {**arrays, "engine": "fast"})
+    assert response.status_code == 422
+
+    # Latitude out of range
+    response = post_npz(
+        client,
+        "/hgs2hpc",
+        {
+            "lat": np.array([0, 91.0]),
+            "lon": np.zeros(2),
+            "coord_time": arrays["coord_time"],
+            "target": arrays["target"],
+        },
+    )
+    assert response.status_code == 422
+    assert "index 1" in response.text
+    response = post_npz(
+        client,
+        "/hgs2hpc",
+        {
+            "lat": np.array([0, np.nan]),
+            "lon": np.zeros(2),
+            "coord_time": arrays["coord_time"],
+            "target": arrays["target"],
+        },
+    )
+    assert response.status_code == 422
+    assert "index 1" in response.text
+
+    # Compressed archives are rejected before they are decompressed
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    response = client.post(
+        "/hpc", content=buffer.getvalue(), headers={"Content-Type": NPZ_MEDIA_TYPE}
+    )
+    assert response.status_code == 422
+    assert "uncompressed" in response.text
+
+    # Client doesn't accept npz responses
+    response = client.post(
+        "/hpc",
+        content=write_npz(arrays),
+        headers={"Content-Type": NPZ_MEDIA_TYPE, "Accept": "application/json"},
+    )
+    assert response.status_code == 406
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from ..main import app, _hpc_coalescer
+import coalesce
+from coalesce import Coalescer
+
+
+def run_threads(coalescer: Coalescer, submissions, window=0.2):
+    results = [None] * len(submissions)
+
+    def submit(i, key, item):
+        try:
+            results[i] = coalescer.submit(key, item, window)
+        except Exception as e:
+            results[i] = e
+
+    threads = [
+        threading.Thread(target=submit, args=(i, key, item))
+        for i, (key, item) in enumerate(submissions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_coalescer():
+    calls = []
+
+    def double(key, items):
+        calls.append((key, len(items)))
+        return [(key, item[0] * 2) for item in items]
+
+    coalescer = Coalescer(double)
+    submissions = [("a", (1,)), ("b", (2,)), ("a", (3,)), ("a", (4,))]
+    results = run_threads(coalescer, submissions)
+    # Each caller gets its own result, batches are split by key
+    assert results == [("a", 2), ("b", 4), ("a", 6), ("a", 8)]
+    assert sorted(calls) == [("a", 3), ("b", 1)]
+    assert coalescer.metrics == {"batches": 2, "coalesced": 2}
+
+
+def test_coalescer_errors():
+    def check(key, items):
+        if any(item[0] < 0 for item in items):
+            raise ValueError("negative")
+        return [item for item in items]
+
+    # Only the item which fails raises
+    results = run_threads(Coalescer(check), [("a", (1,)), ("a", (-1,)), ("a", (2,))])
+    assert results[0] == (1,) and results[2] == (2,)
+    assert isinstance(results[1], ValueError)
+
+    with pytest.raises(ValueError):
+        Coalescer(check).submit("a", (-1,), 0)
+
+
+def test_coalesced_requests(monkeypatch):
+    """
+    Concurrent GET requests return the same results with coalescing on
+    """
+    queries = [
+        f"/hpc?x={x}&y={-x}&coord_time=2012-07-05 1{i}:00:00&target=2012-07-05 13:01:46"
+        for i, x in enumerate([-800, -300, 0, 450, 900])
+    ] + [
+        f"/hgs2hpc?lat={lat}&lon={-lat}&coord_time=2012-07-05 1{i}:00:00&target=2012-07-05 13:01:46"
+        for i, lat in enumerate([-40, 0, 25])
+    ]
+
+    async def request_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(*[client.get(query) for query in queries])
+
+    expected = [response.json() for response in asyncio.run(request_all())]
+    monkeypatch.setattr(coalesce, "COALESCE_WINDOW", 200)
+    coalesced = _hpc_coalescer.metrics["coalesced"]
+    responses = asyncio.run(request_all())
+    assert _hpc_coalescer.metrics["coalesced"] > coalesced
+    for response, coord in zip(responses, expected):
+        assert response.status_code == 200
+        assert pytest.approx(response.json()["x"], abs=1e-10) == coord["x"]
+        assert pytest.approx(response.json()["y"], abs=1e-10) == coord["y"]
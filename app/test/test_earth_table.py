@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from astropy.time import Time
+import astropy.units as u
+from sunpy.coordinates import get_earth
+
+import frames
+from earth_table import earth_hgs
+from normalizer import normalize_hpc_batch
+
+
+# Future dates are past the end of the leap second table
+@pytest.mark.filterwarnings("ignore::erfa.ErfaWarning")
+def test_earth_table_accuracy():
+    rng = np.random.default_rng(0)
+    times = Time("1991-01-01", scale="tt") + rng.uniform(0, 58 * 365.25, 1000) * u.day
+    lon, lat, radius = earth_hgs(times)
+    earth = get_earth(times)
+    assert np.max(np.abs(lon - earth.lon)) < 0.001 * u.arcsec
+    assert np.max(np.abs(lat - earth.lat)) < 0.001 * u.arcsec
+    assert np.max(np.abs(radius - earth.radius)) < 1 * u.km
+
+    # Scalar times return scalar quantities
+    lon, lat, radius = earth_hgs("2012-07-05 13:01:46")
+    assert lat.isscalar
+    assert abs(lat - get_earth("2012-07-05 13:01:46").lat) < 0.001 * u.arcsec
+
+
+def test_earth_table_out_of_range():
+    assert earth_hgs("1980-01-01") is None
+    assert earth_hgs(Time(["2000-01-01", "2060-01-01"], scale="tt")) is None
+
+
+def test_earth_table_frames(monkeypatch):
+    coordinates = [
+        {"x": 515, "y": -342, "coord_time": Time("2012-07-05 13:01:46")},
+        {"x": -883, "y": -348, "coord_time": Time("2012-07-05 03:29:06")},
+        {"x": 100, "y": 200, "coord_time": Time("2024-01-01 00:00:00")},
+    ]
+    target = Time("2024-01-02 00:00:00")
+    expected = normalize_hpc_batch(coordinates, target)
+    monkeypatch.setattr(frames, "USE_EARTH_TABLE", True)
+    observer = frames.get_earth_observer(Time(["2012-07-05", "2024-01-01"]))
+    assert observer.obstime.shape == (2,)
+    result = normalize_hpc_batch(coordinates, target)
+    for a, b in zip(expected, result):
+        assert pytest.approx(a["x"], abs=1e-4) == b["x"]
+        assert pytest.approx(a["y"], abs=1e-4) == b["y"]
@@ -1,6 +1,22 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
 from astropy.time import Time, TimeDelta
 import astropy.units as u
-from ephemeris import get_position
+from sunpy.coordinates import get_earth
+from sunpy.coordinates.frames import HeliographicStonyhurst
+import ephemeris
+from ephemeris import (
+    MAX_OBSERVATORIES,
+    EphemerisCache,
+    get_position,
+    get_positions,
+    set_cache,
+)
 
 
 def test_ephemeris():
@@ -11,3 +27,252 @@ def test_ephemeris():
     assert len(positions) == 13
     for i, pos in enumerate(positions):
         assert pos.obstime == start + TimeDelta(i * u.hour)
+
+
+class CountingFetcher:
+    """
+    Local stand-in for get_horizons_coord which uses earth's position
+    and records every upstream call
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, observatory, times):
+        self.calls.append(len(times))
+        return get_earth(times)
+
+
+def test_ephemeris_cache(tmp_path):
+    fetcher = CountingFetcher()
+    cache = EphemerisCache(str(tmp_path), fetcher)
+    start = Time("2025-01-01 00:00:00")
+    times = start + np.arange(13) * u.hour
+
+    first = cache.get("sdo", times)
+    assert fetcher.calls == [13]
+    expected = get_earth(times)
+    assert np.allclose(first.lon.deg, expected.lon.deg)
+    assert np.allclose(first.lat.deg, expected.lat.deg)
+    assert np.allclose(first.radius.to_value(u.AU), expected.radius.to_value(u.AU))
+    assert np.all(first.obstime == times)
+
+    # Same span is served from disk
+    second = cache.get("SDO", times)
+    assert fetcher.calls == [13]
+    assert np.all(second.lon.deg == first.lon.deg)
+
+    # Overlapping span only fetches the missing hours
+    cache.get("sdo", start + np.arange(6, 20) * u.hour)
+    assert fetcher.calls == [13, 7]
+
+    # Cache persists across instances
+    fetcher = CountingFetcher()
+    cache = EphemerisCache(str(tmp_path), fetcher)
+    cache.get("sdo", start + np.arange(20) * u.hour)
+    assert fetcher.calls == []
+
+    # Times which are not on the hour are never cached
+    offset = start + 30 * u.minute + np.arange(2) * u.hour
+    cache.get("sdo", offset)
+    cache.get("sdo", offset)
+    assert fetcher.calls == [2, 2]
+
+
+def test_get_position_uses_cache(tmp_path):
+    fetcher = CountingFetcher()
+    set_cache(EphemerisCache(str(tmp_path), fetcher))
+    try:
+        start = Time("2025-01-01 00:00:00")
+        positions = get_position("sdo", start, Time("2025-01-01 12:00:00"))
+        positions = get_position("sdo", start, Time("2025-01-01 12:00:00"))
+        assert len(positions) == 13
+        assert fetcher.calls == [13]
+    finally:
+        set_cache(None)
+
+
+def test_ephemeris_cache_coalesces_overlapping_fetches(tmp_path):
+    release = threading.Event()
+    fetcher = CountingFetcher()
+
+    def blocking_fetcher(observatory, times):
+        result = fetcher(observatory, times)
+        release.wait(10)
+        return result
+
+    cache = EphemerisCache(str(tmp_path), blocking_fetcher)
+    start = Time("2025-01-01 00:00:00")
+    results = {}
+
+    def request(name, first, last):
+        results[name] = cache.get("sdo", start + np.arange(first, last) * u.hour)
+
+    leader = threading.Thread(target=request, args=("leader", 0, 13))
+    leader.start()
+    while len(fetcher.calls) < 1:
+        time.sleep(0.01)
+    follower = threading.Thread(target=request, args=("follower", 6, 20))
+    follower.start()
+    while len(fetcher.calls) < 2:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    # The follower only fetched the hours the leader wasn't already fetching
+    assert fetcher.calls == [13, 7]
+    assert cache.metrics == {"fetched": 2, "coalesced": 1}
+    expected = get_earth(start + np.arange(6, 20) * u.hour)
+    assert np.allclose(results["follower"].lon.deg, expected.lon.deg)
+    assert np.allclose(results["follower"].lat.deg, expected.lat.deg)
+
+
+def test_ephemeris_cache_coalesced_error(tmp_path):
+    release = threading.Event()
+
+    def failing_fetcher(observatory, times):
+        release.wait(10)
+        raise ValueError("Horizons is down")
+
+    cache = EphemerisCache(str(tmp_path), failing_fetcher)
+    times = Time("2025-01-01 00:00:00") + np.arange(3) * u.hour
+    errors = []
+
+    def request():
+        try:
+            cache.get("sdo", times)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.metrics["coalesced"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 4
+    assert cache.metrics["fetched"] == 1
+
+
+class OrbitFetcher(CountingFetcher):
+    """
+    Stand-in fetcher for an observatory in a geosynchronous orbit around earth
+    """
+
+    def __call__(self, observatory, times):
+        earth = super().__call__(observatory, times)
+        earth.representation_type = "cartesian"
+        phase = 2 * np.pi * (times.unix / 86164)
+        orbit = 42164 * u.km
+        return SkyCoord(
+            earth.x + orbit * np.cos(phase),
+            earth.y + orbit * np.sin(phase),
+            earth.z,
+            frame=HeliographicStonyhurst,
+            obstime=times,
+            representation_type="cartesian",
+        )
+
+
+def test_get_position_cadence(tmp_path):
+    fetcher = OrbitFetcher()
+    set_cache(EphemerisCache(str(tmp_path), fetcher))
+    try:
+        start = Time("2025-01-01 00:05:00")
+        end = Time("2025-01-02 00:05:00")
+        positions = get_position("sdo", start, end, 1 * u.minute)
+        assert len(positions) == 24 * 60 + 1
+        assert np.all(positions.obstime == start + np.arange(24 * 60 + 1) * u.minute)
+        # Only the hourly anchors are fetched
+        assert fetcher.calls == [28]
+
+        # Interpolated positions are within the documented error bound
+        exact = OrbitFetcher()("sdo", positions.obstime)
+        error = (positions.cartesian - exact.cartesian).norm().to_value(u.km)
+        assert np.max(error) < 5
+
+        # Coarse cadences are looked up directly
+        positions = get_position("sdo", start, end, 6 * u.hour)
+        assert len(positions) == 5
+        assert fetcher.calls[-1] == 5
+
+        with pytest.raises(ValueError):
+            get_position("sdo", end, start)
+        with pytest.raises(ValueError):
+            get_position("sdo", start, Time("2026-01-01"), 1 * u.second)
+    finally:
+        set_cache(None)
+
+
+def test_get_positions(tmp_path):
+    names = []
+    lock = threading.Lock()
+    # Every observatory must be fetching at once for the barrier to pass
+    barrier = threading.Barrier(3, timeout=10)
+
+    def fetcher(observatory, times):
+        with lock:
+            names.append(observatory)
+        barrier.wait()
+        return OrbitFetcher()(observatory, times)
+
+    set_cache(EphemerisCache(str(tmp_path), fetcher))
+    try:
+        start = Time("2025-01-01 00:00:00")
+        end = Time("2025-01-01 12:00:00")
+        positions = get_positions(["sdo", "soho", "psp"], start, end)
+        assert sorted(names) == ["psp", "sdo", "soho"]
+        assert len(positions) == 3 * 13
+        assert np.all(positions.obstime[13:26] == start + np.arange(13) * u.hour)
+        # Each observatory's rows match get_position
+        expected = get_position("soho", start, end)
+        error = (positions[13:26].cartesian - expected.cartesian).norm()
+        assert np.max(error.to_value(u.km)) < 1e-6
+
+        # Fine cadences are interpolated for each observatory
+        barrier.reset()
+        positions = get_positions(["sdo", "soho", "psp"], start, end, 10 * u.minute)
+        assert len(positions) == 3 * 73
+
+        with pytest.raises(ValueError):
+            get_positions(["sdo"], end, start)
+        with pytest.raises(ValueError):
+            get_positions([f"obs{i}" for i in range(MAX_OBSERVATORIES + 1)], start, end)
+    finally:
+        set_cache(None)
+
+
+def test_get_positions_limits(tmp_path, monkeypatch):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fetcher(observatory, times):
+        with lock:
+            active.append(observatory)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(observatory)
+        return get_earth(times)
+
+    # Lookups share a pool of threads, whatever the number of observatories
+    monkeypatch.setattr(ephemeris, "_executor", ThreadPoolExecutor(max_workers=2))
+    set_cache(EphemerisCache(str(tmp_path), fetcher))
+    try:
+        start = Time("2025-01-01 00:00:00")
+        end = Time("2025-01-01 12:00:00")
+        positions = get_positions([f"obs{i}" for i in range(6)], start, end)
+        assert len(positions) == 6 * 13
+        assert max(peak) == 2
+
+        # MAX_POSITIONS counts the positions of every observatory
+        monkeypatch.setattr(ephemeris, "MAX_POSITIONS", 20)
+        assert len(get_positions(["sdo"], start, end)) == 13
+        with pytest.raises(ValueError, match="26 positions"):
+            get_positions(["sdo", "soho"], start, end)
+    finally:
+        set_cache(None)
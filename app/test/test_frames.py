@@ -0,0 +1,116 @@
+import threading
+import time
+
+from astropy.time import Time
+from sunpy.coordinates import get_earth
+from sunpy.coordinates.frames import Helioprojective
+
+import frames
+from frames import (
+    get_earth_frame,
+    get_helioviewer_frame,
+    frame_cache_info,
+    group_by_time,
+)
+
+
+def test_earth_frame_cache():
+    before = frame_cache_info()["earth"]
+    first = get_earth_frame("2013-03-04 05:06:07")
+    # Same time in a different format hits the same entry
+    second = get_earth_frame(Time("2013-03-04T05:06:07"))
+    after = frame_cache_info()["earth"]
+    assert first is second
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    # Cached frame matches a freshly built frame
+    fresh = Helioprojective(observer="earth", obstime="2013-03-04 05:06:07")
+    assert first.obstime == fresh.obstime
+    assert first.observer.lon == fresh.observer.lon
+    assert first.observer.lat == fresh.observer.lat
+    assert first.observer.radius == fresh.observer.radius
+
+
+def test_helioviewer_frame_cache():
+    before = frame_cache_info()["helioviewer"]
+    first = get_helioviewer_frame("2014-05-06 07:08:09")
+    second = get_helioviewer_frame("2014-05-06 07:08:09")
+    after = frame_cache_info()["helioviewer"]
+    assert first is second
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+    earth = get_earth("2014-05-06 07:08:09")
+    assert first.observer.lon == earth.lon
+    assert first.observer.radius.to_value("au") == 1
+
+
+def test_array_frames_not_cached():
+    before = frame_cache_info()["earth"]
+    frame = get_earth_frame(["2015-01-01 00:00:00", "2015-01-02 00:00:00"])
+    assert frame.obstime.shape == (2,)
+    assert frame_cache_info()["earth"] == before
+
+
+def test_frame_cache_quantum(monkeypatch):
+    monkeypatch.setattr(frames, "FRAME_CACHE_QUANTUM", 60)
+    first = get_earth_frame("2016-01-01 00:00:10")
+    second = get_earth_frame("2016-01-01 00:00:20")
+    assert first is second
+    assert first.obstime == Time("2016-01-01 00:00:00")
+
+
+def test_group_by_time(monkeypatch):
+    times = Time(["2017-01-01", "2017-01-02", "2017-01-01", "2017-01-02T00:00:00"])
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 2)
+    groups = group_by_time(times)
+    assert len(groups) == 2
+    assert groups[0][0] == Time("2017-01-01")
+    assert groups[0][1].tolist() == [0, 2]
+    assert groups[1][0] == Time("2017-01-02")
+    assert groups[1][1].tolist() == [1, 3]
+
+    # Too few times per group
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 3)
+    assert group_by_time(times) is None
+    assert group_by_time(Time("2017-01-01")) is None
+
+
+def test_transform_chunks(monkeypatch):
+    monkeypatch.setattr(frames, "TRANSFORM_CHUNK_SIZE", 4)
+    assert list(frames.transform_chunks(10)) == [
+        slice(0, 4),
+        slice(4, 8),
+        slice(8, 10),
+    ]
+    assert list(frames.transform_chunks(0)) == []
+
+
+def test_transform_lock_fair():
+    """
+    A thread taking the lock again waits behind threads already waiting
+    """
+    lock = frames._FairLock()
+    order = []
+    holding = threading.Event()
+
+    def chunked():
+        for i in range(3):
+            with lock:
+                # Reentrant
+                with lock:
+                    order.append(f"batch {i}")
+                holding.set()
+                time.sleep(0.1)
+
+    def point():
+        holding.wait()
+        with lock:
+            order.append("point")
+
+    threads = [threading.Thread(target=chunked), threading.Thread(target=point)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert order == ["batch 0", "point", "batch 1", "batch 2"]
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from astropy.time import Time
+import astropy.units as u
+
+import grid
+import rotation
+
+
+@pytest.fixture(autouse=True)
+def clear_grids():
+    grid._get_grid.cache_clear()
+    yield
+    grid._get_grid.cache_clear()
+
+
+def test_grid_matches_numpy():
+    # Points on the visible side are within GRID_MAX_ERROR of the numpy
+    # engine, even when their coord_times are far from the bucket's time
+    rng = np.random.default_rng(4)
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - rng.uniform(-48, 48, 2000) * u.hour
+    lats = rng.uniform(-80, 80, 2000)
+    lons = rng.uniform(-180, 180, 2000)
+    expected = rotation.hgs2hpc(lats, lons, coord_times, target)
+    actual = grid.hgs2hpc(lats, lons, coord_times, target)
+    error = np.hypot(actual[0] - expected[0], actual[1] - expected[1])
+    assert np.all(error <= grid.GRID_MAX_ERROR)
+
+
+def test_grid_falls_back_off_disk(monkeypatch):
+    # Points on the far side and at the limb are answered exactly
+    monkeypatch.setattr(grid, "metrics", {"interpolated": 0, "exact": 0})
+    target = Time("2020-01-01 00:00:00")
+    lats = np.array([0, 10, 0, -30])
+    lons = np.array([0, 180, 90, -95])
+    expected = rotation.hgs2hpc(lats, lons, target, target)
+    actual = grid.hgs2hpc(lats, lons, target, target)
+    assert np.array_equal(actual[0][1:], expected[0][1:])
+    assert np.array_equal(actual[1][1:], expected[1][1:])
+    assert grid.metrics == {"interpolated": 1, "exact": 3}
+
+
+def test_grid_cache(monkeypatch):
+    # Times in the same bucket share a grid
+    monkeypatch.setattr(grid, "GRID_TIME_BUCKET", 3600)
+    target = Time("2020-01-01 00:00:00")
+    grid.hgs2hpc([0], [0], Time("2020-01-01 00:10:00"), target)
+    grid.hgs2hpc([0], [0], Time("2020-01-01 00:20:00"), target)
+    info = grid._get_grid.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
@@ -0,0 +1,70 @@
+import threading
+
+from health import SelfTest
+from warmup import warm_up
+
+
+def test_self_test():
+    def broken():
+        raise RuntimeError("no ephemeris")
+
+    self_test = SelfTest({"ok": lambda: None, "broken": broken}, 0)
+    assert self_test.status()["ready"] is False
+    self_test.start()
+    result = self_test.wait(10)
+    assert result["ready"] is False
+    assert result["checks"] == {"ok": "ok", "broken": "RuntimeError: no ephemeris"}
+    self_test.stop()
+
+
+def test_self_test_interval():
+    # The checks are run again every interval until stopped
+    runs = threading.Semaphore(0)
+    self_test = SelfTest({"count": runs.release}, 0.01)
+    self_test.start()
+    for _ in range(3):
+        assert runs.acquire(timeout=10)
+    self_test.stop()
+    assert self_test.status()["ready"] is True
+
+
+def test_self_test_warmup():
+    # The warm-up runs once before the first checks and its errors are
+    # reported as a failed check
+    calls = []
+
+    def warmup():
+        calls.append("warmup")
+        raise ValueError("bad frame")
+
+    self_test = SelfTest({"ok": lambda: calls.append("ok")}, 0, warmup)
+    self_test.start()
+    result = self_test.wait(10)
+    self_test.stop()
+    assert calls == ["warmup", "ok"]
+    assert result["ready"] is False
+    assert result["checks"] == {"warmup": "ValueError: bad frame", "ok": "ok"}
+
+
+def test_self_test_warmup_retried():
+    # A failed warm-up is run again with the next checks, until it succeeds
+    calls = []
+    runs = threading.Semaphore(0)
+
+    def warmup():
+        calls.append("warmup")
+        if len(calls) == 1:
+            raise ValueError("bad frame")
+
+    self_test = SelfTest({"count": runs.release}, 0.01, warmup)
+    self_test.start()
+    for _ in range(3):
+        assert runs.acquire(timeout=10)
+    self_test.stop()
+    assert calls == ["warmup", "warmup"]
+    assert self_test.status()["ready"] is True
+    assert self_test.status()["checks"]["warmup"] == "ok"
+
+
+def test_warm_up():
+    warm_up()
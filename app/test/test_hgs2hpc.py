@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from astropy.time import Time
+import astropy.units as u
+
+import frames
+from hgs2hpc import hgs2hpc_columns
+
+
+def test_hgs2hpc_grouped_times(monkeypatch):
+    # Grouping coordinates by coord_time gives the same results as
+    # transforming the whole array at once
+    rng = np.random.default_rng(1)
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - rng.integers(0, 5, size=200) * 37 * u.min
+    lats = rng.uniform(-60, 60, 200)
+    lons = rng.uniform(-80, 80, 200)
+    grouped = hgs2hpc_columns(lats, lons, coord_times, target)
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 1000)
+    ungrouped = hgs2hpc_columns(lats, lons, coord_times, target)
+    assert np.allclose(grouped[0], ungrouped[0], rtol=0, atol=1e-6)
+    assert np.allclose(grouped[1], ungrouped[1], rtol=0, atol=1e-6)
+    assert hgs2hpc_columns([], [], Time([], format="iso"), target)[0].shape == (0,)
+
+
+def test_hgs2hpc_grouped_matches_scalar():
+    target = Time("2020-01-01 00:00:00")
+    coord_times = Time(["2019-12-31 22:00:00"] * 100)
+    lats = np.linspace(-50, 50, 100)
+    lons = np.linspace(-70, 70, 100)
+    x, y = hgs2hpc_columns(lats, lons, coord_times, target)
+    for i in [0, 42, 99]:
+        single = hgs2hpc_columns([lats[i]], [lons[i]], coord_times[[i]], target)
+        assert pytest.approx(single[0][0], abs=1e-6) == x[i]
+        assert pytest.approx(single[1][0], abs=1e-6) == y[i]
@@ -0,0 +1,131 @@
+import json
+import os
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from fastapi.testclient import TestClient
+from sunpy.coordinates import get_earth
+
+import metrics
+from ephemeris import EphemerisCache
+from metrics import Counter, Histogram, stage
+from ..main import app
+
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "Test", ["route"], (0.1, 1))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5, "/a")
+    assert histogram.render() == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_seconds_bucket{route="/a",le="1"} 2',
+        'test_seconds_bucket{route="/a",le="+Inf"} 3',
+        'test_seconds_sum{route="/a"} 5.55',
+        'test_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_counter_render():
+    counter = Counter("test_total", "Test", ["outcome"])
+    metrics.REGISTRY.remove(counter)
+    counter.inc("ok")
+    counter.inc("ok", amount=2)
+    assert counter.render()[2:] == ['test_total{outcome="ok"} 3']
+
+
+def test_stage_nesting():
+    # A stage entered inside itself is only recorded once
+    count = metrics.STAGE_SECONDS.count("test")
+    with stage("test"):
+        with stage("test"):
+            pass
+    assert metrics.STAGE_SECONDS.count("test") == count + 1
+
+
+def test_horizons_metrics(tmp_path):
+    cache = EphemerisCache(str(tmp_path), lambda observatory, times: get_earth(times))
+    calls = metrics.HORIZONS_REQUESTS.value("ok")
+    hits = metrics.EPHEMERIS_ROWS.value("hit")
+    times = Time("2025-01-01") + np.arange(3) * u.hour
+    cache.get("sdo", times)
+    cache.get("sdo", times)
+    assert metrics.HORIZONS_REQUESTS.value("ok") == calls + 1
+    assert metrics.EPHEMERIS_ROWS.value("hit") == hits + 3
+
+
+def test_metrics_endpoint():
+    client = TestClient(app)
+    count = metrics.REQUEST_SECONDS.count("POST", "/hpc", "200")
+    batch = {
+        "coordinates": [{"x": 515, "y": -342, "coord_time": "2012-07-05T13:01:46"}],
+        "target": "2012-07-05T13:01:46",
+    }
+    assert client.post("/hpc", json=batch).status_code == 200
+    assert metrics.REQUEST_SECONDS.count("POST", "/hpc", "200") == count + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    for stage_name in ["validation", "parse_times", "transform", "serialize"]:
+        assert any(
+            line.startswith(f'coordinator_stage_seconds_count{{stage="{stage_name}"}}')
+            for line in lines
+        )
+    assert any(
+        line.startswith('coordinator_batch_size_count{operation="hpc"}')
+        for line in lines
+    )
+    assert any(
+        line.startswith('coordinator_cache_hit_ratio{cache="responses"}')
+        for line in lines
+    )
+
+
+def test_metrics_dir(tmp_path, monkeypatch):
+    # With METRICS_DIR, /metrics reports the sum over every process's file
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    other = Counter("coordinator_horizons_requests_total", "Test", ["outcome"])
+    metrics.REGISTRY.remove(other)
+    other.inc("ok", amount=5)
+    histogram = Histogram(
+        "coordinator_stage_seconds", "Test", ["stage"], metrics.LATENCY_BUCKETS
+    )
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.2, "test_other_process")
+    snapshot = {
+        "metrics": {other.name: other.state(), histogram.name: histogram.state()},
+        "caches": {"responses": [3, 4]},
+    }
+    (tmp_path / "metrics-1.json").write_text(json.dumps(snapshot))
+
+    calls = metrics.HORIZONS_REQUESTS.value("ok")
+    text = metrics.render_all({"responses": (1, 2)})
+    assert f'coordinator_horizons_requests_total{{outcome="ok"}} {calls + 5:g}' in text
+    assert 'coordinator_stage_seconds_count{stage="test_other_process"} 1' in text
+    assert 'coordinator_cache_hits_total{cache="responses"} 4' in text
+    assert 'coordinator_cache_misses_total{cache="responses"} 6' in text
+    # This process's own file was written too, and its metrics are unchanged
+    assert (tmp_path / f"metrics-{os.getpid()}.json").exists()
+    assert metrics.HORIZONS_REQUESTS.value("ok") == calls
+
+
+def test_state_merge():
+    histogram = Histogram("test_seconds", "Test", ["route"], (0.1, 1))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.05, "/a")
+    histogram.observe(5, "/a")
+    state = json.loads(json.dumps(histogram.state(clear=True)))
+    assert histogram.count("/a") == 0
+    histogram.merge(state)
+    histogram.merge(state)
+    assert histogram.count("/a") == 4
+    assert histogram.render()[-2:] == [
+        'test_seconds_sum{route="/a"} 10.1',
+        'test_seconds_count{route="/a"} 4',
+    ]
@@ -1,9 +1,19 @@
+import numpy as np
 import pytest
 
 from astropy.time import Time, TimeDelta
+from sunpy.coordinates import get_earth
 import astropy.units as u
 from ephemeris import get_position
-from ..normalizer import normalize_hpc, jsonify_skycoord
+from ..normalizer import (
+    normalize_hpc,
+    jsonify_skycoord,
+    gse_frame,
+    gse_frame_batch,
+    normalize_hpc_columns,
+    _normalize_skycoord,
+)
+import frames
 
 
 def test_normalize():
@@ -35,3 +45,74 @@ def test_jsonify_skycoord():
     # Asset there is a coordinate for each time point between start and end.
     for i, coord in enumerate(result):
         assert coord["time"] == str(start + TimeDelta(i * u.hour))
+
+
+def test_gse_frame_batch():
+    # Batched results must match transforming each point on its own
+    xs = [16856.9645, -250000.0, 0.0, 1.5e6]
+    ys = [32613.5430, 120000.0, 0.0, -3.0e5]
+    zs = [-20740.0146, 5000.0, 0.0, 7.5e4]
+    times = [
+        Time("2025-01-01 00:00:00"),
+        Time("2024-06-15 12:30:00"),
+        Time("2024-01-02"),
+        Time("2023-03-01 06:00:00"),
+    ]
+    batched = gse_frame_batch(xs, ys, zs, times)
+    assert len(batched) == len(xs)
+    for i, result in enumerate(batched):
+        expected = gse_frame(xs[i], ys[i], zs[i], times[i])
+        assert pytest.approx(expected["x"], rel=1e-12, abs=1e-6) == result["x"]
+        assert pytest.approx(expected["y"], rel=1e-12, abs=1e-6) == result["y"]
+        assert pytest.approx(expected["z"], rel=1e-12, abs=1e-6) == result["z"]
+        assert expected["time"] == result["time"]
+
+    assert gse_frame_batch([], [], [], []) == []
+
+
+def test_gse_frame_batch_mixed_formats():
+    # Each point keeps the format of its own time, like gse_frame
+    times = [
+        Time("2024-01-01 00:00:00"),
+        Time("2024-01-02T00:00:00"),
+        Time("2024:003:00:00:00"),
+    ]
+    batched = gse_frame_batch([1.0, 2.0, 3.0], [0.0] * 3, [0.0] * 3, times)
+    assert [result["time"] for result in batched] == [
+        "2024-01-01 00:00:00.000",
+        "2024-01-02T00:00:00.000",
+        "2024:003:00:00:00.000",
+    ]
+    for i, result in enumerate(batched):
+        assert result["time"] == gse_frame(i + 1.0, 0.0, 0.0, times[i])["time"]
+
+
+def test_jsonify_skycoord_matches_scalar():
+    # The array path must produce the same values as normalizing each
+    # element of the coordinate on its own
+    start = Time("2025-01-01 00:00:00")
+    times = start + np.arange(30) * u.hour
+    coord = get_earth(times)
+    result = jsonify_skycoord(coord)
+    assert len(result) == 30
+    for i, row in enumerate(result):
+        expected = _normalize_skycoord(coord[i])
+        assert pytest.approx(expected["x"], rel=1e-12, abs=1e-6) == row["x"]
+        assert pytest.approx(expected["y"], rel=1e-12, abs=1e-6) == row["y"]
+        assert pytest.approx(expected["z"], rel=1e-12, abs=1e-6) == row["z"]
+        assert expected["time"] == row["time"]
+
+
+def test_normalize_hpc_grouped_times(monkeypatch):
+    # Grouping coordinates by coord_time gives the same results as
+    # transforming the whole array at once, including off disk points
+    rng = np.random.default_rng(2)
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - rng.integers(0, 5, size=200) * 37 * u.min
+    xs = rng.uniform(-1200, 1200, 200)
+    ys = rng.uniform(-1200, 1200, 200)
+    grouped = normalize_hpc_columns(xs, ys, coord_times, target)
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 1000)
+    ungrouped = normalize_hpc_columns(xs, ys, coord_times, target)
+    assert np.allclose(grouped[0], ungrouped[0], rtol=0, atol=1e-6, equal_nan=True)
+    assert np.allclose(grouped[1], ungrouped[1], rtol=0, atol=1e-6, equal_nan=True)
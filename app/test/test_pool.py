@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from astropy.time import Time
+import astropy.units as u
+
+import metrics
+import pool
+from hgs2hpc import hgs2hpc_columns
+from normalizer import normalize_hpc_columns, gse_frame_arrays
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    monkeypatch.setattr(pool, "POOL_WORKERS", 2)
+    monkeypatch.setattr(pool, "POOL_MIN_BATCH", 10)
+    yield
+    pool.shutdown()
+
+
+def test_pool_matches_single_process(sharded):
+    # Sharded results are the same, and in the same order, as running the
+    # whole batch in this process
+    rng = np.random.default_rng(6)
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - rng.uniform(0, 24, 25) * u.hour
+    xs = rng.uniform(-1200, 1200, 25)
+    ys = rng.uniform(-1200, 1200, 25)
+    zs = rng.uniform(-1e5, 1e5, 25)
+
+    results = [
+        normalize_hpc_columns(xs, ys, coord_times, target, "sunpy"),
+        hgs2hpc_columns(ys / 20, xs / 20, coord_times, target, "sunpy"),
+        gse_frame_arrays(xs, ys, zs, coord_times),
+    ]
+    pool.POOL_WORKERS = 0
+    expected = [
+        normalize_hpc_columns(xs, ys, coord_times, target, "sunpy"),
+        hgs2hpc_columns(ys / 20, xs / 20, coord_times, target, "sunpy"),
+        gse_frame_arrays(xs, ys, zs, coord_times),
+    ]
+    for result, columns in zip(results, expected):
+        for actual, column in zip(result, columns):
+            assert len(actual) == 25
+            assert np.allclose(actual, column, rtol=1e-12, atol=1e-9)
+
+
+def test_should_shard(monkeypatch):
+    monkeypatch.setattr(pool, "POOL_WORKERS", 0)
+    assert not pool.should_shard(10**6)
+    monkeypatch.setattr(pool, "POOL_WORKERS", 4)
+    monkeypatch.setattr(pool, "POOL_MIN_BATCH", 100)
+    assert not pool.should_shard(99)
+    assert pool.should_shard(100)
+
+
+def test_pool_stage_metrics(sharded):
+    # Stage timings recorded in the workers are added to the server's,
+    # except the transform stage which the server times itself
+    target = Time("2020-01-01 00:00:00")
+    coord_times = target - np.arange(20) * u.hour
+    transforms = metrics.STAGE_SECONDS.count("transform")
+    rotates = metrics.STAGE_SECONDS.count("rotate")
+    hgs2hpc_columns(np.zeros(20), np.zeros(20), coord_times, target, "sunpy")
+    assert metrics.STAGE_SECONDS.count("transform") == transforms + 1
+    assert metrics.STAGE_SECONDS.count("rotate") >= rotates + 2
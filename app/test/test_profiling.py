@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import ProfiledRoute, ProfilingMiddleware
+
+
+def _slow_sum(n: int) -> int:
+    return sum(range(n))
+
+
+def _app(started: threading.Event = None, release: threading.Event = None):
+    app = FastAPI()
+    app.router.route_class = ProfiledRoute
+
+    @app.get("/sum")
+    def sum_route(n: int):
+        return _slow_sum(n)
+
+    @app.get("/wait")
+    def wait_route():
+        started.set()
+        release.wait(10)
+        return _slow_sum(10)
+
+    app.add_middleware(ProfilingMiddleware, token="secret")
+    return app
+
+
+def _client() -> TestClient:
+    return TestClient(_app())
+
+
+def test_profile_header():
+    response = _client().get("/sum?n=1000", headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    assert response.headers["x-profile-status"] == "200"
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "_slow_sum" in response.text
+
+
+def test_profile_query():
+    # The flag is removed before the route sees the query
+    response = _client().get("/sum?n=1000&profile=secret")
+    assert response.headers["x-profile-status"] == "200"
+    assert "_slow_sum" in response.text
+
+
+def test_profile_not_requested():
+    client = _client()
+    assert client.get("/sum?n=10").json() == 45
+    # A wrong token runs the request normally
+    assert client.get("/sum?n=10", headers={"X-Profile": "guess"}).json() == 45
+
+
+def test_profile_concurrent():
+    # Only one request is profiled at a time, others get 409
+    started = threading.Event()
+    release = threading.Event()
+    app = _app(started, release)
+    headers = {"X-Profile": "secret"}
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            first = asyncio.create_task(client.get("/wait", headers=headers))
+            await asyncio.to_thread(started.wait, 10)
+            second = await client.get("/sum?n=10", headers=headers)
+            release.set()
+            first = await first
+            third = await client.get("/sum?n=10", headers=headers)
+            return first, second, third
+
+    first, second, third = asyncio.run(requests())
+    assert first.status_code == 200
+    assert first.headers["x-profile-status"] == "200"
+    assert second.status_code == 409
+    # The lock is released once the profiled request has finished
+    assert third.status_code == 200
+    assert "_slow_sum" in third.text
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sunpy.coordinates import get_earth
+
+from ..main import app
+import response_cache
+from ephemeris import EphemerisCache, set_cache
+from response_cache import POSITION_CACHE_MAX_AGE, ResponseCache, response_cache_info
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(response_cache, "_cache", ResponseCache(16))
+    return TestClient(app)
+
+
+def test_response_cache(client: TestClient):
+    # Different spellings of the same time share an entry
+    response = client.get("/hpc?x=515&y=-342&coord_time=2012-07-05 13:01:46")
+    assert response.status_code == 200
+    assert response_cache_info()["misses"] == 1
+    cached = client.get("/hpc?x=515.0&y=-342&coord_time=2012-07-05T13:01:46Z")
+    assert cached.status_code == 200
+    assert cached.json() == response.json()
+    assert response_cache_info()["hits"] == 1
+    assert response_cache_info()["hit_rate"] == 0.5
+
+    # A different target is a different entry
+    client.get("/hpc?x=515&y=-342&coord_time=2012-07-05 13:01:46&target=2012-07-06")
+    assert response_cache_info()["size"] == 2
+
+    # Same for /hgs2hpc, which is cached separately
+    client.get("/hgs2hpc?lat=0&lon=0&coord_time=2012-07-05 13:01:46")
+    client.get("/hgs2hpc?lat=0&lon=0&coord_time=2012-07-05T13:01:46")
+    assert response_cache_info()["hits"] == 2
+    assert response_cache_info()["size"] == 3
+
+
+def test_etag(client: TestClient):
+    response = client.get("/hgs2hpc?lat=10&lon=10&coord_time=2012-07-05 13:01:46")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
+    response = client.get(
+        "/hgs2hpc?lat=10&lon=10&coord_time=2012-07-05 13:01:46",
+        headers={"If-None-Match": f'"other", {etag}'},
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    # ETag depends on the response
+    response = client.get(
+        "/hgs2hpc?lat=20&lon=10&coord_time=2012-07-05 13:01:46",
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_errors_not_cached(client: TestClient):
+    response = client.get(
+        "/position/SDO?start=2025-01-02 00:00:00&stop=2025-01-01 00:00:00"
+    )
+    assert response.status_code == 422
+    assert response_cache_info()["size"] == 0
+
+
+def test_position_max_age(client: TestClient, tmp_path, monkeypatch):
+    # Positions depend on JPL Horizons, so they are cached for a shorter time
+    set_cache(EphemerisCache(str(tmp_path), lambda name, times: get_earth(times)))
+    try:
+        url = "/position/SDO?start=2025-01-01 00:00:00&stop=2025-01-01 01:00:00"
+        response = client.get(url)
+        assert response.headers["cache-control"] == (
+            f"public, max-age={POSITION_CACHE_MAX_AGE}"
+        )
+        body = {
+            "observatories": ["SDO"],
+            "start": "2025-01-01 00:00:00",
+            "stop": "2025-01-01 01:00:00",
+        }
+        response = client.post("/positions", json=body)
+        assert response.headers["cache-control"] == (
+            f"public, max-age={POSITION_CACHE_MAX_AGE}"
+        )
+        assert response_cache_info()["size"] == 2
+        client.get(url)
+        assert response_cache_info()["hits"] == 1
+
+        # Entries are dropped once they expire
+        now = time.monotonic()
+        monkeypatch.setattr(
+            response_cache.time, "monotonic", lambda: now + POSITION_CACHE_MAX_AGE
+        )
+        client.get(url)
+        assert response_cache_info()["hits"] == 1
+    finally:
+        set_cache(None)
+
+
+def test_ttl():
+    cache = ResponseCache(2)
+    cache.put("a", (b"a", "1"), ttl=0)
+    cache.put("b", (b"b", "2"))
+    assert cache.get("a") is None
+    assert cache.get("b") == (b"b", "2")
+    assert cache.info()["size"] == 1
+
+
+def test_lru():
+    cache = ResponseCache(2)
+    cache.put("a", (b"a", "1"))
+    cache.put("b", (b"b", "2"))
+    assert cache.get("a") == (b"a", "1")
+    # b is the least recently used entry
+    cache.put("c", (b"c", "3"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.info() == {
+        "hits": 3,
+        "misses": 1,
+        "hit_rate": 0.75,
+        "size": 2,
+        "maxsize": 2,
+    }
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from astropy.time import Time
+import astropy.units as u
+
+import frames
+import rotation
+from hgs2hpc import hgs2hpc_columns
+from normalizer import normalize_hpc_columns
+
+
+@pytest.mark.parametrize("target", ["2020-01-01 00:00:00", "1985-06-01 00:00:00"])
+def test_normalize_hpc_numpy(monkeypatch, target):
+    # The numpy engine matches sunpy for on and off disk points, both with
+    # the earth table (2020) and without it (1985)
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 1000)
+    rng = np.random.default_rng(2)
+    target = Time(target)
+    coord_times = target - rng.uniform(-48, 48, 200) * u.hour
+    xs = rng.uniform(-1500, 1500, 200)
+    ys = rng.uniform(-1500, 1500, 200)
+    expected = normalize_hpc_columns(xs, ys, coord_times, target, "sunpy")
+    actual = normalize_hpc_columns(xs, ys, coord_times, target, "numpy")
+    assert np.allclose(actual[0], expected[0], rtol=0, atol=1e-3)
+    assert np.allclose(actual[1], expected[1], rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize("target", ["2020-01-01 00:00:00", "1985-06-01 00:00:00"])
+def test_hgs2hpc_numpy(monkeypatch, target):
+    monkeypatch.setattr(frames, "TIME_GROUP_MIN_SIZE", 1000)
+    rng = np.random.default_rng(3)
+    target = Time(target)
+    coord_times = target - rng.uniform(-48, 48, 200) * u.hour
+    lats = rng.uniform(-80, 80, 200)
+    lons = rng.uniform(-180, 180, 200)
+    expected = hgs2hpc_columns(lats, lons, coord_times, target, "sunpy")
+    actual = hgs2hpc_columns(lats, lons, coord_times, target, "numpy")
+    assert np.allclose(actual[0], expected[0], rtol=0, atol=1e-3)
+    assert np.allclose(actual[1], expected[1], rtol=0, atol=1e-3)
+
+
+def test_resolve_engine(monkeypatch):
+    monkeypatch.setattr(rotation, "DEFAULT_ENGINE", "numpy")
+    assert rotation.resolve_engine(None) == "numpy"
+    assert rotation.resolve_engine("sunpy") == "sunpy"
@@ -0,0 +1,208 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from ..main import app
+import streaming
+from streaming import NDJSON_MEDIA_TYPE
+
+TARGET = "2012-07-05 13:01:46"
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def post_ndjson(client: TestClient, path: str, lines, **params):
+    # Body is sent in small pieces which don't line up with the lines
+    body = "".join(line + "\n" for line in lines).encode()
+    pieces = (body[i : i + 7] for i in range(0, len(body), 7))  # noqa: E203
+    return client.post(
+        path,
+        params=params,
+        content=pieces,
+        headers={"Content-Type": NDJSON_MEDIA_TYPE},
+    )
+
+
+def read_ndjson(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_hpc_stream(client: TestClient, monkeypatch):
+    # Streamed results match the batch endpoint, across several chunks
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_SIZE", 3)
+    coordinates = [
+        {"x": 100.0 * i - 500, "y": 50.0 * i, "coord_time": f"2012-07-05 {i:02d}:00:00"}
+        for i in range(10)
+    ]
+    response = post_ndjson(
+        client, "/hpc/stream", [json.dumps(c) for c in coordinates], target=TARGET
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == NDJSON_MEDIA_TYPE
+    expected = client.post("/hpc", json={"coordinates": coordinates, "target": TARGET})
+    assert read_ndjson(response) == expected.json()["coordinates"]
+
+
+def test_hgs2hpc_stream(client: TestClient):
+    coordinates = [
+        {"lat": 10.0, "lon": -20.0, "coord_time": "2012-01-01T00:00:00Z"},
+        {"lat": -45.0, "lon": 60.0, "coord_time": "2012-01-01 06:00:00"},
+    ]
+    response = post_ndjson(
+        client,
+        "/hgs2hpc/stream",
+        [json.dumps(c) for c in coordinates],
+        target=TARGET,
+        engine="numpy",
+    )
+    assert response.status_code == 200
+    expected = client.post(
+        "/hgs2hpc",
+        json={"coordinates": coordinates, "target": TARGET, "engine": "numpy"},
+    )
+    assert read_ndjson(response) == expected.json()["coordinates"]
+
+
+def test_gse2frame_stream(client: TestClient):
+    coordinates = [
+        {"x": 16856.9645, "y": 32613.5430, "z": -20740.0146, "time": TARGET},
+        {"x": 0.0, "y": 0.0, "z": 0.0, "time": "2024-01-02 00:00:00"},
+        # Each time keeps its own format
+        {"x": 1.0, "y": 0.0, "z": 0.0, "time": "2024-01-03T00:00:00"},
+    ]
+    response = post_ndjson(
+        client, "/gse2frame/stream", [json.dumps(c) for c in coordinates]
+    )
+    assert response.status_code == 200
+    expected = client.post("/gse2frame", json={"coordinates": coordinates})
+    assert read_ndjson(response) == expected.json()["coordinates"]
+
+
+def test_stream_errors(client: TestClient, monkeypatch):
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_SIZE", 2)
+    lines = [
+        '{"x": 515, "y": -342, "coord_time": "2012-07-05 13:01:46"}',
+        '{"x": "a"}',
+        "",
+        "not json",
+        '{"x": 0, "y": 0, "coord_time": "2012-13-45 00:00:00"}',
+        '{"x": 0, "y": 0, "coord_time": "2012-07-05 13:01:46"}',
+    ]
+    response = post_ndjson(client, "/hpc/stream", lines, target=TARGET)
+    assert response.status_code == 200
+    results = read_ndjson(response)
+    # One result per non blank line, in order
+    assert len(results) == 5
+    assert pytest.approx(results[0]["x"]) == 523.6178
+    assert [r.get("line") for r in results[1:4]] == [2, 4, 5]
+    assert "2012-13-45" in results[3]["error"]
+    assert pytest.approx(results[4]["x"], abs=1) == 0
+
+    # Missing target
+    response = post_ndjson(client, "/hpc/stream", lines)
+    assert response.status_code == 422
+
+
+def test_stream_long_lines(client: TestClient, monkeypatch):
+    # Lines over STREAM_MAX_LINE_BYTES are answered with an error
+    monkeypatch.setattr(streaming, "STREAM_MAX_LINE_BYTES", 100)
+    valid = '{"x": 515, "y": -342, "coord_time": "2012-07-05 13:01:46"}'
+    long = '{"x": 515, "y": -342, "coord_time": "2012-07-05 13:01:46"' + " " * 200 + "}"
+    lines = [valid, long, valid, long]
+    response = post_ndjson(client, "/hpc/stream", lines, target=TARGET)
+    assert response.status_code == 200
+    results = read_ndjson(response)
+    assert len(results) == 4
+    assert [r.get("line") for r in results] == [None, 2, None, 4]
+    assert "longer than 100 bytes" in results[1]["error"]
+    assert pytest.approx(results[2]["x"]) == 523.6178
+
+    # Same when the whole body arrives at once, without a final newline
+    response = client.post(
+        "/hpc/stream",
+        params={"target": TARGET},
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": NDJSON_MEDIA_TYPE},
+    )
+    assert [r.get("line") for r in read_ndjson(response)] == [None, 2, None, 4]
+
+
+def stream_request(pieces):
+    """
+    Returns an NDJSON request whose body arrives in the given pieces, a
+    piece of None is an http.disconnect
+    """
+    messages = [
+        (
+            {"type": "http.disconnect"}
+            if piece is None
+            else {"type": "http.request", "body": piece, "more_body": True}
+        )
+        for piece in pieces
+    ]
+    if pieces[-1] is not None:
+        messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    return Request({"type": "http", "method": "POST", "headers": []}, receive)
+
+
+def run_stream(pieces, transform):
+    """
+    Streams the request through NdjsonResponse and returns the body sent
+    """
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    response = streaming.stream_ndjson(stream_request(pieces), Row, transform)
+    asyncio.run(response(response, None, send))
+    return b"".join(
+        m.get("body", b"") for m in sent if m["type"] == "http.response.body"
+    )
+
+
+class Row(BaseModel):
+    value: float
+
+
+def test_stream_transform_raises(monkeypatch):
+    # Rows the transform fails on with any exception are answered with an
+    # error, the others are still transformed
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_SIZE", 10)
+
+    def transform(rows):
+        if any(row.value < 0 for row in rows):
+            raise ZeroDivisionError("negative")
+        return [{"value": row.value * 2} for row in rows]
+
+    body = run_stream([b'{"value": 1}\n{"value": -1}\n{"value": 2}\n'], transform)
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {"value": 2},
+        {"line": 2, "error": "ZeroDivisionError: negative"},
+        {"value": 4},
+    ]
+
+
+def test_stream_disconnect(monkeypatch):
+    # Once the client goes away, the rest of the body isn't transformed
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_SIZE", 1)
+    transformed = []
+
+    def transform(rows):
+        transformed.extend(rows)
+        return [{"value": row.value} for row in rows]
+
+    body = run_stream([b'{"value": 1}\n', None, b'{"value": 2}\n'], transform)
+    assert [row.value for row in transformed] == [1]
+    assert body.splitlines() == [b'{"value": 1.0}']
@@ -0,0 +1,62 @@
+import pytest
+from astropy.time import Time
+
+from validation import make_times, check_time, check_columns, time_formats
+
+
+def test_make_times():
+    values = [
+        "2012-07-05 13:01:46",
+        "2012-07-05T13:01:46Z",
+        "2012-07-05",
+        "2012-07-05 13:01",
+        "2012-07-05T13:01:46.123",
+    ]
+    times = make_times(values)
+    assert len(times) == len(values)
+    for time, value in zip(times, values):
+        assert time == Time(value)
+
+    # Format matches the format a single value would be parsed with
+    assert make_times(["2012-07-05T13:01:46"]).format == "isot"
+    assert make_times(["2012-07-05 13:01:46"]).format == "iso"
+
+    # Non ISO values are parsed one at a time
+    times = make_times(["2012-07-05 13:01:46", "2012:187:13:01:46"])
+    assert times[1] == Time("2012:187:13:01:46")
+
+    assert len(make_times([])) == 0
+
+
+def test_time_formats():
+    values = [
+        "2012-07-05 13:01:46",
+        "2012-07-05T13:01:46Z",
+        "2012-07-05",
+        "2012:187:13:01:46",
+    ]
+    assert time_formats(values) == [Time(value).format for value in values]
+    # Mixed values are parsed into one format, time_formats keeps each one
+    assert make_times(values[:2]).format == "iso"
+    assert time_formats(values[:2]) == ["iso", "isot"]
+
+
+def test_make_times_errors():
+    with pytest.raises(ValueError, match="index 2"):
+        make_times(["2012-07-05", "2012-07-06", "2012-13-45 00:00:00"])
+    with pytest.raises(ValueError, match="index 1"):
+        make_times(["2012-07-05", "NotATime"])
+
+
+def test_check_time():
+    assert check_time("2012-07-05 13:01:46") == "2012-07-05 13:01:46"
+    assert check_time("2012:187:13:01:46") == "2012:187:13:01:46"
+    with pytest.raises(ValueError):
+        check_time("NotATime")
+
+
+def test_check_columns():
+    check_columns(x=[1, 2], y=[3, 4])
+    check_columns()
+    with pytest.raises(ValueError, match="same length"):
+        check_columns(x=[1, 2], y=[3])
@@ -2,9 +2,18 @@
 Contains validation related functions
 """
 
+import re
+from typing import List, Sized
+
 from typing_extensions import Annotated
 from astropy.time import Time
-from pydantic import AfterValidator, BaseModel, ConfigDict
+from pydantic import AfterValidator, BaseModel, ConfigDict, model_validator
+
+from metrics import stage
+
+# Matches ISO 8601 style times (Y-m-d, Y-m-d H:M, Y-m-d H:M:S, Y-m-dTH:M:S.f, ...)
+# which can be parsed in bulk.
+ISO_TIME = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d*)?)?)?Z?$")
 
 
 # This function is used by Pydantic to verify the user input
@@ -26,6 +35,99 @@ def make_time(value: str) -> Time:
 AstropyTime = Annotated[str, AfterValidator(make_time)]
 
 
+def check_time(value: str) -> str:
+    """
+    Returns the given string unchanged or raises a ValueError if it can't be
+    converted to an astropy time. ISO formatted strings are only checked
+    against ISO_TIME, they are fully parsed later by make_times.
+
+    Parameters
+    ----------
+    value: str
+        Value to check
+    """
+    if ISO_TIME.match(value) is None:
+        make_time(value)
+    return value
+
+
+# Custom validation type for time columns in batch requests. The value
+# stays a string so the whole column can be parsed at once with make_times.
+TimeString = Annotated[str, AfterValidator(check_time)]
+
+
+@stage("parse_times")
+def make_times(values: List[str]) -> Time:
+    """
+    Parses a list of time strings into a single array valued astropy Time.
+    When every value is ISO formatted, all values are parsed in one
+    vectorized call. Raises a ValueError naming the index of the first
+    value that can't be converted.
+
+    Parameters
+    ----------
+    values: List[str]
+        Values to cast to an astropy time.
+    """
+    if all(ISO_TIME.match(value) for value in values):
+        try:
+            times = Time(
+                [value.replace("T", " ").rstrip("Z") for value in values],
+                format="iso",
+            )
+            # Keep the format the values would have been given on their own
+            # when they all use the same one, see time_formats for the rest
+            if values and all("T" in value for value in values):
+                times.format = "isot"
+            return times
+        except ValueError:
+            # Fall through to find the value which failed
+            pass
+
+    times = []
+    for index, value in enumerate(values):
+        try:
+            times.append(make_time(value))
+        except ValueError as e:
+            raise ValueError(f"Invalid time at index {index}: {value}") from e
+    return Time(times)
+
+
+def time_formats(values: List[str]) -> List[str]:
+    """
+    Returns the format which make_time gives each value on its own, i.e.
+    "isot" or "iso" for ISO formatted values. make_times returns a single
+    array valued Time, which only has one format, so routes that echo times
+    back use this to format each value like its input.
+
+    Parameters
+    ----------
+    values: List[str]
+        Time strings
+    """
+    formats = []
+    for value in values:
+        if ISO_TIME.match(value):
+            formats.append("isot" if "T" in value else "iso")
+        else:
+            formats.append(make_time(value).format)
+    return formats
+
+
+def check_columns(**columns: Sized):
+    """
+    Raises a ValueError if the given columns don't all have the same length
+
+    Parameters
+    ----------
+    columns: Sized
+        Columns of a column based request, keyed by field name
+    """
+    lengths = {name: len(column) for name, column in columns.items()}
+    if len(set(lengths.values())) > 1:
+        raise ValueError(f"Columns must all have the same length, got {lengths}")
+
+
 class HvBaseModel(BaseModel):
     """
     Base pydantic model to use for type checking
@@ -34,3 +136,18 @@ class HvBaseModel(BaseModel):
     # Disable sending extra fields, only fields in
     # the model are allowed
     model_config = ConfigDict(extra="forbid")
+
+
+class HvRequestModel(HvBaseModel):
+    """
+    Base model for request parameters and bodies. Records the time spent
+    validating the request as the "validation" stage, see metrics.py.
+    Nested models should use HvBaseModel, a Python validator on every item
+    of a large batch makes validation much slower.
+    """
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _timed(cls, data, handler):
+        with stage("validation"):
+            return handler(data)
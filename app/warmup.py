@@ -0,0 +1,47 @@
+"""
+Startup warm-up.
+
+The first transform after startup is much slower than later ones. It
+imports sunpy.physics.differential_rotation, finds and caches paths through
+astropy's frame transform graph, computes the first frames and loads the
+earth table. warm_up makes one small call on each transform path so this
+happens before the server reports ready (see health.py) instead of during
+the first requests.
+"""
+
+import os
+
+import numpy as np
+from astropy.time import Time
+
+import pool
+from ephemeris import get_cache
+from hgs2hpc import hgs2hpc, hgs2hpc_columns
+from normalizer import (
+    gse_frame_arrays,
+    normalize_hpc,
+    normalize_hpc_columns,
+)
+
+# Set to 0 to skip the warm-up on startup
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") == "1"
+
+
+def warm_up():
+    """
+    Runs a representative call for each transform path
+    """
+    target = Time("2024-01-02")
+    coord_times = Time(["2024-01-01", "2024-01-01 12:00:00"])
+    xs = np.array([515.0, 1200.0])
+    ys = np.array([-342.0, 300.0])
+
+    normalize_hpc(xs[0], ys[0], coord_times[0], target)
+    hgs2hpc(9, 9, coord_times[0], target)
+    for engine in ("sunpy", "numpy"):
+        normalize_hpc_columns(xs, ys, coord_times, target, engine)
+        hgs2hpc_columns([9, -20], [9, 40], coord_times, target, engine)
+    gse_frame_arrays(xs, ys, xs, coord_times)
+    get_cache()
+    if pool.POOL_WORKERS > 1:
+        pool.get_pool()